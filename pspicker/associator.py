@@ -1,17 +1,14 @@
 # import warnings
-import itertools
 
 import numpy as np
-from scipy.cluster.hierarchy import fclusterdata
-from obspy.taup import TauPyModel
-from obspy.taup.taup_create import build_taup_model
-from obspy.taup.tau_model import TauModel
 from obspy.core import UTCDateTime
 # from obspy.core.event.origin import Pick
 
 from .utils import picks_matched_stations
 from .logger import log
 from .pick_candidate import PickCandidate
+from .delay_table import DelayTable
+from .travel_time_grid import TravelTimeGrid
 
 
 class Associator():
@@ -27,15 +24,19 @@ class Associator():
     # default_delays = {'op': [0, 19.17, 76.27, 144.90, 370.27, 781.35],
     #                   'ps': [0, 13.92, 59.63, 114.2, 300.00, 654.43]}
 
-    def __init__(self, params, vel_model=None, target_depth=10., max_offset=1.,
-                 verbose=True, debug=False):
+    def __init__(self, params, vel_model=None, target_depth=None,
+                 max_offset=None, verbose=True, debug=False,
+                 delay_cache_dir=None):
         """
         :param params: AssociatorParameters object
         :param vel_model: velocity model (obspy taup valid string or the
-            absolute path name of a .nd file)
-        :param target_depth: event depth to use to construct travel-time tables
+            absolute path name of a .nd file).  None: params.velocity_model
+        :param target_depth: event depth to use to construct travel-time
+            tables.  None: params.target_depth
         :param max_offset: maximum offset(degrees) for which to calculate
-            travel_times
+            travel_times.  None: params.max_offset
+        :param delay_cache_dir: directory of cached delay tables (None:
+            delay_table.default_cache_dir())
 
         The nd file format allows c-style comment lines, depth-parameter lines
         and named discontinuity lines.
@@ -65,13 +66,36 @@ class Associator():
         self.ps_cluster = {}   # a dictionary with key=station and value=stime
         self.o_cluster = {}   # a dictionary with key=station and value=otime
         self.delays = None
+        self.delay_cache_dir = delay_cache_dir
+        if vel_model is None:
+            vel_model = getattr(params, 'velocity_model', None)
+        if target_depth is None:
+            target_depth = getattr(params, 'target_depth', 10.)
+        if max_offset is None:
+            max_offset = getattr(params, 'max_offset', 1.)
         if vel_model is not None:
             try:
-                self.delays = self._get_delays(vel_model, target_depth,
-                                               max_offset)
-            except Exception:
-                log("Couldn't generate ps delays using '" + vel_model
-                    + "', using default", "warning")
+                self.delays = self._get_origtime_delays(vel_model,
+                                                        target_depth,
+                                                        max_offset)
+            except Exception as err:
+                log(f"Couldn't generate ps delays using '{vel_model}' "
+                    f"({err}), using default", "warning")
+        self.grid = None
+        self.hypocenter = None
+        self.location_tolerance = getattr(params, 'location_tolerance', 0.5)
+        if self.method == 'location':
+            try:
+                self.grid = TravelTimeGrid.from_stationxml(
+                    params.station_file,
+                    vel_model if vel_model is not None else 'iasp91',
+                    spacing=params.grid_spacing, margin=params.grid_margin,
+                    depths=params.grid_depths, cache_dir=delay_cache_dir)
+            except Exception as err:
+                log(f"Couldn't make a travel-time grid for "
+                    f"'{params.station_file}' ({err}), associating by "
+                    "origin time", "warning")
+                self.method = 'origin_time'
         self.verbose = verbose
         self.debug = debug
         self.min_clust = 3  # minimum number of values in a "cluster"
@@ -80,18 +104,22 @@ class Associator():
         """
         Run associator
 
-        Tries to associate by origin time, if that doesn't work associates by
-        pick clustering
+        Tries to associate by location (if method == 'location') or origin
+        time, if that doesn't work associates by pick clustering
         :param picks: list of preferred picks
         :param candidates: all pick candidates (including preferred picks)
-
-        Future upgrade: associate by position (requires velocity model and
-        station positions)
         """
         picks = PickCandidate.remove_duplicates(picks)
         input_picks = picks.copy()
         method = self.method
-        assert method in ['origin_time', 'arrival_time']
+        assert method in ['origin_time', 'arrival_time', 'location']
+        self.hypocenter = None
+        if method == 'location':
+            assoc_str = 'location'
+            picks, associated = self.find_same_location(picks, candidates)
+            if not associated:
+                log('Could not associate by location', 'verbose')
+                method = 'origin_time'
         if method == 'origin_time':
             assoc_str = 'origin times'
             picks, associated = self.find_same_origin_time(picks, candidates)
@@ -137,7 +165,7 @@ class Associator():
         log(s, 'verbose')
         for key in ['rejected', 'modified', 'added']:
             if len(stats[key]) > 1:
-                log(f"{key.upper()}: {stats[key]}", 'debug')
+                log("%s: %s", 'debug', key.upper(), stats[key])
 
     def remove_nonclustered(self, picks):
         """
@@ -168,7 +196,7 @@ class Associator():
         :rtype: list of PickCandidate, bool
         """
         stations = _pick_stations(picks)
-        ots = []
+        p_times, s_times = [], []
         for station in stations:
             station_picks = [x for x in picks
                              if x.station == station]
@@ -176,7 +204,10 @@ class Associator():
             s_pick = [x for x in station_picks if x.phase_guess == "S"]
             if not (len(p_pick) == 1 and len(s_pick) == 1):
                 continue
-            ots.append(self._ps_to_otime(p_pick[0].time, s_pick[0].time))
+            p_times.append(p_pick[0].time)
+            s_times.append(s_pick[0].time)
+        ots = [UTCDateTime(x) for x in self.calc_origin_times(
+            p_times, s_times, self.vp_over_vs, self.delays)]
         if len(ots) < self.min_clust:
             log(f'less than {self.min_clust} P-S calculated origin times'
                 ', cannot associate by this criteria', 'verbose')
@@ -188,106 +219,154 @@ class Associator():
             log('less than {} P-S origin times agree, cannot associate'
                 .format(self.min_clust), 'verbose')
             for p in picks:
-                log(f' {p}', 'debug')
+                log(' %s', 'debug', p)
             return picks, False
         mean_ot = UTCDateTime(np.mean([x.timestamp for x in good_ots]))
         new_picks = self._find_otime_matching(mean_ot, picks, candidates)
         return new_picks, True
 
+    def find_same_location(self, picks, candidates):
+        """
+        Select picks by grid-search location
+
+        Searches the travel-time grid for the hypocentre and origin time
+        that explain the most candidates as P or S arrivals.  Candidates
+        within location_tolerance of the predicted times become the picks.
+        Picks on stations that are not in the grid are kept.
+
+        :param picks: list of PickCandidates pre-selected as P and S picks
+        :candidates: list of all PickCandidates
+
+        :returns: list of picks, whether associator worked
+        :rtype: list of PickCandidate, bool
+        """
+        located = [x for x in candidates
+                   if self.grid.station_index(x.station) is not None]
+        if len(_pick_stations(located)) < self.min_clust:
+            log(f'less than {self.min_clust} stations with coordinates, '
+                'cannot associate by location', 'verbose')
+            return picks, False
+        result = self.grid.search(
+            _timestamps([x.time for x in located]),
+            [self.grid.station_index(x.station) for x in located],
+            self.location_tolerance)
+        matched = [(located[i], phase, resid)
+                   for i, phase, resid in result['phases']]
+        if len(_pick_stations([x[0] for x in matched])) < self.min_clust:
+            log(f'less than {self.min_clust} stations fit a location, '
+                'cannot associate', 'verbose')
+            return picks, False
+        ot = UTCDateTime(result['origin_time'])
+        lat, lon, depth = self.grid.hypocenter(result['node'])
+        self.hypocenter = {'latitude': lat, 'longitude': lon,
+                           'depth': depth, 'time': ot,
+                           'n_phases': result['n_phases']}
+        log(f'Grid location: {lat:.3f}, {lon:.3f}, {depth:g} km, {ot}, '
+            f'{result["n_phases"]:d} phases', 'verbose')
+        new_picks = [x for x in picks
+                     if self.grid.station_index(x.station) is None]
+        self.o_cluster = {}
+        for cand, phase, resid in matched:
+            cand.phase_guess = phase
+            new_picks.append(cand)
+            self.o_cluster[cand.station] = ot + resid
+        return new_picks, True
+
     def _find_otime_matching(self, ot, picks, candidates):
         """
         Return picks or candidates whose P-S delay matches the origin time
 
+        The origin times of all of a station's candidate pairs are
+        calculated at once, on arrays of timestamps
+
         :param ot: desired origin time
         :param picks: list of preferred PickCandidates
         :param candidates: list of all PickCandidates
         :returns: new list of preferred PickCandidates
         """
         otime_margin = self.cluster_window_otime / 2.
+        ot = _timestamps([ot])[0]
         stations_c = _pick_stations(candidates)
         # Error check
         for sta in _pick_stations(picks):
             if sta not in stations_c:
                 raise ValueError(f"picked station {sta} not in candidates")
+        station_candidates = {}
+        for x in candidates:
+            station_candidates.setdefault(x.station, []).append(x)
 
         new_picks = []
         self.o_cluster = {}
         for station in stations_c:
-            sta_candidates = [x for x in candidates if x.station == station]
+            sta_candidates = station_candidates[station]
+            times = _timestamps([x.time for x in sta_candidates])
             p_existing, s_existing = self._get_existing(picks, station)
 
             # If we have a P and an S candidate that match ot, keep them
             if s_existing is not None and p_existing is not None:
-                # log(f'{station}: s_existing and p_existing', 'debug')
                 otime = self._ps_to_otime(p_existing.time, s_existing.time)
-                if np.abs(otime - ot) < otime_margin:
+                if np.abs(otime.timestamp - ot) < otime_margin:
                     new_picks.extend([p_existing, s_existing])
                     self.o_cluster[station] = otime
                     continue
             # Otherwise, if a P cand matches another cand's ot, keep them
             if p_existing is not None:
-                # log(f'{station}: p_existing top', 'debug')
-                # log(p_existing, 'debug')
-                cands = [x for x in sta_candidates if not x == p_existing]
-                if len(cands) > 0:
-                    otimes = [self._ps_to_otime(p_existing.time, x.time)
-                              for x in cands]
-                    offsets = [np.abs(x - ot) for x in otimes]
-                    if np.min(offsets) < otime_margin:
-                        s_candidate = cands[np.argmin(offsets)]
+                i_cands = [i for i, x in enumerate(sta_candidates)
+                           if not x == p_existing]
+                if len(i_cands) > 0:
+                    otimes = self._ps_to_otimes(
+                        np.full(len(i_cands), p_existing.time.timestamp),
+                        times[i_cands])
+                    offsets = np.abs(otimes - ot)
+                    best = np.argmin(offsets)
+                    if offsets[best] < otime_margin:
+                        s_candidate = sta_candidates[i_cands[best]]
                         s_candidate.phase_guess = 'S'
-                        # log(p_existing, 'debug')
-                        # log(s_candidate, 'debug')
                         new_picks.extend([p_existing, s_candidate])
-                        self.o_cluster[station] = otimes[np.argmin(offsets)]
+                        self.o_cluster[station] = UTCDateTime(otimes[best])
                         continue
             # Otherwise, an S cand that matches with another cand, keep them
             if s_existing is not None:
-                # log(f'{station}: s_existing top', 'debug')
-                cands = [x for x in sta_candidates if not x == s_existing]
-                if len(cands) > 0:
-                    otimes = [self._ps_to_otime(x.time, s_existing.time)
-                              for x in cands]
-                    offsets = [np.abs(x - ot) for x in otimes]
-                    if np.min(offsets) < otime_margin:
-                        p_candidate = cands[np.argmin(offsets)]
+                i_cands = [i for i, x in enumerate(sta_candidates)
+                           if not x == s_existing]
+                if len(i_cands) > 0:
+                    otimes = self._ps_to_otimes(
+                        times[i_cands],
+                        np.full(len(i_cands), s_existing.time.timestamp))
+                    offsets = np.abs(otimes - ot)
+                    best = np.argmin(offsets)
+                    if offsets[best] < otime_margin:
+                        p_candidate = sta_candidates[i_cands[best]]
                         p_candidate.phase_guess = 'P'
                         new_picks.extend([p_candidate, s_existing])
-                        self.o_cluster[station] = otimes[np.argmin(offsets)]
+                        self.o_cluster[station] = UTCDateTime(otimes[best])
                         continue
             # Otherwise, if any combination of cands matches ot, keep them
-            if sta_candidates is not None:
-                # log(f'{station}: neither s_existing nor p_existing', 'debug')
-                sort_cands = sorted(sta_candidates, key=lambda x: x.time)
-                min_offset = otime_margin
-                new_p, new_s = None, None
-                for p_maybe, s_maybe in itertools.combinations(sort_cands, 2):
-                    otime = self._ps_to_otime(p_maybe.time, s_maybe.time)
-                    offset = np.abs(otime - ot)
-                    if offset < min_offset:
-                        new_p = p_maybe
-                        new_s = s_maybe
-                        new_otime = otime
-                        min_offset = offset
-                if new_p is not None:
+            # (pairs in itertools.combinations() order of the time-sorted
+            # candidates, so that the first best pair is the same)
+            order = np.argsort(times, kind='stable')
+            i_p, i_s = np.triu_indices(len(order), 1)
+            i_p, i_s = order[i_p], order[i_s]
+            if len(i_p) > 0:
+                otimes = self._ps_to_otimes(times[i_p], times[i_s])
+                offsets = np.abs(otimes - ot)
+                best = np.argmin(offsets)
+                if offsets[best] < otime_margin:
+                    new_p = sta_candidates[i_p[best]]
+                    new_s = sta_candidates[i_s[best]]
                     new_p.phase_guess = 'P'
                     new_s.phase_guess = 'S'
                     new_picks.extend([new_p, new_s])
-                    self.o_cluster[station] = new_otime
+                    self.o_cluster[station] = UTCDateTime(otimes[best])
                     continue
             # Otherwise, keep a solitary P or S pick
             # (if I used station positions, I could compare times here)
             if p_existing is not None and s_existing is None:
-                # log(f'{station}: p_existing bottom', 'debug')
                 assert isinstance(p_existing, PickCandidate)
                 new_picks.append(p_existing)
             elif p_existing is None and s_existing is not None:
-                # log(f'{station}: s_existing bottom', 'debug')
                 assert isinstance(s_existing, PickCandidate)
                 new_picks.append(s_existing)
-        # log('about to test for duplicates', 'debug')
-        # new_picks = PickCandidate.remove_duplicates(new_picks)
-        # log('just tested for duplicates', 'debug')
         return new_picks
 
     @staticmethod
@@ -315,13 +394,13 @@ class Associator():
         p_picks = [p for p in picks if p.phase_guess == 'P']
         if len(p_picks) >= self.distri_min_values:
             p_picks = self._cluster_clean_picks('P'. p_picks)
-            log(f'clustered p_picks = {p_picks}', 'debug')
+            log('clustered p_picks = %s', 'debug', p_picks)
             self.p_cluster = {x.station: x.time for x in p_picks}
 
         s_picks = [p for p in picks if p.phase_guess == 'S']
         if len(s_picks) >= self.distri_min_values:
             s_picks = self._cluster_clean_picks('S', s_picks)
-            log(f'clustered s_picks = {s_picks}', 'debug')
+            log('clustered s_picks = %s', 'debug', s_picks)
             self.p_cluster = {x.station: x.time for x in s_picks}
 
         return p_picks + s_picks
@@ -372,28 +451,13 @@ class Associator():
             which to calculate delats
         :returns: dict with keys 'op' and 'ps' corresponding to sorted lists
             of delay times from origin-to-p and p-to-s
+
+        The delays are read from the delay table cache, or calculated and
+        added to it (see DelayTable.from_model())
         """
-        try:
-            model = TauPyModel(model=vel_mod)
-        except Exception:
-            build_taup_model(vel_mod)   # converts from np or tvel to npz
-            model = TauModel.from_file(vel_mod)  # reads npz
-        delays = {'op': [0], 'ps': [0]}
-        # ps_delays, p_delays = [0], [0]
-        step = max_dist / num_vals
-        for distance in np.arange(step, max_dist + .001, step):
-            arrivals = model.get_travel_times(target_depth, distance,
-                                              phase_list=["P", "S"])
-            p_delay = [x.time for x in arrivals if x.phase == "P"]
-            s_delay = [x.time for x in arrivals if x.phase == "S"]
-            ps_delay = s_delay - p_delay
-            if len(ps_delay) == 1 and len(p_delay) == 1:
-                delays['ps'].append(ps_delay[0])
-                delays['op'].append(p_delay[0])
-            else:
-                log('Could not calculate delays for dist={:.2g} degrees'
-                    .format(distance), 'warning')
-        return delays
+        table = DelayTable.from_model(vel_mod, max_dist, num_vals,
+                                      [target_depth], self.delay_cache_dir)
+        return table.delays(target_depth)
 
     def _ps_to_otime(self, p_time, s_time):
         """
@@ -405,6 +469,13 @@ class Associator():
         return self.calc_origin_time(p_time, s_time, self.vp_over_vs,
                                      self.delays)
 
+    def _ps_to_otimes(self, p_times, s_times):
+        """
+        Calculate origin times given arrays of P and S arrival timestamps
+        """
+        return self.calc_origin_times(p_times, s_times, self.vp_over_vs,
+                                      self.delays)
+
     @staticmethod
     def calc_origin_time(p_time, s_time, vpvs=1.65, delays_model=None):
         """
@@ -428,6 +499,28 @@ class Associator():
             origin_time -= (s_time - p_time) / (vpvs - 1)
         return origin_time
 
+    @staticmethod
+    def calc_origin_times(p_times, s_times, vpvs=1.65, delays_model=None):
+        """
+        Calculate the origin times of arrays of P and S arrival times
+
+        Vectorized version of calc_origin_time()
+
+        :param p_times: P arrival times (UTCDateTimes or timestamps)
+        :param s_times: S arrival times (UTCDateTimes or timestamps)
+        :param vpvs: Vp/Vs ratio, to be used if delays_model == None
+        :param delays_model: dict with keys='op' and 'ps', each with an
+            equal-length sorted list of origin-to-P and P-to-S delays
+        :returns: origin times (timestamps)
+        :rtype: numpy.ndarray
+        """
+        p_times = _timestamps(p_times)
+        ps_delays = _timestamps(s_times) - p_times
+        if delays_model is not None:
+            return p_times - np.interp(ps_delays, delays_model['ps'],
+                                       delays_model['op'])
+        return p_times - ps_delays / (vpvs - 1)
+
     def _cluster_clean_otimes(self, times=None):
         """
         Return indices of origin times fitting in largest cluster
@@ -469,6 +562,7 @@ def cluster_clean_indices(min_clust=None, window_sec=None, times=None):
     elif len(times) == 1:
         return [0]
     else:
+        from scipy.cluster.hierarchy import fclusterdata
         cluster_data = fclusterdata(np.array([[x.timestamp for x in times]]).T,
                                     t=window_sec, criterion='distance')
         cluster_groups = dict()
@@ -519,6 +613,14 @@ def clean_distri(values, n_std=3, mode='median', min_vals=3):
     return x[in_rm], in_rm
 
 
+def _timestamps(times):
+    """Return an array of timestamps from UTCDateTimes or timestamps"""
+    if isinstance(times, np.ndarray) and times.dtype.kind == 'f':
+        return times
+    return np.array([x.timestamp if isinstance(x, UTCDateTime) else x
+                     for x in times], dtype=float)
+
+
 def _pick_stations(picks):
     # log(picks, 'debug')
     return list(set([x.station for x in picks]))
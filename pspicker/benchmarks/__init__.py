@@ -0,0 +1,12 @@
+"""
+Benchmarks of the picker and its components, on synthetic events
+
+Run from the command line with ``python -m pspicker.benchmarks``
+"""
+from .synthetic import SyntheticEvent
+from .benchmark import (run_benchmarks, write_results, compare_results,
+                        results_str, import_time, BENCHMARKS, LAZY_MODULES)
+
+__all__ = ['SyntheticEvent', 'run_benchmarks', 'write_results',
+           'compare_results', 'results_str', 'import_time', 'BENCHMARKS',
+           'LAZY_MODULES']
@@ -0,0 +1,65 @@
+"""
+Command-line benchmark runner
+
+Example, 100 stations with hour-long traces:
+    python -m pspicker.benchmarks --stations 100 --duration 3600 -o bench.json
+"""
+import argparse
+import json
+import sys
+
+from .benchmark import (run_benchmarks, compare_results, results_str,
+                        BENCHMARKS)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='python -m pspicker.benchmarks',
+        description='Time the picker and its components on a synthetic event')
+    parser.add_argument('--stations', type=int, default=10,
+                        help='number of stations (default: %(default)s)')
+    parser.add_argument('--components', type=int, default=3, choices=[3, 4],
+                        help='components per station (default: %(default)s)')
+    parser.add_argument('--sampling-rate', type=float, default=100.,
+                        help='sampling rate in Hz (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=120.,
+                        help='trace length in seconds (default: %(default)s)')
+    parser.add_argument('--noise', type=float, default=1.,
+                        help='noise level (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='random seed (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs per benchmark (default: %(default)s)')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS,
+                        help='benchmarks to run (default: all)')
+    parser.add_argument('-o', '--output',
+                        help='output file (JSON, or CSV if it ends in .csv)')
+    parser.add_argument('--compare',
+                        help='JSON results file to compare to')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative slowdown flagged as a regression '
+                             '(default: %(default)s)')
+    args = parser.parse_args()
+
+    results = run_benchmarks(n_stations=args.stations,
+                             n_components=args.components,
+                             sampling_rate=args.sampling_rate,
+                             duration=args.duration,
+                             noise_level=args.noise,
+                             seed=args.seed,
+                             repeat=args.repeat,
+                             benchmarks=args.only,
+                             output=args.output)
+    print(results_str(results))
+    if args.compare is not None:
+        with open(args.compare) as fp:
+            reference = json.load(fp)
+        report, regressions = compare_results(results, reference,
+                                              args.tolerance)
+        print(report)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+"""
+Time the picker and its main components on synthetic events
+"""
+import csv
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import obspy
+import scipy
+from obspy.core import Stream
+from obspy.core.event.origin import Pick
+from obspy.core.event.base import WaveformStreamID
+
+from ..associator import Associator
+from ..energy_snr import EnergySNR, EnergySNRBatch
+from ..kurtosis import Kurtosis
+from ..local_amplitude import LocalAmplitude
+from ..logger import setup_log
+from ..parameters import PickerParameters
+from ..pick_candidate import PickCandidate
+from ..polarity import Polarity
+from ..pspicker import PSPicker
+from ..version import __version__
+from .synthetic import SyntheticEvent
+
+BENCHMARKS = ['run_one', 'kurtosis', 'polarity', 'energy_snr',
+              'energy_snr_batch', 'associator', 'local_amplitude',
+              'import_pspicker']
+# Modules that are only imported when they are used
+LAZY_MODULES = ['matplotlib', 'obspy.signal', 'obspy.taup', 'scipy.cluster']
+
+
+def run_benchmarks(n_stations=10, n_components=3, sampling_rate=100.,
+                   duration=120., noise_level=1., seed=42, repeat=3,
+                   benchmarks=None, output=None):
+    """
+    Time the picker and its main components on a synthetic event
+
+    Each benchmark is run `repeat` times over all stations (plus one
+    untimed warm-up run) and the minimum, median and mean times are
+    reported.  The benchmarks are:
+        - run_one: PSPicker.run_one()
+        - kurtosis: Kurtosis.pick_trace() on each station's Z trace
+        - polarity: Polarity.calc_dip_rect() at each station's P and S times
+        - energy_snr: EnergySNR() on each station's filtered traces
+        - energy_snr_batch: EnergySNRBatch on all stations' filtered traces,
+          and their trustworthiness
+        - associator: Associator.run() on jittered picks plus false
+          candidates
+        - local_amplitude: LocalAmplitude.get_iaml() on each station
+        - import_pspicker: `import pspicker`, in a new Python process (see
+          import_time())
+
+    :param n_stations: number of stations
+    :param n_components: number of components per station (3 or 4)
+    :param sampling_rate: sampling rate (Hz)
+    :param duration: trace length (seconds)
+    :param noise_level: noise standard deviation
+    :param seed: random number generator seed
+    :param repeat: number of timed runs per benchmark
+    :param benchmarks: list of benchmarks to run (None: all)
+    :param output: file to write the results to: JSON, or CSV if the
+        filename ends in '.csv' (None: don't write)
+    :returns: results dictionary (see write_results())
+    """
+    if benchmarks is None:
+        benchmarks = BENCHMARKS
+    for b in benchmarks:
+        assert b in BENCHMARKS, f'unknown benchmark "{b}"'
+    setup_log('warning')
+    event = SyntheticEvent(n_stations=n_stations, n_components=n_components,
+                           sampling_rate=sampling_rate, duration=duration,
+                           noise_level=noise_level, seed=seed)
+    results = {'metadata': _metadata(),
+               'config': {'n_stations': n_stations,
+                          'n_components': n_components,
+                          'sampling_rate': sampling_rate,
+                          'duration': duration,
+                          'noise_level': noise_level,
+                          'seed': seed,
+                          'repeat': repeat},
+               'results': {}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = event.write_database(tmp_dir)
+        params = PickerParameters.from_yaml_file(files['parm_file'])
+        cases = _Cases(event, params, files)
+        for name in benchmarks:
+            func = getattr(cases, name)
+            func()   # warm-up, and fills caches such as response files
+            times = []
+            for i in range(repeat):
+                start = time.perf_counter()
+                elapsed = func()   # None unless timed by the case itself
+                if elapsed is None:
+                    elapsed = time.perf_counter() - start
+                times.append(elapsed)
+            results['results'][name] = {'times': times,
+                                        'min': min(times),
+                                        'median': float(np.median(times)),
+                                        'mean': float(np.mean(times))}
+    if output is not None:
+        write_results(results, output)
+    return results
+
+
+def import_time(module='pspicker'):
+    """
+    Time importing a module in a new Python process
+
+    Only the import is timed, not the interpreter's startup
+
+    :param module: module to import
+    :returns: import time (seconds), list of LAZY_MODULES that were
+        imported
+    """
+    code = ('import json, sys, time\n'
+            't = time.perf_counter()\n'
+            f'import {module}\n'
+            't = time.perf_counter() - t\n'
+            f'lazy = [m for m in {LAZY_MODULES!r} if m in sys.modules]\n'
+            'print(json.dumps([t, lazy]))\n')
+    env = dict(os.environ)
+    package_parent = str(Path(__file__).resolve().parents[2])
+    env['PYTHONPATH'] = os.pathsep.join(
+        [package_parent] + [x for x in [env.get('PYTHONPATH')] if x])
+    output = subprocess.run([sys.executable, '-c', code], env=env,
+                            check=True, capture_output=True, text=True)
+    elapsed, lazy = json.loads(output.stdout.splitlines()[-1])
+    return elapsed, lazy
+
+
+def write_results(results, filename):
+    """
+    Write benchmark results to a JSON or CSV file
+
+    The JSON file contains the full results dictionary: 'metadata'
+    (versions, platform, date), 'config' (run_benchmarks() arguments) and
+    'results' ({name: {'times', 'min', 'median', 'mean'}}).
+    The CSV file has one line per benchmark, with the config values and
+    the min, median and mean times
+
+    :param results: output from run_benchmarks()
+    :param filename: output file name
+    """
+    if Path(filename).suffix.lower() == '.csv':
+        config = results['config']
+        with open(filename, 'w', newline='') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(['benchmark'] + list(config.keys())
+                            + ['min', 'median', 'mean'])
+            for name, r in results['results'].items():
+                writer.writerow([name] + list(config.values())
+                                + [r['min'], r['median'], r['mean']])
+    else:
+        with open(filename, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+
+def compare_results(results, reference, tolerance=0.2):
+    """
+    Compare benchmark results to reference results
+
+    :param results: results dictionary (from run_benchmarks() or a JSON
+        results file)
+    :param reference: reference results dictionary
+    :param tolerance: relative slowdown (of the minimum time) above which
+        a benchmark is considered a regression
+    :returns: text report, list of regressed benchmarks
+    """
+    lines, regressions = [], []
+    if results['config'] != reference['config']:
+        lines.append('WARNING: configurations differ')
+    for name, r in results['results'].items():
+        if name not in reference['results']:
+            lines.append(f'{name:16s}: {r["min"]:9.4f}s (no reference)')
+            continue
+        ref_min = reference['results'][name]['min']
+        ratio = r['min'] / ref_min
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = ' REGRESSION'
+            regressions.append(name)
+        lines.append(f'{name:16s}: {r["min"]:9.4f}s vs {ref_min:9.4f}s '
+                     f'({ratio:5.2f}x){flag}')
+    return '\n'.join(lines), regressions
+
+
+def results_str(results):
+    """
+    Return a text summary of benchmark results
+    """
+    c = results['config']
+    s = (f"{c['n_stations']:d} stations, {c['n_components']:d} components, "
+         f"{c['sampling_rate']:g} Hz, {c['duration']:g} s, "
+         f"{c['repeat']:d} repeats\n")
+    s += f'{"benchmark":16s}  {"min":>9s}  {"median":>9s}  {"mean":>9s}\n'
+    for name, r in results['results'].items():
+        s += (f'{name:16s}: {r["min"]:9.4f}s {r["median"]:9.4f}s '
+              f'{r["mean"]:9.4f}s\n')
+    return s
+
+
+def _metadata():
+    return {'pspicker': __version__,
+            'obspy': obspy.__version__,
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'date': obspy.UTCDateTime().isoformat()}
+
+
+class _Cases():
+    """
+    Benchmark cases, each a method running over all stations
+
+    Inputs are prepared in advance so that only the benchmarked call is
+    timed
+    """
+    def __init__(self, event, params, files):
+        """
+        :param event: SyntheticEvent
+        :param params: PickerParameters
+        :param files: output from SyntheticEvent.write_database()
+        """
+        self.event = event
+        self.params = params
+        self.files = files
+        self.station_params = params.station_parameters['S*']
+        rng = np.random.default_rng(event.seed)
+        self.streams, self.filtered, self.windows = {}, {}, {}
+        f_min, f_max = self.station_params.SNR_energy.frequency_band
+        for station in event.stations:
+            st = event.stream.select(station=station)
+            self.streams[station] = st
+            self.filtered[station] = Stream(
+                [tr for tr in st if tr.stats.channel[-1] in 'ZNE']
+                ).copy().filter('bandpass', corners=3, freqmin=f_min,
+                                freqmax=f_max)
+            arrivals = event.arrivals[station]
+            self.windows[station] = (arrivals['P'] - 5., arrivals['S'] + 5.)
+        # Jittered P and S picks, plus false candidates
+        self.picks, self.candidates = [], []
+        for station, arrivals in event.arrivals.items():
+            for phase, t in arrivals.items():
+                c = PickCandidate(t + rng.normal(0, 0.05), 'kurtosis', 1.,
+                                  phase_guess=phase, station=station,
+                                  sampling_rate=event.sampling_rate)
+                self.picks.append(c)
+                self.candidates.append(c)
+            for i in range(3):
+                self.candidates.append(PickCandidate(
+                    arrivals['P'] + rng.uniform(-5., 15.), 'kurtosis',
+                    rng.uniform(), station=station,
+                    sampling_rate=event.sampling_rate))
+        net = event.network
+        self.obspy_picks = {s: [_obspy_pick(net, s, 'HHZ', 'P', a['P']),
+                                _obspy_pick(net, s, 'HHN', 'S', a['S'])]
+                            for s, a in event.arrivals.items()}
+
+    def run_one(self):
+        f = self.files
+        picker = PSPicker(f['parm_file'], f['wav_base_path'],
+                          f['database_path_in'], f['database_path_out'])
+        picker.run_one(f['database_filename'], plot_global=False,
+                       plot_stations=False, log_level=None)
+
+    def kurtosis(self):
+        sp = self.station_params
+        for station, st in self.streams.items():
+            k = Kurtosis(sp.kurtosis)
+            k.pick_trace(st.select(component='Z')[0], sp.max_candidates,
+                         *self.windows[station])
+
+    def polarity(self):
+        for station, st in self.filtered.items():
+            pol = Polarity(st, self.params.polarity)
+            pol.calc_dip_rect(list(self.event.arrivals[station].values()))
+
+    def energy_snr(self):
+        for st in self.filtered.values():
+            EnergySNR(st, self.params.SNR)
+
+    def energy_snr_batch(self):
+        for batch in EnergySNRBatch.from_streams(self.filtered,
+                                                 self.params.SNR):
+            batch.is_trustworthy()
+
+    def associator(self):
+        Associator(self.params.assoc).run(self.picks, self.candidates)
+
+    def local_amplitude(self):
+        for station, st in self.streams.items():
+            traces = Stream([tr for tr in st
+                             if tr.stats.channel[-1] in 'ZNE'])
+            la = LocalAmplitude(traces, self.obspy_picks[station],
+                                self.station_params.resp_file,
+                                self.params.response_file_type)
+            la.get_iaml(method='wood_calc')
+
+    def import_pspicker(self):
+        return import_time('pspicker')[0]
+
+
+def _obspy_pick(network, station, channel, phase, time):
+    return Pick(time=time, phase_hint=phase,
+                waveform_id=WaveformStreamID(network, station, '', channel))
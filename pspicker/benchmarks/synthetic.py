@@ -0,0 +1,188 @@
+"""
+Deterministic synthetic events, for benchmarks and tests
+"""
+from pathlib import Path
+
+import numpy as np
+import yaml
+from obspy.core import UTCDateTime, Stream, Trace
+
+from ..paz import PAZ
+
+
+class SyntheticEvent():
+    """
+    Synthetic local earthquake recorded on a network of stations
+
+    Each station records gaussian noise plus a P and an S wavelet (decaying
+    sinusoids), the P-wave mostly vertical and the S-wave mostly horizontal.
+    The same arguments always give the same data.
+    """
+    # Parameters for the picker's parameter file (see write_database())
+    picker_parameters = {
+        'global_window': {'kurtosis': {'frequency_bands': [[5, 30]],
+                                       'window_lengths': [5]},
+                          'distri_secs': 5,
+                          'offsets': [-10, 20],
+                          'end_cutoff': 0.9,
+                          'max_candidates': 1},
+        'SNR': {'noise_window': 2., 'signal_window': 1.,
+                'quality_thresholds': [1.5, 2.5, 4, 6],
+                'threshold_parameter': -3.},
+        'polarity': {'calculate_window': 1., 'analyze_window': 1.},
+        'association': {'cluster_window_otime': 1., 'otime_vp_vs': 1.70,
+                        'cluster_window_P': 3., 'cluster_window_S': 5.},
+        'response_file_type': 'JSON_PZ',
+        'station_parameters': {
+            'SYNTH': {'picking_components': {'P': 'Z', 'S': 'ZNE'},
+                      'SNR_energy': {'frequency_band': [3, 30],
+                                     'window': 20},
+                      'kurtosis': {'frequency_bands': [[3, 15], [8, 30]],
+                                   'window_lengths': [0.3, 0.5, 1, 2, 4, 8],
+                                   'extrema_smoothings': [2, 4, 6, 8, 10, 20,
+                                                          30, 40, 50]},
+                      'use_polarity': True}}}
+
+    def __init__(self, n_stations=5, n_components=3, sampling_rate=100.,
+                 duration=120., noise_level=1., origin_offset=None,
+                 min_distance=5., max_distance=60., vp=6., vp_vs=1.73, seed=42,
+                 starttime=UTCDateTime(2019, 5, 19, 6, 9), network='XS'):
+        """
+        :param n_stations: number of stations
+        :param n_components: 3 (Z, N, E) or 4 (Z, N, E and hydrophone)
+        :param sampling_rate: sampling rate (Hz)
+        :param duration: length of each trace (seconds)
+        :param noise_level: noise standard deviation (the P wavelet's
+            vertical amplitude is 20)
+        :param origin_offset: origin time, in seconds after starttime
+            (default: duration / 3)
+        :param min_distance: distance of the closest station (km)
+        :param max_distance: distance of the furthest station (km)
+        :param vp: P-wave velocity (km/s)
+        :param vp_vs: Vp/Vs ratio
+        :param seed: random number generator seed
+        :param starttime: start time of all traces
+        :param network: network code
+        """
+        assert n_components in (3, 4), 'n_components must be 3 or 4'
+        if origin_offset is None:
+            origin_offset = duration / 3
+        self.n_stations = n_stations
+        self.n_components = n_components
+        self.sampling_rate = float(sampling_rate)
+        self.duration = duration
+        self.noise_level = noise_level
+        self.seed = seed
+        self.starttime = UTCDateTime(starttime)
+        self.network = network
+        self.origin_time = self.starttime + origin_offset
+        self.stations = [f'S{i:03d}' for i in range(n_stations)]
+        distances = np.linspace(min_distance, max_distance,
+                                n_stations)
+        self.arrivals = {s: {'P': self.origin_time + d / vp,
+                             'S': self.origin_time + d * vp_vs / vp}
+                         for s, d in zip(self.stations, distances)}
+        self.stream = self._make_stream()
+
+    def __str__(self):
+        return (f'SyntheticEvent: {self.n_stations:d} stations, '
+                f'{self.n_components:d} components, '
+                f'{self.sampling_rate:g} Hz, {self.duration:g} s')
+
+    @property
+    def channels(self):
+        channels = ['HHZ', 'HHN', 'HHE', 'HDH']
+        return channels[:self.n_components]
+
+    def _make_stream(self):
+        """
+        Return the synthetic data
+        """
+        rng = np.random.default_rng(self.seed)
+        n_samps = int(round(self.duration * self.sampling_rate))
+        t = np.arange(n_samps) / self.sampling_rate
+        stream = Stream()
+        for i, station in enumerate(self.stations):
+            onsets = {k: v - self.starttime
+                      for k, v in self.arrivals[station].items()}
+            p_wave = _wavelet(t, onsets['P'], 10., 1.5, i)
+            s_wave = _wavelet(t, onsets['S'], 6., 1.5, i + 1)
+            # [P, S] amplitudes for each component
+            amps = {'Z': [20, 4], 'N': [6, 30], 'E': [4, 25], 'H': [30, 2]}
+            for channel in self.channels:
+                a_p, a_s = amps[channel[-1]]
+                data = (rng.normal(0, self.noise_level, n_samps)
+                        + a_p * p_wave + a_s * s_wave)
+                stream += Trace((data * 1000).astype('int32'), header={
+                    'network': self.network, 'station': station,
+                    'channel': channel, 'starttime': self.starttime,
+                    'sampling_rate': self.sampling_rate})
+        return stream
+
+    def write_database(self, base_dir):
+        """
+        Write the event as a SEISAN-style database that PSPicker can read
+
+        Writes the waveforms under base_dir/WAV/, an empty S-file under
+        base_dir/REA/, a response file and a picker parameter file
+
+        :param base_dir: directory to write to
+        :returns: dict with keys 'parm_file', 'wav_base_path',
+            'database_path_in', 'database_path_out' (PSPicker() arguments)
+            and 'database_filename' (run_one() argument)
+        """
+        from ..pspicker import PSPicker
+
+        base_dir = Path(base_dir)
+        t0 = self.starttime
+        year_month = Path(f'{t0.year:04d}', f'{t0.month:02d}')
+        wav_name = (t0.strftime('%Y-%m-%d-%H%M-%SM.') + self.network
+                    + f'_{self.n_stations:03d}')
+        wav_dir = base_dir / 'WAV' / year_month
+        wav_dir.mkdir(parents=True, exist_ok=True)
+        self.stream.write(str(wav_dir / wav_name), 'MSEED')
+        rea_dir = base_dir / 'REA' / year_month
+        rea_dir.mkdir(parents=True, exist_ok=True)
+        database_filename = t0.strftime('%d-%H%M-%SL.S%Y%m')
+        PSPicker.save_nordic_event([], self.origin_time, rea_dir,
+                                   database_filename, wavefiles=[wav_name])
+        resp_file = base_dir / 'synthetic_resp.json'
+        self.response().write_json_pz(str(resp_file))
+        params = dict(self.picker_parameters)
+        params['stations'] = {'S*': {'parameters': 'SYNTH',
+                                     'resp_file': str(resp_file)}}
+        parm_file = base_dir / 'synthetic_parameters.yaml'
+        with open(parm_file, 'w') as fp:
+            yaml.safe_dump(params, fp)
+        return {'parm_file': str(parm_file),
+                'wav_base_path': str(base_dir / 'WAV'),
+                'database_path_in': str(base_dir / 'REA'),
+                'database_path_out': str(base_dir / 'Sfile_directory'),
+                'database_filename': database_filename}
+
+    @staticmethod
+    def response():
+        """
+        Return the instrument response (a 1-Hz geophone, 1e9 counts/(m/s))
+        """
+        return PAZ.from_refgain(1e9, poles=[-4.44 + 4.44j, -4.44 - 4.44j],
+                                zeros=[0j, 0j], ref_freq=10.,
+                                input_units='m/s', output_units='counts')
+
+
+def _wavelet(t, onset, frequency, decay, phase):
+    """
+    Return a decaying sinusoid starting at onset
+
+    :param t: sample times (s)
+    :param onset: onset time (s)
+    :param frequency: frequency of the sinusoid (Hz)
+    :param decay: e-folding time (s)
+    :param phase: phase of the sinusoid (radians)
+    """
+    out = np.zeros(len(t))
+    after = t >= onset
+    dt = t[after] - onset
+    out[after] = (np.exp(-dt / decay)
+                  * np.sin(2 * np.pi * frequency * dt + phase))
+    return out
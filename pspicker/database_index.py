@@ -0,0 +1,226 @@
+"""
+Persistent index of a SEISAN database tree
+"""
+from contextlib import contextmanager
+import json
+import os
+import sqlite3
+from fnmatch import fnmatch
+from pathlib import Path
+
+from obspy.core import UTCDateTime
+
+from .logger import log
+
+
+class DatabaseIndex():
+    """
+    SQLite index of the database (S-) files in a SEISAN database tree
+
+    Maps each database file (path relative to the database directory) to
+    its waveform file names, event time and the stations in its phase lines,
+    so that running over a date range neither globs each day's directory
+    nor parses each database file.
+
+    update() only reads database files that are new or whose modification
+    time or size changed since the last update, and removes files that no
+    longer exist.  Database files are parsed directly (type 1, 6 and
+    phase lines), not using obspy.io.nordic.read_nordic()
+    """
+    default_name = 'pspicker_index.sqlite'
+    sfile_pattern = '[0-3][0-9]-[0-2][0-9][0-5][0-9]-*.S*'
+
+    def __init__(self, database_path, index_file=None):
+        """
+        :param database_path: database base directory (just before the
+            YEAR/MONTH subdirectories)
+        :param index_file: SQLite index file (created if it doesn't exist).
+            None: database_path/pspicker_index.sqlite
+        """
+        self.database_path = Path(database_path)
+        if index_file is None:
+            index_file = self.database_path / self.default_name
+        self.index_file = Path(index_file)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS sfiles ('
+                         'path TEXT PRIMARY KEY, '
+                         'mtime_ns INTEGER, '
+                         'size INTEGER, '
+                         'name_time TEXT, '
+                         'event_time REAL, '
+                         'wavefiles TEXT, '
+                         'stations TEXT)')
+            conn.execute('CREATE INDEX IF NOT EXISTS sfiles_name_time '
+                         'ON sfiles (name_time)')
+
+    def __str__(self):
+        return (f'DatabaseIndex: {self.database_path}, {len(self):d} '
+                f'database files in {self.index_file}')
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM sfiles').fetchone()[0]
+
+    @contextmanager
+    def _connect(self):
+        """
+        Connect to the index file, commit and close
+
+        Connections are not kept open, so that the DatabaseIndex can be
+        sent to worker processes
+        """
+        conn = sqlite3.connect(self.index_file)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def update(self):
+        """
+        Add new and modified database files to the index, remove deleted ones
+
+        :returns: number of added, updated and removed database files
+        """
+        with self._connect() as conn:
+            indexed = {row[0]: (row[1], row[2]) for row in conn.execute(
+                'SELECT path, mtime_ns, size FROM sfiles')}
+            found = set()
+            n_added, n_updated = 0, 0
+            for path, rel_path, name_time, stat in self._scan():
+                found.add(rel_path)
+                old = indexed.get(rel_path)
+                if old == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                event_time, wavefiles, stations = _parse_sfile(path)
+                conn.execute(
+                    'INSERT OR REPLACE INTO sfiles '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (rel_path, stat.st_mtime_ns, stat.st_size, name_time,
+                     event_time, json.dumps(wavefiles), json.dumps(stations)))
+                if old is None:
+                    n_added += 1
+                else:
+                    n_updated += 1
+            removed = [p for p in indexed if p not in found]
+            conn.executemany('DELETE FROM sfiles WHERE path = ?',
+                             [(p,) for p in removed])
+        log(f'{self.index_file}: {n_added:d} added, {n_updated:d} updated, '
+            f'{len(removed):d} removed', 'verbose')
+        return n_added, n_updated, len(removed)
+
+    def _scan(self):
+        """
+        Yield the database files in YEAR/MONTH subdirectories
+
+        :returns: generator of (path, path relative to database_path,
+            'YYYYMMDDHHMM' from directory and file names, os.stat_result)
+        """
+        for year in _scan_dirs(self.database_path, 4):
+            for month in _scan_dirs(Path(year.path), 2):
+                with os.scandir(month.path) as it:
+                    for entry in it:
+                        if not (entry.is_file() and fnmatch(
+                                entry.name, self.sfile_pattern)):
+                            continue
+                        name_time = (year.name + month.name + entry.name[:2]
+                                     + entry.name[3:7])
+                        yield (Path(entry.path),
+                               f'{year.name}/{month.name}/{entry.name}',
+                               name_time, entry.stat())
+
+    def sfiles(self, start_dt, end_dt):
+        """
+        Return the database files between two times
+
+        Uses the times in the directory and file names, to the minute, as
+        PSPicker.run_many() does without an index
+
+        :param start_dt: first time
+        :param end_dt: last time
+        :type start_dt, end_dt: datetime.datetime
+        :returns: sorted list of database file paths
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT path FROM sfiles WHERE name_time BETWEEN ? AND ? '
+                'ORDER BY path',
+                (start_dt.strftime('%Y%m%d%H%M'),
+                 end_dt.strftime('%Y%m%d%H%M'))).fetchall()
+        return [self.database_path / row[0] for row in rows]
+
+    def get(self, sfile):
+        """
+        Return the indexed information for a database file
+
+        :param sfile: database file path
+        :returns: dict with keys 'event_time' (UTCDateTime or None),
+            'wavefiles' and 'stations' (lists of str), or None if the file
+            is not indexed or has changed since it was indexed
+        """
+        try:
+            rel_path = Path(sfile).resolve().relative_to(
+                self.database_path.resolve()).as_posix()
+            stat = os.stat(sfile)
+        except (ValueError, OSError):
+            return None
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT mtime_ns, size, event_time, wavefiles, stations '
+                'FROM sfiles WHERE path = ?', (rel_path,)).fetchone()
+        if row is None or tuple(row[:2]) != (stat.st_mtime_ns, stat.st_size):
+            return None
+        return {'event_time': None if row[2] is None else UTCDateTime(row[2]),
+                'wavefiles': json.loads(row[3]),
+                'stations': json.loads(row[4])}
+
+
+def _scan_dirs(path, n_digits):
+    """Return the subdirectories whose names are n_digits digits"""
+    if not path.is_dir():
+        return []
+    with os.scandir(path) as it:
+        return sorted([e for e in it if e.is_dir() and e.name.isdigit()
+                       and len(e.name) == n_digits], key=lambda e: e.name)
+
+
+def _parse_sfile(path):
+    """
+    Read the event time, waveform files and stations from a NORDIC file
+
+    Only reads the first event in the file
+
+    :param path: database file path
+    :returns: event_time (timestamp, or None if unreadable), list of
+        waveform file names, sorted list of stations in phase lines
+    """
+    event_time, wavefiles, stations = None, [], set()
+    with open(path, errors='replace') as fp:
+        lines = fp.read().splitlines()
+    for line in lines:
+        if len(line.strip()) == 0:
+            if event_time is not None or len(wavefiles) > 0:
+                break   # end of first event
+            continue
+        line_type = line[79] if len(line) >= 80 else ' '
+        if line_type == '1':
+            if event_time is None:
+                event_time = _type1_time(line)
+        elif line_type == '6':
+            wavefiles.append(line[1:79].strip())
+        elif line_type in ' 4' and len(line[1:6].strip()) > 0:
+            stations.add(line[1:6].strip())
+    return event_time, wavefiles, sorted(stations)
+
+
+def _type1_time(line):
+    """Return the origin time timestamp on a NORDIC type 1 line, or None"""
+    def _value(field, func=int):
+        return func(field) if len(field.strip()) > 0 else 0
+
+    try:
+        return UTCDateTime(int(line[1:5]), int(line[6:8]), int(line[8:10]),
+                           _value(line[11:13]), _value(line[13:15])
+                           ).timestamp + _value(line[16:20], float)
+    except ValueError:
+        return None
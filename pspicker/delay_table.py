@@ -0,0 +1,191 @@
+"""
+Origin-to-P and P-to-S delay tables, calculated with TauP and cached on disk
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import obspy
+
+from .logger import log
+
+
+class DelayTable():
+    """
+    Origin-to-P and P-to-S delays over a grid of distances and depths
+
+    Delays are calculated once for each velocity model and grid, using
+    obspy.taup, and saved in a cache directory, in a file whose name
+    contains a hash of the velocity model (file contents or TauP model
+    name) and of the grid.  Later calls to from_model() read this file.
+
+    >>> table = DelayTable.from_model('iasp91', max_distance=1.,
+    ...                               depths=[5., 10., 20.])
+    >>> delays = table.delays(10.)   # {'op': [...], 'ps': [...]}
+    """
+    def __init__(self, distances, depths, op, ps, model=''):
+        """
+        :param distances: distances (degrees)
+        :param depths: source depths (km)
+        :param op: origin-to-P delays (s), shape (len(depths),
+            len(distances)), NaN where there is no arrival
+        :param ps: P-to-S delays (s), same shape as op
+        :param model: velocity model name
+        """
+        self.distances = np.asarray(distances, dtype=float)
+        self.depths = np.asarray(depths, dtype=float)
+        self.op = np.asarray(op, dtype=float)
+        self.ps = np.asarray(ps, dtype=float)
+        self.model = model
+
+    def __str__(self):
+        return (f'DelayTable: {self.model}, {len(self.depths):d} depths '
+                f'({self.depths.min():g}-{self.depths.max():g} km), '
+                f'{len(self.distances):d} distances '
+                f'({self.distances.min():g}-{self.distances.max():g} deg)')
+
+    @classmethod
+    def from_model(cls, vel_model, max_distance=1., n_distances=20,
+                   depths=(10.,), cache_dir=None):
+        """
+        Return the delay table of a velocity model, from the cache if possible
+
+        :param vel_model: velocity model (obspy taup model name or path
+            of a .nd or .tvel file)
+        :param max_distance: maximum distance (degrees)
+        :param n_distances: number of distances (from max_distance /
+            n_distances to max_distance)
+        :param depths: source depths (km)
+        :param cache_dir: cache directory (None: default_cache_dir())
+        """
+        distances = np.linspace(max_distance / n_distances, max_distance,
+                                n_distances)
+        depths = np.atleast_1d(np.asarray(depths, dtype=float))
+        cache_dir = Path(default_cache_dir() if cache_dir is None
+                         else cache_dir)
+        model_hash = _model_hash(vel_model, distances, depths)
+        cache_file = cache_dir / (f'delays_{Path(str(vel_model)).stem}_'
+                                  f'{model_hash}.npz')
+        if cache_file.is_file():
+            log(f'Reading delays from {cache_file}', 'verbose')
+            return cls.load(cache_file)
+        log(f'Calculating delays for {vel_model}, cached in {cache_file}',
+            'verbose')
+        table = cls.calculate(vel_model, distances, depths)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        table.save(cache_file)
+        return table
+
+    @classmethod
+    def calculate(cls, vel_model, distances, depths):
+        """
+        Calculate a delay table using TauP
+
+        Uses the first P (p or P) and S (s or S) arrivals
+
+        :param vel_model: velocity model (obspy taup model name or path
+            of a .nd or .tvel file)
+        :param distances: distances (degrees)
+        :param depths: source depths (km)
+        """
+        with tempfile.TemporaryDirectory() as build_dir:
+            model = _taup_model(vel_model, build_dir)
+        op = np.full((len(depths), len(distances)), np.nan)
+        ps = np.full((len(depths), len(distances)), np.nan)
+        for i, depth in enumerate(depths):
+            for j, distance in enumerate(distances):
+                arrivals = model.get_travel_times(
+                    depth, distance, phase_list=['p', 'P', 's', 'S'])
+                p_times = [x.time for x in arrivals if x.name in ('p', 'P')]
+                s_times = [x.time for x in arrivals if x.name in ('s', 'S')]
+                if len(p_times) == 0 or len(s_times) == 0:
+                    log(f'Could not calculate delays for dist={distance:.2g} '
+                        f'degrees, depth={depth:g} km', 'warning')
+                    continue
+                op[i, j] = min(p_times)
+                ps[i, j] = min(s_times) - min(p_times)
+        return cls(distances, depths, op, ps, str(vel_model))
+
+    def save(self, filename):
+        """
+        Save to a numpy .npz file
+        """
+        np.savez(filename, distances=self.distances, depths=self.depths,
+                 op=self.op, ps=self.ps, model=self.model)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Read from a numpy .npz file written by save()
+        """
+        with np.load(filename) as data:
+            return cls(data['distances'], data['depths'], data['op'],
+                       data['ps'], str(data['model']))
+
+    def delays(self, depth):
+        """
+        Return the delays at one depth (interpolated between table depths)
+
+        :param depth: source depth (km)
+        :returns: dict with keys 'op' and 'ps', each a list of delays
+            starting at 0 and sorted by P-S delay (the delays_model of
+            Associator.calc_origin_time())
+        """
+        if len(self.depths) == 1:
+            op, ps = self.op[0], self.ps[0]
+        else:
+            op = np.array([np.interp(depth, self.depths, col)
+                           for col in self.op.T])
+            ps = np.array([np.interp(depth, self.depths, col)
+                           for col in self.ps.T])
+        good = np.isfinite(op) & np.isfinite(ps)
+        op, ps = op[good], ps[good]
+        order = np.argsort(ps)
+        return {'op': [0.] + list(op[order]), 'ps': [0.] + list(ps[order])}
+
+
+def default_cache_dir():
+    """
+    Return the default delay table cache directory
+
+    $PSPICKER_CACHE_DIR if it is set, otherwise pspicker/ under
+    $XDG_CACHE_HOME (default ~/.cache)
+    """
+    if 'PSPICKER_CACHE_DIR' in os.environ:
+        return Path(os.environ['PSPICKER_CACHE_DIR'])
+    return Path(os.environ.get('XDG_CACHE_HOME',
+                               Path.home() / '.cache')) / 'pspicker'
+
+
+def _model_hash(vel_model, distances, depths):
+    """
+    Return a hash of a velocity model (its file's contents if it is a file)
+    and of the distance and depth grid
+    """
+    h = hashlib.sha256()
+    if Path(str(vel_model)).is_file():
+        h.update(Path(vel_model).read_bytes())
+    else:
+        h.update(f'taup:{vel_model}:obspy {obspy.__version__}'.encode())
+    h.update(np.asarray(distances, dtype=float).tobytes())
+    h.update(np.asarray(depths, dtype=float).tobytes())
+    return h.hexdigest()[:16]
+
+
+def _taup_model(vel_model, build_dir):
+    """
+    Return a TauPyModel, building it first if vel_model is a model file
+
+    :param vel_model: obspy taup model name or path of a .nd or .tvel file
+    :param build_dir: directory to build the model file's TauP model in
+    """
+    from obspy.taup import TauPyModel
+    from obspy.taup.taup_create import build_taup_model
+
+    path = Path(str(vel_model))
+    if not path.is_file():
+        return TauPyModel(model=vel_model)
+    build_taup_model(str(path), output_folder=str(build_dir))
+    return TauPyModel(model=str(Path(build_dir) / (path.stem + '.npz')))
@@ -1,17 +1,18 @@
 import copy
 
 import numpy as np
-from obspy.signal.util import smooth as obspy_smooth
 from obspy.core.stream import Stream
 from obspy.core import UTCDateTime
 
-from .utils import smooth_filter
+from .utils import ArrayTrace, rolling_mean
 from .logger import log
 
 
 class EnergySNR():
     """
     Energy and signal-to-noise ratio of a waveform Stream
+
+    The energy (nrg) and signal-to-noise ratio (snr) are ArrayTraces
     """
     def __init__(self, stream, params, plot=False):
         """
@@ -28,14 +29,30 @@ class EnergySNR():
         self.station = self._get_station(stream)
         self.snr = self._calc_snr()
         self.nrg.stats.channel = 'NRG'
-        self.snr.stats.channel = 'SNR'
+        if self.snr is not None:
+            self.snr.stats.channel = 'SNR'
 
         if plot:
-            snr_dB = self.snr.copy()
-            snr_dB.data = 20*np.log10(snr_dB.data)
+            snr_dB = self.snr.with_data(20*np.log10(self.snr.data))
             snr_dB.stats.channel = 'SDB'
-            Stream([stream[0], snr_dB, self.snr, self.nrg]).plot(
-                equal_scale=False)
+            Stream([stream[0], snr_dB.to_trace(), self.snr.to_trace(),
+                    self.nrg.to_trace()]).plot(equal_scale=False)
+
+    @classmethod
+    def from_arrays(cls, nrg, snr, params, station):
+        """
+        Return an EnergySNR with already calculated energy and SNR
+
+        :param nrg: energy ArrayTrace
+        :param snr: signal-to-noise ratio ArrayTrace (or None)
+        :param params: SNRParameters object
+        :param station: station name
+        """
+        new = cls.__new__(cls)
+        new.params = params
+        new.snr_threshold = None
+        new.nrg, new.snr, new.station = nrg, snr, station
+        return new
 
     def copy(self):
         return copy.copy(self)
@@ -45,12 +62,22 @@ class EnergySNR():
 
     @staticmethod
     def _calc_energy(stream):
-        temp = stream.copy()
-        for t in temp:
-            t.data = np.power(t.data, 2)
+        s = stream[0].stats
+        if all(t.stats.starttime == s.starttime and t.stats.npts == s.npts
+               and t.stats.sampling_rate == s.sampling_rate for t in stream):
+            # Aligned traces: no copies, no stacking
+            data = np.array([t.data for t in stream], dtype=float)
+            ids = {}
+            for key in ('network', 'station', 'location', 'channel'):
+                values = set([getattr(t.stats, key) for t in stream])
+                ids[key] = values.pop() if len(values) == 1 else ''
+            return ArrayTrace(_energy(data[None, :, :])[0], s.starttime,
+                              s.sampling_rate, **ids)
+        temp = [ArrayTrace.from_trace(t) for t in stream]
+        temp = [t.with_data(np.power(t.data, 2)) for t in temp]
         try:
-            energy = temp.stack(npts_tol=1,
-                                time_tol=1/temp[0].stats.sampling_rate)[0]
+            energy = _stack(temp, npts_tol=1,
+                            time_tol=1/temp[0].stats.sampling_rate)
             if energy.stats.starttime.timestamp == 0:
                 log('stacked traces are offset by more than one sample'
                     'setting starttime to stream[0].stats.starttime',
@@ -59,14 +86,14 @@ class EnergySNR():
         except ValueError as err:
             log(err, 'error')
             log('Slicing to same size', 'warning')
-            log(temp, 'warning')
+            log(Stream([t.to_trace() for t in temp]), 'warning')
             last_start = UTCDateTime(max([t.stats.starttime.timestamp
                                           for t in temp]))
             first_end = UTCDateTime(min([t.stats.endtime.timestamp
                                          for t in temp]))
-            temp.trim(last_start, first_end)
-            log(temp, 'warning')
-            energy = temp.stack(npts_tol=1)[0]
+            temp = [t.trim(last_start, first_end) for t in temp]
+            log(Stream([t.to_trace() for t in temp]), 'warning')
+            energy = _stack(temp, npts_tol=1)
         energy.data = np.power(energy.data, 0.5)
         return energy
 
@@ -85,32 +112,12 @@ class EnergySNR():
         :param energy: energy trace
         :returns: (M(t...t+window_after)/M(t-window_before,t))
         """
-        sr = self.nrg.stats.sampling_rate
-        half_noise_wind_samps = round(sr * self.params.noise_window / 2)
-        half_signal_wind_samps = round(sr * self.params.signal_window / 2)
-        self.params.noise_window = 2*half_noise_wind_samps/sr
-        self.params.signal_window = 2*half_signal_wind_samps/sr
-        w_noise = self.nrg.copy()
-        w_signal = self.nrg.copy()
-        # smooth using central moving average
-        w_noise.data = obspy_smooth(self.nrg.data, half_noise_wind_samps)
-        w_signal.data = obspy_smooth(self.nrg.data, half_signal_wind_samps)
-        # Shift times so that noise is BEFORE reference time and signal AFTER
-        w_noise.stats.starttime += self.params.noise_window/2
-        w_signal.stats.starttime -= self.params.signal_window/2
-        noise_start = w_noise.stats.starttime
-        signal_end = w_signal.stats.endtime
-        if noise_start >= signal_end:
-            log("SNR noise_start >= signal_end, no SNR calculated"
-                "(trace, signal, noise lengths = {.2g}, {.2g}, {.2g})".format(
-                self.nrg.stats.npts / self.nrg.stats.sampling_rate,
-                self.params.signal_window,
-                self.params.noise_window), 'error')
+        snr, offset = _snr(self.nrg.data[None, :],
+                           self.nrg.stats.sampling_rate, self.params)
+        if snr is None:
             return None
-        w_noise.trim(noise_start, signal_end)
-        w_signal.trim(noise_start, signal_end)
-        w_signal.data /= w_noise.data
-        return w_signal
+        return self.nrg.with_data(
+            snr[0], self.nrg.stats.starttime + offset * self.nrg.stats.delta)
 
     def slice(self, starttime=None, endtime=None, nearest_sample=True):
         """
@@ -135,49 +142,305 @@ class EnergySNR():
         :returns: is_trustworthy, info_text
         """
         # Pick_Function.m:380
-        if self.snr.stats.npts == 0:
+        if self.snr is None or self.snr.stats.npts == 0:
             log(f'station {self.station} self.snr has zero length', 'error')
             return False, 'error'
-        snr_smooth = smooth_filter(self.snr, n_smooth)
-        if snr_smooth is None:
-            log('Could not smooth_filter self.snr for station "{}"'
-                .format(self.station), 'error')
-            log(self.snr, 'error')
-            return False, 'error'
-        self._set_snr_threshold(snr_smooth)
-        sign_change = np.diff(np.sign(snr_smooth.data - self.snr_threshold))
-        crossings = len(sign_change[sign_change == 2])
+        snr_smooth = _smooth(self.snr.data[None, :], n_smooth)
+        thresholds, crossings = _threshold_crossings(snr_smooth, self.params)
+        self.snr_threshold = float(thresholds[0])
         if debug:
-            snr_smooth.plot()
-        max_cross = self.params.max_threshold_crossings
-        trustworthy = (crossings > 0 and crossings <= max_cross)
-        if not trustworthy:
-            s = 'not trustworthy: '
-            if crossings == 0:
-                s += f'never crossed the threshold ({self.snr_threshold})'
-            else:
-                s += f'crossed the threshold ({self.snr_threshold}) '
-                s += f'{crossings:d} times (> {max_cross:d})'
-        else:
-            s = "trustworthy"
-        return (crossings > 0
-                and crossings <= self.params.max_threshold_crossings), s
+            self.snr.with_data(snr_smooth[0]).to_trace().plot()
+        return _trust(crossings[0], self.snr_threshold, self.params)
 
-    def _set_snr_threshold(self, snr_smooth):
+
+class EnergySNRBatch():
+    """
+    Energy and signal-to-noise ratio of several stations at once
+
+    Calculated on an aligned (stations x components x samples) array: the
+    energy, the central noise and signal moving averages (using
+    cumulative sums) and their ratio are each calculated in one pass over
+    all stations.  The energy (nrg) and signal-to-noise ratio (snr) are
+    (stations x samples) arrays.
+
+    >>> batch = EnergySNRBatch.from_streams({'STA1': st1, 'STA2': st2},
+    ...                                     params)
+    >>> trustworthy, messages = batch.is_trustworthy(first_time, last_time)
+    >>> energies = batch.to_energy_snrs()   # {station: EnergySNR}
+    """
+    def __init__(self, data, sampling_rate, starttime, params, stations=None):
+        """
+        :param data: (stations x components x samples) array.  Stations
+            with fewer components can be padded with zeros
+        :param sampling_rate: sampling rate (Hz)
+        :param starttime: time of the first sample
+        :param params: SNRParameters object
+        :param stations: station names (default: '0', '1', ...)
         """
-        Calculate the signal-to-noise threshold value
+        data = np.asarray(data, dtype=float)
+        assert data.ndim == 3, 'data is not (stations x components x samples)'
+        self.params = params
+        self.sampling_rate = float(sampling_rate)
+        self.starttime = starttime
+        if stations is None:
+            stations = [str(i) for i in range(data.shape[0])]
+        assert len(stations) == data.shape[0], 'wrong number of stations'
+        self.stations = list(stations)
+        self.nrg = _energy(data)
+        self.snr, offset = _snr(self.nrg, self.sampling_rate, params)
+        self.snr_starttime = starttime + offset / self.sampling_rate
+        self.snr_thresholds = None
+
+    def __len__(self):
+        return len(self.stations)
+
+    def __str__(self):
+        return (f'EnergySNRBatch: {len(self):d} stations, '
+                f'{self.nrg.shape[-1]:d} samples')
 
-        :param snr_smooth: trace of smoothed signal-to-noise ratio
+    @classmethod
+    def from_streams(cls, streams, params):
         """
-        # Pick_Function.m:382
-        tp = self.params.threshold_parameter
-        min_threshold = min(self.params.quality_thresholds)
-        if (tp > 0 and tp <= 1):
-            threshold = 1 + tp * (np.nanmax(snr_smooth.data) - 1)
-        else:
-            assert tp < 0, f'Illegal SNR threshold_parameter value: {tp:g}'
-            threshold = -tp
-        self.snr_threshold = max([threshold, min_threshold])
+        Return an EnergySNRBatch for each group of aligned stations
+
+        Stations whose traces all have the same start time, number of
+        samples and sampling rate are calculated together.  Stations whose
+        components are not aligned are calculated alone, by EnergySNR.
+
+        :param streams: dict with key=station, value=Stream of the
+            station's (filtered) traces
+        :param params: SNRParameters object
+        :returns: list of EnergySNRBatch and EnergySNR objects
+        """
+        groups, single = {}, []
+        for station, st in streams.items():
+            keys = set([(t.stats.starttime.ns, t.stats.npts,
+                         t.stats.sampling_rate) for t in st])
+            if len(keys) == 1:
+                groups.setdefault((keys.pop(), len(st)), []).append(station)
+            elif len(keys) > 1:
+                single.append(EnergySNR(st, params))
+        batches = []
+        for ((start_ns, npts, sr), _), stations in groups.items():
+            data = np.array([[t.data for t in streams[s]] for s in stations],
+                            dtype=float)
+            batches.append(cls(data, sr, UTCDateTime(ns=start_ns), params,
+                               stations))
+        return batches + single
+
+    def nrg_trace(self, i):
+        """
+        Return a station's energy ArrayTrace
+
+        :param i: station index
+        """
+        return ArrayTrace(self.nrg[i], self.starttime, self.sampling_rate,
+                          station=self.stations[i], channel='NRG')
+
+    def snr_trace(self, i):
+        """
+        Return a station's signal-to-noise ratio ArrayTrace (None if the
+        data are too short)
+
+        :param i: station index
+        """
+        if self.snr is None:
+            return None
+        return ArrayTrace(self.snr[i], self.snr_starttime, self.sampling_rate,
+                          station=self.stations[i], channel='SNR')
+
+    def to_energy_snrs(self):
+        """
+        Return each station's EnergySNR object
+
+        :returns: dict with key=station, value=EnergySNR
+        """
+        return {s: EnergySNR.from_arrays(self.nrg_trace(i),
+                                         self.snr_trace(i), self.params, s)
+                for i, s in enumerate(self.stations)}
+
+    def is_trustworthy(self, starttime=None, endtime=None, n_smooth=100):
+        """
+        Check if each station's signal can be trusted or not
+
+        As EnergySNR.is_trustworthy(), on the SNR between starttime and
+        endtime (selecting the same samples as EnergySNR.slice())
+
+        :param starttime: start of the SNR to check (None: first sample)
+        :param endtime: end of the SNR to check (None: last sample)
+        :param n_smooth: length of moving average filter to apply before
+            analysis
+        :returns: boolean array, list of info texts
+        """
+        if self.snr is None:
+            return np.zeros(len(self), dtype=bool), ['error'] * len(self)
+        # Indices of the samples that ArrayTrace.slice() would keep
+        indices = ArrayTrace(np.arange(self.snr.shape[-1]),
+                             self.snr_starttime, self.sampling_rate
+                             ).slice(starttime, endtime).data
+        if len(indices) == 0:
+            return np.zeros(len(self), dtype=bool), ['error'] * len(self)
+        snr_smooth = _smooth(self.snr[:, indices[0]:indices[-1] + 1],
+                             n_smooth)
+        self.snr_thresholds, crossings = _threshold_crossings(snr_smooth,
+                                                              self.params)
+        trust = [_trust(c, t, self.params)
+                 for c, t in zip(crossings, self.snr_thresholds)]
+        return np.array([x[0] for x in trust]), [x[1] for x in trust]
+
+
+def _energy(data):
+    """
+    Return the energy of each station
+
+    :param data: (stations x components x samples) array
+    :returns: (stations x samples) array: root mean square over components
+    """
+    return np.sqrt(np.mean(np.square(data), axis=1))
+
+
+def _snr(nrg, sampling_rate, params):
+    """
+    Return the signal-to-noise ratio of each station
+
+    The noise (signal) is the central moving average of the energy over
+    params.noise_window (signal_window), shifted so that it ends (starts)
+    at each time
+
+    :param nrg: (stations x samples) energy array
+    :param sampling_rate: sampling rate (Hz)
+    :param params: SNRParameters object
+    :returns: (stations x samples) SNR array (None if the data are shorter
+        than the windows), offset (in samples) of the SNR's first sample
+        from the energy's
+    """
+    half_noise = round(sampling_rate * params.noise_window / 2)
+    half_signal = round(sampling_rate * params.signal_window / 2)
+    npts = nrg.shape[-1]
+    if npts - half_noise - half_signal <= 1:
+        log("SNR noise_start >= signal_end, no SNR calculated"
+            "(trace, signal, noise lengths = {:.2g}, {:.2g}, {:.2g})".format(
+                npts / sampling_rate, 2 * half_signal / sampling_rate,
+                2 * half_noise / sampling_rate), 'error')
+        return None, half_noise
+    noise = _central_mean(nrg, half_noise)
+    signal = _central_mean(nrg, half_signal)
+    # noise BEFORE each time and signal AFTER
+    return (signal[:, half_noise + half_signal:]
+            / noise[:, :npts - half_noise - half_signal]), half_noise
+
+
+def _central_mean(data, half_width):
+    """
+    Central moving average of each row of an array
+
+    Average of the half_width samples before and the half_width samples
+    after each sample, as utils.central_moving_average(), but using
+    cumulative sums (utils.rolling_mean())
+
+    :param data: 2-D array (one row per signal)
+    :param half_width: number of samples on each side (0: return data)
+    """
+    n = int(half_width)
+    if n <= 0:
+        return data
+    npts = data.shape[-1]
+    padded = np.concatenate((np.repeat(data[:, :1], n, axis=1), data,
+                             np.repeat(data[:, -1:], n, axis=1)), axis=1)
+    means = rolling_mean(padded, n)   # mean of the n samples up to each
+    out = (means[:, n - 1:n - 1 + npts] + means[:, 2 * n:2 * n + npts]) / 2
+    out[:, :n] = out[:, n:n + 1]
+    out[:, npts - n:] = out[:, npts - n - 1:npts - n]
+    return out
+
+
+def _smooth(data, n_smooth):
+    """
+    Trailing moving average of each row, as utils.smooth_filter() (using
+    cumulative sums)
+    """
+    return rolling_mean(data, int(n_smooth))
+
+
+def _threshold_crossings(snr_smooth, params):
+    """
+    Return each row's SNR threshold and number of upward crossings of it
+
+    :param snr_smooth: (stations x samples) smoothed SNR array
+    :param params: SNRParameters object
+    """
+    # Pick_Function.m:382
+    tp = params.threshold_parameter
+    min_threshold = min(params.quality_thresholds)
+    if (tp > 0 and tp <= 1):
+        thresholds = 1 + tp * (np.nanmax(snr_smooth, axis=-1) - 1)
+    else:
+        assert tp < 0, f'Illegal SNR threshold_parameter value: {tp:g}'
+        thresholds = np.full(snr_smooth.shape[0], -tp)
+    thresholds = np.maximum(thresholds, min_threshold)
+    sign_change = np.diff(np.sign(snr_smooth - thresholds[:, None]), axis=-1)
+    return thresholds, np.count_nonzero(sign_change == 2, axis=-1)
+
+
+def _trust(crossings, threshold, params):
+    """
+    Return whether a station is trustworthy, and why
+
+    It is if the SNR crosses (from below to above) the threshold at least
+    once and no more than params.max_threshold_crossings times
+
+    :param crossings: number of threshold crossings
+    :param threshold: SNR threshold
+    :param params: SNRParameters object
+    :returns: is_trustworthy, info_text
+    """
+    max_cross = params.max_threshold_crossings
+    trustworthy = bool(crossings > 0 and crossings <= max_cross)
+    if trustworthy:
+        return trustworthy, "trustworthy"
+    s = 'not trustworthy: '
+    if crossings == 0:
+        s += f'never crossed the threshold ({threshold})'
+    else:
+        s += f'crossed the threshold ({threshold}) '
+        s += f'{crossings:d} times (> {max_cross:d})'
+    return trustworthy, s
+
+
+def _stack(traces, time_tol=0, npts_tol=0):
+    """
+    Return the mean of ArrayTraces
+
+    Follows obspy's Stream.stack() rules for the starttime, number of samples
+    and seed id
+    :param traces: list of ArrayTraces
+    :param time_tol: starttimes within time_tol are stacked, using the high
+        median starttime.  Otherwise, the starttime is set to timestamp 0
+    :param npts_tol: maximum difference in number of samples.  Samples beyond
+        the shortest trace are ignored.
+    """
+    if len(set([t.stats.sampling_rate for t in traces])) > 1:
+        raise ValueError('Sampling rate of traces to stack is different')
+    times = [t.stats.starttime for t in traces]
+    if all([x == times[0] for x in times]):
+        starttime = times[0]
+    elif time_tol > 0 and max(times) - min(times) <= time_tol:
+        starttime = sorted(times)[len(times) // 2]
+    else:
+        starttime = UTCDateTime(0)
+    npts_all = [len(t) for t in traces]
+    npts = min(npts_all)
+    if max(npts_all) - npts > npts_tol:
+        raise ValueError('Difference of number of points of the traces is '
+                         'higher than requested tolerance ({} > {})'
+                         .format(max(npts_all) - npts, npts_tol))
+    ids = {}
+    for key in ('network', 'station', 'location', 'channel'):
+        values = set([getattr(t.stats, key) for t in traces])
+        ids[key] = values.pop() if len(values) == 1 else ''
+    return ArrayTrace(np.mean(np.array([t.data[:npts] for t in traces]),
+                              axis=0),
+                      starttime, traces[0].stats.sampling_rate, **ids)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,144 @@
+"""
+Butterworth filters designed once and applied directly to arrays
+"""
+import warnings
+
+import numpy as np
+from scipy.signal import iirfilter, sosfilt
+from obspy.core import Stream, Trace
+
+
+class FilterBank():
+    """
+    Second-order sections of Butterworth bandpass filters
+
+    Filters are designed the first time they are asked for and then
+    reused, keyed by (frequency band, corners, sampling rate, zero-phase).
+    They are applied with scipy.signal.sosfilt() to numpy arrays, giving
+    the same results as obspy's Trace.filter('bandpass') without
+    redesigning the filter or adding to the trace's processing history.
+
+    >>> bank = FilterBank()
+    >>> filtered = bank.bandpass(data, [3, 15], 100.)
+    >>> filtered = bank.bandpass_bands(data, [[3, 15], [8, 30]], 100.)
+    """
+    def __init__(self):
+        self._sos = {}
+
+    def __len__(self):
+        return len(self._sos)
+
+    def sos(self, band, sampling_rate, corners=3, zerophase=False):
+        """
+        Return a bandpass filter's second-order sections
+
+        As in obspy.signal.filter.bandpass(), a highpass filter is returned
+        if the high corner frequency is at or above Nyquist
+
+        :param band: [low, high] frequency band (Hz)
+        :param sampling_rate: sampling rate (Hz)
+        :param corners: filter corners
+        :param zerophase: the filter will be applied forwards and backwards
+        """
+        key = (tuple(band), corners, float(sampling_rate), zerophase)
+        try:
+            return self._sos[key]
+        except KeyError:
+            sos = _design_sos(band, sampling_rate, corners)
+            self._sos[key] = sos
+            return sos
+
+    def bandpass(self, data, band, sampling_rate, corners=3,
+                 zerophase=False):
+        """
+        Bandpass filter each row of an array
+
+        :param data: 1-D or 2-D array (one row per signal)
+        :param band: [low, high] frequency band (Hz)
+        :param sampling_rate: sampling rate (Hz)
+        :param corners: filter corners
+        :param zerophase: filter forwards and backwards
+        :returns: filtered array (float64), same shape as data
+        """
+        sos = self.sos(band, sampling_rate, corners, zerophase)
+        data = np.require(data, dtype=np.float64)
+        if not zerophase:
+            return sosfilt(sos, data, axis=-1)
+        firstpass = np.flip(sosfilt(sos, data, axis=-1), axis=-1)
+        return np.flip(sosfilt(sos, firstpass, axis=-1), axis=-1)
+
+    def bandpass_bands(self, data, bands, sampling_rate, corners=3,
+                       zerophase=False):
+        """
+        Filter an array in several frequency bands
+
+        :param data: 1-D or 2-D array (one row per signal)
+        :param bands: list of [low, high] frequency bands (Hz)
+        :param sampling_rate: sampling rate (Hz)
+        :param corners: filter corners
+        :param zerophase: filter forwards and backwards
+        :returns: array of shape (len(bands), *data.shape)
+        """
+        data = np.require(data, dtype=np.float64)
+        out = np.empty((len(bands), *data.shape))
+        for i, band in enumerate(bands):
+            out[i] = self.bandpass(data, band, sampling_rate, corners,
+                                   zerophase)
+        return out
+
+    def filter_stream(self, stream, band, corners=3, zerophase=False):
+        """
+        Return a bandpass filtered copy of a Stream
+
+        Traces with the same sampling rate and number of samples are
+        filtered in one call.  The new Traces only have the seed id,
+        starttime and sampling rate of the originals (no processing
+        history).
+
+        :param stream: obspy Stream
+        :param band: [low, high] frequency band (Hz)
+        :param corners: filter corners
+        :param zerophase: filter forwards and backwards
+        """
+        groups = {}
+        for i, tr in enumerate(stream):
+            key = (tr.stats.sampling_rate, tr.stats.npts)
+            groups.setdefault(key, []).append(i)
+        traces = [None] * len(stream)
+        for (sr, npts), indices in groups.items():
+            filtered = self.bandpass(
+                np.array([stream[i].data for i in indices], dtype=np.float64),
+                band, sr, corners, zerophase)
+            for i, data in zip(indices, filtered):
+                s = stream[i].stats
+                traces[i] = Trace(data, header={
+                    'network': s.network, 'station': s.station,
+                    'location': s.location, 'channel': s.channel,
+                    'starttime': s.starttime, 'sampling_rate': sr})
+        return Stream(traces)
+
+
+def _design_sos(band, sampling_rate, corners=3):
+    """
+    Return the second-order sections of obspy.signal.filter.bandpass()
+
+    :param band: [low, high] frequency band
+    :param sampling_rate: sampling rate
+    :param corners: filter corners
+    """
+    fe = 0.5 * sampling_rate
+    low, high = band[0] / fe, band[1] / fe
+    if high - 1.0 > -1e-6:
+        warnings.warn(f'Selected high corner frequency ({band[1]}) of '
+                      f'bandpass is at or above Nyquist ({fe}). Applying a '
+                      'high-pass instead.')
+        return iirfilter(corners, low, btype='highpass', ftype='butter',
+                         output='sos')
+    if low > 1:
+        raise ValueError('Selected low corner frequency is above Nyquist.')
+    return iirfilter(corners, [low, high], btype='band', ftype='butter',
+                     output='sos')
+
+
+# Shared by all stations and events
+FILTER_BANK = FilterBank()
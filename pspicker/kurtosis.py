@@ -4,13 +4,15 @@ Kurtosis-specific routines
 import warnings
 
 import numpy as np
-from scipy.signal import lfilter
+from scipy.signal import lfilter, sosfilt
+from obspy.core import UTCDateTime
 from obspy.core.stream import Stream
 from obspy.core.trace import Trace
 # from scipy.stats import kurtosis as scipy_kurtosis
 # from obspy.realtime.signal import kurtosis as obspy_kurtosis
 
-from .utils import smooth_filter
+from .utils import smooth_filter, rolling_mean, ArrayTrace
+from .filter_bank import FILTER_BANK
 from .pick_candidate import PickCandidate
 from .logger import log
 
@@ -30,6 +32,62 @@ class Kurtosis_pick():
         self.kurtosis = kurtosis
 
 
+class KurtosisCache():
+    """
+    Per-event cache of band-filtered data and kurtosis products
+
+    Lets the global window and station picking passes share the work done
+    on the same traces.  Products are keyed by the trace (id, starttime,
+    sampling rate and number of samples), the frequency band and, for
+    kurtoses, the window length and time span.
+    """
+    def __init__(self):
+        self._products = {}
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def __len__(self):
+        return len(self._products)
+
+    @staticmethod
+    def trace_key(trace):
+        """
+        Return the part of the key that identifies a trace
+        """
+        return (trace.id, trace.stats.starttime.ns, trace.stats.sampling_rate,
+                trace.stats.npts)
+
+    def get(self, key, func, *args):
+        """
+        Return the product corresponding to key, calculating it if needed
+
+        :param key: hashable key
+        :param func: function to calculate the product
+        :param args: arguments to func
+        """
+        try:
+            value = self._products[key]
+        except KeyError:
+            self.n_misses += 1
+            value = func(*args)
+            self._products[key] = value
+        else:
+            self.n_hits += 1
+        return value
+
+    def discard(self, kind):
+        """
+        Remove one kind of product ('bandpass' or 'kurtosis')
+
+        For example, to free the kurtoses of a time window that will not be
+        used again while keeping the filtered traces
+
+        :param kind: product kind (first element of the key)
+        """
+        self._products = {k: v for k, v in self._products.items()
+                          if k[0] != kind}
+
+
 class Kurtosis():
     """
     Class for picking seismograms using the Kurtosis
@@ -45,21 +103,32 @@ class Kurtosis():
     5) identify where the slope of the resulting function changes from positive
        to negative
     """
-    def __init__(self, params, plot=False):
+    def __init__(self, params, plot=False, cache=None):
         """
         :param params: KurtosisParameters object
         :param plot: make a plot of Kurtosis parameters
+        :param cache: KurtosisCache object to get/put filtered data and
+            kurtoses ('array' engine only)
         """
         self.params = params
         self.plot = plot
+        self.cache = cache
 
-        # Mean trace over freq_bands, wind_lengths & smoothing
+        # Mean ArrayTrace over freq_bands, wind_lengths & smoothing
         self.mean_kurtosis = None
         # Mean trace, cumulated and detrended
         self.mean_cumulative_kurtosis = None
         # Gradients of mean_cumulative_kurtosis, for each extrem_smoothing
         self.kurto_gradients = None
 
+    def __getstate__(self):
+        """
+        Pickle without the KurtosisCache (shared by a whole event)
+        """
+        state = self.__dict__.copy()
+        state['cache'] = None
+        return state
+
     def __str__(self):
         s = "Kurtosis:\n"
         s += f"   params = {self.params}\n"
@@ -101,7 +170,10 @@ class Kurtosis():
 
         Puts mean kurtosis over all windows and freq_bands in
         self.mean_cumulative_kurtosis
-        
+
+        Uses the engine specified in self.params.engine ('trace' is always
+        used if self.plot is True, to plot each band and window)
+
         :param trace: the raw trace (works one trace, not a stream)
         :param starttime: is the first time of interest
         :param endtime: is the last time of interest
@@ -120,10 +192,85 @@ class Kurtosis():
         elif endtime > trace.stats.endtime:
             endtime = trace.stats.endtime
 
+        if self.params.engine == 'array' and not self.plot:
+            self._calc_kurtocum_array(trace, starttime, endtime)
+        else:
+            self._calc_kurtocum_trace(trace, starttime, endtime)
+
+    def _calc_kurtocum_array(self, trace, starttime, endtime):
+        """
+        Calculate cumulative kurtosis using one array for all bands/windows
+
+        Each row of the array is one (window_length, frequency_band)
+        combination, so the smoothing, cumulation and detrending are each
+        done in one call.  Filtered data and kurtoses are taken from
+        self.cache, if it exists.
+
+        :param trace: the raw trace
+        :param starttime: is the first time of interest
+        :param endtime: is the last time of interest
+        """
+        # Only the metadata are copied, to get the sliced samples
+        sliced = ArrayTrace.from_trace(trace).slice(starttime, endtime)
+        sr = sliced.stats.sampling_rate
+        npts = sliced.stats.npts
+        i_first = int(round((sliced.stats.starttime
+                             - trace.stats.starttime) * sr))
+        trace_key = KurtosisCache.trace_key(trace)
+        log('Pre-filtering data for kurtosis in %s bands', 'debug',
+            self.params.frequency_bands)
+        B = [self._cached(('bandpass', trace_key, tuple(FB)),
+                          _bandpass_array, trace.data, FB, sr)
+             [i_first: i_first + npts]
+             for FB in self.params.frequency_bands]
+
+        log('Calculating kurtosis of filtered data using %s-s windows',
+            'debug', self.params.window_lengths)
+        dl = sliced.stats.endtime - sliced.stats.starttime
+        K = []
+        for win_len in self.params.window_lengths:
+            if win_len > dl:
+                warnings.warn('Kurtosis window > data window ('
+                              f'{win_len:.3g}s > {dl:.3g}s), skipping!')
+                continue
+            win_samps = min(int(np.floor(win_len * sr)) + 1, npts)
+            for b, FB in zip(B, self.params.frequency_bands):
+                K.append(self._cached(
+                    ('kurtosis', trace_key, tuple(FB), i_first, npts,
+                     win_samps, self.params.moments_method),
+                    _kurtosis_array, b, win_samps, sr,
+                    self.params.moments_method))
+        if len(K) == 0:
+            raise ValueError('All kurtosis windows are longer than the data')
+        K = np.array(K)
+        n_smooth = int(self.params.n_smooth)
+        C = lfilter(np.ones(n_smooth) / n_smooth, 1., K, axis=-1)
+        C = _f_cumul_array(C)
+        C = _detrend_simple_array(C)
+
+        self.mean_kurtosis = sliced.with_data(K.mean(axis=0))
+        self.mean_cumulative_kurtosis = sliced.with_data(C.mean(axis=0))
+
+    def _cached(self, key, func, *args):
+        """
+        Return func(*args), from self.cache if possible
+        """
+        if self.cache is None:
+            return func(*args)
+        return self.cache.get(key, func, *args)
+
+    def _calc_kurtocum_trace(self, trace, starttime, endtime):
+        """
+        Calculate cumulative kurtosis using one Trace for each band/window
+
+        :param trace: the raw trace
+        :param starttime: is the first time of interest
+        :param endtime: is the last time of interest
+        """
         # Filter traces in different frequency bands
         B = []
-        log('Pre-filtering data for kurtosis in {} bands'.format(
-            self.params.frequency_bands), 'debug')
+        log('Pre-filtering data for kurtosis in %s bands', 'debug',
+            self.params.frequency_bands)
         for FB in self.params.frequency_bands:
             f = trace.copy()
             f.detrend('demean')
@@ -140,14 +287,14 @@ class Kurtosis():
 
         # 2-level lists: : 1st dim: window_lengths, 2nd dim: freq bands
         K, C = [], []  # all kurtoses and all cumulative, detrended kurtoses
-        log('Calculating kurtosis of filtered data using {}-s windows'
-            .format(self.params.window_lengths), 'debug')
+        log('Calculating kurtosis of filtered data using %s-s windows',
+            'debug', self.params.window_lengths)
         for win_len in self.params.window_lengths:
             corr_cums, kurtos = self.calc_cum_kurtoses(B, win_len)
             C.extend(corr_cums)
             K.extend(kurtos)
-        self.mean_kurtosis = _mean_trace(K)
-        self.mean_cumulative_kurtosis = _mean_trace(C)
+        self.mean_kurtosis = ArrayTrace.from_trace(_mean_trace(K))
+        self.mean_cumulative_kurtosis = ArrayTrace.from_trace(_mean_trace(C))
 
     def calc_cum_kurtoses(self, B, win_len):
         """
@@ -165,7 +312,7 @@ class Kurtosis():
                               f'{win_len:.3g}s > {dl:.3g}s), skipping!')
                 continue
             win_samps = min(int(np.floor(win_len * sr)) + 1, len(tr.data))
-            k = _fast_kurtosis(tr, win_samps)
+            k = _fast_kurtosis(tr, win_samps, self.params.moments_method)
             filt = smooth_filter(k, self.params.n_smooth)
             corr_cum, _ = _f_cumul(filt.copy())
             corr_cum.detrend('simple')
@@ -253,11 +400,10 @@ class Kurtosis():
             smoothest to roughest.  value is approx height of the kurtosis jump
         """
         extrema, gradients = [], []
-        # Put the strongest smoothing first
-        self.params.extrema_smoothings.sort(reverse=True)
-        # sorted_smooth = sorted(self.params.extrema_smoothings, reverse=True)
-        # self.params.extrema_smoothings = sorted_smooth = sorted(
-        for smoothing in self.params.extrema_smoothings:
+        # Put the strongest smoothing first (without sorting the parameters
+        # in place, they can be shared between threads)
+        sorted_smooth = sorted(self.params.extrema_smoothings, reverse=True)
+        for smoothing in sorted_smooth:
             v_smooth = smooth_filter(self.mean_cumulative_kurtosis, smoothing)
             v_smooth = _cum2grad(v_smooth, normalize)
             ext_indices = _loca_ext(v_smooth, ext_type)
@@ -268,6 +414,174 @@ class Kurtosis():
         return extrema
 
 
+class StreamingKurtosis():
+    """
+    Chunk-wise calculation of the 'array' engine's kurtoses
+
+    Successive chunks of a trace are given to process(), which keeps the
+    bandpass filters' second-order-section states, the sliding-moment and
+    smoothing filter states and the cumulative kurtoses between calls, so
+    that long records can be processed with bounded memory.
+
+    The outputs are the mean kurtosis and the mean cumulative kurtosis
+    that Kurtosis.calc_kurtocum() calculates on the whole trace, before
+    the cumulative kurtosis is detrended: detrend() a slice of it to get
+    the mean_cumulative_kurtosis of that time span.  They match except
+    within the filters' transients at the start (the data offset is taken
+    from the first chunk instead of the whole trace and the filtered data
+    are not demeaned again) and at the first and last samples of a slice
+    (where the batch calculation uses one-sided gradients).  The moments
+    are always calculated using lfilter().
+
+    The cumulative kurtosis's gradient at a sample needs the next sample,
+    so the outputs lag the input by one sample: call flush() after the last
+    chunk to get the last sample.
+
+    >>> sk = StreamingKurtosis(params, trace.stats.sampling_rate,
+    ...                        trace.stats.starttime)
+    >>> for i in range(0, trace.stats.npts, 100000):
+    ...     kurt, cum = sk.process(trace.data[i: i + 100000])
+    >>> kurt, cum = sk.flush()
+    """
+    def __init__(self, params, sampling_rate, starttime=UTCDateTime(0)):
+        """
+        :param params: KurtosisParameters object
+        :param sampling_rate: data sampling rate
+        :param starttime: time of the first sample
+        """
+        self.params = params
+        self.sampling_rate = sampling_rate
+        self.starttime = starttime
+        self._sos = [FILTER_BANK.sos(FB, sampling_rate)
+                     for FB in params.frequency_bands]
+        self._sos_zi = [np.zeros((sos.shape[0], 2)) for sos in self._sos]
+        self._win_samps = [max(int(np.floor(w * sampling_rate)) + 1, 2)
+                           for w in params.window_lengths]
+        n_bands = len(params.frequency_bands)
+        self._moments_zi = [(np.zeros((n_bands, w - 1)),
+                             np.zeros((n_bands, w - 1)))
+                            for w in self._win_samps]
+        n_smooth = int(params.n_smooth)
+        self._smooth_b = np.ones(n_smooth) / n_smooth
+        self._smooth_zi = np.zeros((n_bands * len(self._win_samps),
+                                    n_smooth - 1))
+        self._offset = None
+        self._held = np.zeros((n_bands * len(self._win_samps), 0))
+        self._held_kurtosis = np.zeros(0)
+        self._cumulative = None
+        self.n_samples = 0   # input samples
+        self.n_emitted = 0   # output samples
+
+    def process(self, data):
+        """
+        Process the next chunk of data
+
+        :param data: the chunk's samples (the first chunk should contain
+            at least one second of data, used to start the moment filters)
+        :returns: mean kurtosis, mean cumulative kurtosis (ArrayTraces,
+            starting at the first sample not returned yet)
+        """
+        data = np.require(data, dtype=np.float64)
+        if len(data) == 0:
+            return self._outputs(self._held_kurtosis[:0], self._held[:, :0])
+        if self._offset is None:
+            self._offset = data.mean()
+        K = self._kurtosis(data - self._offset)
+        self.n_samples += len(data)
+        C, self._smooth_zi = lfilter(self._smooth_b, 1., K, axis=-1,
+                                     zi=self._smooth_zi)
+        return self._emit(np.nan_to_num(C, nan=0.), K.mean(axis=0))
+
+    def flush(self):
+        """
+        Return the last sample (no more data can be processed)
+
+        :returns: mean kurtosis, mean cumulative kurtosis (ArrayTraces)
+        """
+        held, n_held = self._held, self._held.shape[-1]
+        kurt = self._held_kurtosis
+        if self._cumulative is None:
+            cum = np.zeros((held.shape[0], n_held))
+        elif n_held == 2:
+            # One-sided gradient, as at the end of a batch calculation
+            cum = self._cumulative[:, None] + np.maximum(
+                held[:, 1:] - held[:, :1], 0)
+        else:
+            cum = held[:, :0]
+        self._held = held[:, :0]
+        self._held_kurtosis = kurt[:0]
+        return self._outputs(kurt, cum)
+
+    @staticmethod
+    def detrend(cumulative):
+        """
+        Return a cumulative kurtosis slice with its first-to-last line
+        removed (the Kurtosis.mean_cumulative_kurtosis of that time span)
+
+        :param cumulative: mean cumulative kurtosis ArrayTrace
+        """
+        return cumulative.with_data(_detrend_simple_array(cumulative.data))
+
+    def _kurtosis(self, data):
+        """
+        Return the kurtoses (one row per (window_length, frequency_band),
+        in the same order as in Kurtosis._calc_kurtocum_array())
+        """
+        B = np.empty((len(self._sos), len(data)))
+        for i, sos in enumerate(self._sos):
+            B[i], self._sos_zi[i] = sosfilt(sos, data, zi=self._sos_zi[i])
+        first = self.n_samples == 0
+        K = []
+        for i, win_samps in enumerate(self._win_samps):
+            x = B
+            if first:
+                # Same starting buffer as _kurtosis_array()
+                one_sec = int(self.sampling_rate)
+                buffer = np.tile(B[:, :one_sec],
+                                 int(np.ceil(win_samps / one_sec)))
+                x = np.concatenate((buffer[:, :win_samps], B), axis=-1)
+            a = np.ones(win_samps) / win_samps
+            zi_2, zi_4 = self._moments_zi[i]
+            m_2, zi_2 = lfilter(a, 1., x**2, axis=-1, zi=zi_2)
+            m_4, zi_4 = lfilter(a, 1., x**4, axis=-1, zi=zi_4)
+            self._moments_zi[i] = (zi_2, zi_4)
+            k = np.divide(m_4, m_2 ** 2)
+            K.append(k[:, win_samps:] if first else k)
+        return np.concatenate(K)
+
+    def _emit(self, C, kurtosis):
+        """
+        Return the samples whose cumulative kurtosis can be calculated
+
+        :param C: new smoothed kurtoses (one row per window and band)
+        :param kurtosis: new mean kurtoses
+        """
+        full = np.concatenate((self._held, C), axis=-1)
+        kurt = np.concatenate((self._held_kurtosis, kurtosis))
+        if full.shape[-1] < 2:
+            self._held, self._held_kurtosis = full, kurt
+            return self._outputs(kurt[:0], full[:, :0])
+        # Central gradient of each sample having a previous and next sample
+        grad = np.maximum((full[:, 2:] - full[:, :-2]) / 2, 0)
+        if self._cumulative is None:
+            # The first cumulative value is zero
+            self._cumulative = np.zeros(full.shape[0])
+            grad = np.concatenate((np.zeros((full.shape[0], 1)), grad),
+                                  axis=-1)
+        cum = self._cumulative[:, None] + np.cumsum(grad, axis=-1)
+        if cum.shape[-1] > 0:
+            self._cumulative = cum[:, -1]
+        # Keep the last returned sample and the unreturned one
+        self._held, self._held_kurtosis = full[:, -2:], kurt[-1:]
+        return self._outputs(kurt[:-1], cum)
+
+    def _outputs(self, kurt, cum):
+        starttime = self.starttime + self.n_emitted / self.sampling_rate
+        self.n_emitted += len(kurt)
+        return (ArrayTrace(kurt, starttime, self.sampling_rate),
+                ArrayTrace(cum.mean(axis=0), starttime, self.sampling_rate))
+
+
 def _find_close_extrema(best_extrem, finer_extrema, max_diff=40):
     if len(finer_extrema) == 0:
         warnings.warn('No extrema found for {:d}-sample smoothing'.format(
@@ -308,7 +622,7 @@ def _select_extrema(extrema, N, order='max', threshold=0.1):
     return selected
 
 
-def _fast_kurtosis(trace, win_samps):
+def _fast_kurtosis(trace, win_samps, moments_method='lfilter'):
     """
     Compute kurtosis quickly using "filter" function
 
@@ -316,10 +630,54 @@ def _fast_kurtosis(trace, win_samps):
 
     :param trace: one trace
     :param win_samps: number of samples in the sliding window
+    :param moments_method: how to calculate the sliding moments ('lfilter'
+        or 'cumsum', see _kurtosis_array())
     :returns: Kurtosis trace
     """
     assert isinstance(trace, Trace), "trace is not an obspy Trace"
     out = trace.copy()
+    out.data = _kurtosis_array(trace.data, win_samps,
+                               trace.stats.sampling_rate, moments_method)
+    # Protect against edge effect
+    # out.data[:win_samps] = out.data[win_samps]
+
+    # Set any kurtosis value to nan for any indices within win_samples of
+    # an NaN in the original data.
+    # I think this is outdated, should just trim
+    # for i in np.nonzero(trace.data == np.nan)[0]:
+    #     if i:
+    #         out.data[i: i + win_samps] = np.nan
+    return out
+
+
+def _bandpass_array(data, band, sampling_rate):
+    """
+    Demean and bandpass filter data (same as the 'trace' engine's filtering)
+
+    :param data: data array
+    :param band: [low, high] frequency band
+    :param sampling_rate: sampling rate
+    """
+    data = np.require(data, dtype=np.float64)
+    return FILTER_BANK.bandpass(data - data.mean(), band, sampling_rate,
+                                corners=3)
+
+
+def _kurtosis_array(data, win_samps, sampling_rate, moments_method='lfilter'):
+    """
+    Compute the sliding-window kurtosis of each row of an array
+
+    :param data: 1-D or 2-D array (one row per signal)
+    :param win_samps: number of samples in the sliding window
+    :param sampling_rate: sampling rate (used to make the starting buffer)
+    :param moments_method: how to calculate the sliding 2nd and 4th moments
+        'lfilter': win_samps-tap FIR filter, cost proportional to win_samps
+        'cumsum': difference of cumulative sums, cost independent of
+                  win_samps (see rolling_mean())
+    :returns: kurtosis array, one row per (input row), same shape as data
+    """
+    data = np.require(data, dtype=np.float64)
+    data = data - data.mean(axis=-1, keepdims=True)
     win_samps = int(round(win_samps))
     # log(f'{win_samps=}', 'debug')
     if win_samps == 1:
@@ -327,30 +685,23 @@ def _fast_kurtosis(trace, win_samps):
     a = np.divide(np.ones(win_samps), float(win_samps))
     b = 1.
 
-    f = trace.copy()
-    f.detrend(type='demean')
     # Make buffer using first second of data
-    one_sec = int(trace.stats.sampling_rate)
-    buffer = np.tile(f.data[:one_sec], int(np.ceil(win_samps/one_sec)))
-    data = np.concatenate((buffer[:win_samps], f.data))
+    one_sec = int(sampling_rate)
+    buffer = np.tile(data[..., :one_sec], int(np.ceil(win_samps/one_sec)))
+    data = np.concatenate((buffer[..., :win_samps], data), axis=-1)
     # data = np.concatenate((np.ones(win_samps)*f.data[0], f.data))
 
     # Compute kurtosis
-    m_2 = lfilter(a, b, data**2)
-    m_4 = lfilter(a, b, data**4)
-    out.data = np.divide(m_4, (m_2 ** 2))
+    if moments_method == 'cumsum':
+        m_2 = rolling_mean(data**2, win_samps)
+        m_4 = rolling_mean(data**4, win_samps)
+    elif moments_method == 'lfilter':
+        m_2 = lfilter(a, b, data**2, axis=-1)
+        m_4 = lfilter(a, b, data**4, axis=-1)
+    else:
+        raise ValueError(f"moments_method '{moments_method}' unknown")
     # Cut off buffer
-    out.data = out.data[win_samps:]
-    # Protect against edge effect
-    # out.data[:win_samps] = out.data[win_samps]
-
-    # Set any kurtosis value to nan for any indices within win_samples of
-    # an NaN in the original data.
-    # I think this is outdated, should just trim
-    # for i in np.nonzero(trace.data == np.nan)[0]:
-    #     if i:
-    #         out.data[i: i + win_samps] = np.nan
-    return out
+    return np.divide(m_4, (m_2 ** 2))[..., win_samps:]
 
 
 def _f_cumul(f):
@@ -398,6 +749,33 @@ def _f_cumul(f):
         return g, p
 
 
+def _f_cumul_array(data):
+    """
+    Calculate the positive gradient cumulative of each row of an array
+
+    Same as _f_cumul(), for arrays
+    :param data: 1-D or 2-D array (one row per signal)
+    :returns: cumulative array, first value of each row = 0
+    """
+    data = np.nan_to_num(data, nan=0.)
+    grad = np.gradient(data, axis=-1)
+    grad[grad < 0] = 0
+    cum = np.cumsum(grad, axis=-1)
+    return cum - cum[..., :1]
+
+
+def _detrend_simple_array(data):
+    """
+    Subtract the line between the first and last values of each row
+
+    Same as Trace.detrend('simple'), for arrays
+    :param data: 1-D or 2-D array (one row per signal)
+    """
+    ndat = data.shape[-1]
+    x1, x2 = data[..., :1], data[..., -1:]
+    return data - (x1 + np.arange(ndat) * (x2 - x1) / float(ndat - 1))
+
+
 def _f_segment(f):
     """
     Return a line segment between the first and last values of function.
@@ -444,7 +822,7 @@ def _cum2grad(f_in, normalize=False, debug=False):
     all values > 0.  Give negative values that "jump" up to zero at the next
     peak
 
-    :param f_in: cumulative trace
+    :param f_in: cumulative ArrayTrace
     :param normalize: 'True' will divide the output by it's min value
     :returns: f_out
     """
@@ -469,13 +847,12 @@ def _cum2grad(f_in, normalize=False, debug=False):
     for j in range(len(tikxs)-2, -1, -1):
         tycalpha[tikxs[j]:tikxs[j+1]+1] = f_in.data[tikxs[j+1]]
 
-    f_out = f_in.copy()
-    f_out.data -= tycalpha          # input minus the next peak value
+    f_out = f_in.with_data(f_in.data - tycalpha)  # minus the next peak value
     f_out.data[f_out.data > 0] = 0  # Get rid of everything above zero
     if normalize:
         f_out.data /= abs(min(f_out.data))
     if debug:
-        Stream([f_in, f_out]).plot()
+        Stream([f_in.to_trace(), f_out.to_trace()]).plot()
     return f_out
 
 
@@ -485,19 +862,18 @@ def _loca_ext(trace, ext_type, starttime=None, endtime=None, debug=False):
 
     Actually just returns where the trace slope changes from positive to
     negative (ext_type=='maxi'), or vice versa (type='mini')
-    :param trace: waveform trace
+    :param trace: waveform ArrayTrace
     :param ext_type: 'maxi' or 'mini'
     :param start_time: start of window to look at
     :param end_time: end of window to look at
     :returns: indices
     """
     assert ext_type in ('mini', 'maxi')
-    diff = trace.copy()
-    diff.data = np.diff(np.sign(np.diff(trace.data)), prepend=0)
+    diff = trace.with_data(np.diff(np.sign(np.diff(trace.data)), prepend=0))
     if starttime is not None or endtime is not None:
         diff.trim(starttime, endtime)
     if debug:
-        diff.plot()
+        diff.to_trace().plot()
     if ext_type == 'maxi':
         loc = (diff.data < 0)
     else:
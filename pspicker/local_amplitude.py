@@ -1,12 +1,9 @@
 from dataclasses import dataclass
 
 import numpy as np
-from matplotlib import pyplot as plt
-from matplotlib.patches import Rectangle
 from scipy.signal import find_peaks
 from obspy.core.event.magnitude import Amplitude
 from obspy.core.event.origin import Pick
-from obspy.signal.invsim import estimate_wood_anderson_amplitude
 
 from .logger import log
 from .paz import PAZ
@@ -79,7 +76,8 @@ class LocalAmplitude():
         return s
 
     def get_iaml(self, plot=False, method='wood_calc', 
-                 pre_filt=(0.005, 0.006, 30.0, 35.), verbose=False):
+                 pre_filt=(0.005, 0.006, 30.0, 35.), verbose=False,
+                 plot_file=None):
         """
         get IAML amplitude and associated pick
         From IAPEI CoSOI 2013 Working Group recommentations:
@@ -125,6 +123,8 @@ class LocalAmplitude():
                             to displacement
             pre_filt (tuple): pre_filter to apply to trace.simulate() to
                               prevent amplifying noise.
+            plot_file (str): if plot is True, save the plot to this file
+                             instead of showing it (see plot())
 
         Returns:
             tuple containing:
@@ -176,6 +176,8 @@ class LocalAmplitude():
             return None, None
         if method == 'wood_est':
             # simulated zero to peak disp amplitude on WA seismometer(mm)
+            # (obspy.signal imports matplotlib)
+            from obspy.signal.invsim import estimate_wood_anderson_amplitude
             amp.value = estimate_wood_anderson_amplitude(
                 paz_remove.to_obspy(), 2*amp.value, amp.period)
             # Divide by 2080 then multiply by 1e6 to get ground motion in nm?
@@ -186,8 +188,7 @@ class LocalAmplitude():
         # print(f'{plot=}')
         if plot:
             # print(amp)
-            self.plot(signal, amp, method, plot_units)
-            plt.show()
+            self.plot(signal, amp, method, plot_units, plot_file)
         waveform_id = self.ref_pick.waveform_id
         waveform_id.channel_code = amp.channel
         pick = Pick(time=amp.time,
@@ -238,7 +239,7 @@ class LocalAmplitude():
                     .format(len(pick), pick[0].phase_hint[0], pick), 'error')
             return pick[0]
 
-    def plot(self, transformed, amp, method, trans_units):
+    def plot(self, transformed, amp, method, trans_units, filename=None):
         """
         Plot the amplitude pick
 
@@ -251,8 +252,19 @@ class LocalAmplitude():
             amp (Amp): pk2pk output
             method (str): method used
             trans_units (str): y-axis label for transformed traces
+            filename (str): save the figure to this file (format given by
+                            the suffix) instead of showing it.  The figure
+                            is drawn with no GUI and nothing blocks
         """
-        fig, axs = plt.subplots(3, 1, num=f'{method} Local Amplitude {self.station}')
+        from matplotlib import pyplot as plt
+        from matplotlib.figure import Figure
+        from matplotlib.patches import Rectangle
+
+        if filename is None:
+            fig, axs = plt.subplots(3, 1, num=f'{method} Local Amplitude {self.station}')
+        else:
+            fig = Figure()
+            axs = fig.subplots(3, 1)
         traces = self.traces.slice(self.win_start, self.win_end)
         transcut = transformed.slice(self.win_start, self.win_end)
         imin = transcut[0].times('utcdatetime').searchsorted(amp.time)
@@ -312,7 +324,10 @@ class LocalAmplitude():
                     marker='x')
         axs[2].set_ylabel(trans_units)
 
-        plt.tight_layout()
+        fig.tight_layout()
+        if filename is not None:
+            fig.savefig(filename)
+            return
         plt.draw()
         plt.show()
         # plt.show(block=False)
@@ -1,16 +1,21 @@
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import multiprocessing
 import verboselogs
 # import sys
-import inspect
 from datetime import datetime
 
 # from obspy.core import UTCDateTime
 #
 logger_name = 'pspicker'
+# Configured by setup_log(), but lets log() be called before
+verboselogs.install()   # Sets VerboseLogger as the default Logger
+logger = logging.getLogger(logger_name)
+# Level names already converted to numbers
+_levels = {}
 
 
 # Set up Filter to not output logs from other programs to file handler
-# (because it requires the "caller" variable)
 class NoParsingFilter(logging.Filter):
     def filter(self, record):
         return record.name == logger_name
@@ -50,7 +55,7 @@ def setup_log(stream_log_level=logging.INFO,
 
     # Set up Formatters
     lf = logging.Formatter('%(asctime)s %(levelname)-8s - '
-                           '%(message)s (in %(caller)s)')
+                           '%(message)s (in %(funcName)s())')
     cf = logging.Formatter('%(levelname)-8s %(message)s')
 
     # Set up Handlers
@@ -72,18 +77,76 @@ def setup_log(stream_log_level=logging.INFO,
     print(f'{logger.handlers=}')
 
 
-def log(string, level="info"):
+def log(string, level="info", *args):
     """
     Prints a string and logs to file
 
-    :param level: the log level
+    Returns immediately if the level is not logged.  The caller's name is
+    found by the logging module, and only if the message is logged
+
+    :param string: the message.  If args are given, it is a %-format string
+        that is only formatted if the message is logged
+    :param level: the log level (name or number)
+    :param args: values to insert into the string
+    """
+    try:
+        level = _levels[level]
+    except KeyError:
+        _levels[level] = level = _level_number(level)
+    if not logger.isEnabledFor(level):
+        return
+    # stacklevel=2 attributes the record to the function calling log()
+    logger.log(level, string, *args, stacklevel=2)
+
+
+def _level_number(level):
+    """
+    Return the number corresponding to a log level name
+
+    :param level: level name (any case) or number
     """
-    caller = inspect.stack()[1]
-    caller_str = caller[3] + '()'
-    level = level.upper()
-    extra = {'caller': caller_str}
+    if isinstance(level, str):
+        return getattr(logging, level.upper())
+    return level
 
-    level = getattr(logging, level.upper())
 
+def get_log_level():
+    """
+    Return the level of the pspicker logger
+    """
     global logger
-    logger.log(level, string, extra=extra)
+    return logger.level
+
+
+def start_log_listener():
+    """
+    Forward log records from worker processes to this process's handlers
+
+    Call setup_log() first
+    :returns: queue to pass to setup_worker_log(), QueueListener (stop()
+        it once the workers are finished)
+    """
+    global logger
+    queue = multiprocessing.Queue(-1)
+    listener = QueueListener(queue, *logger.handlers,
+                             respect_handler_level=True)
+    listener.start()
+    return queue, listener
+
+
+def setup_worker_log(queue, log_level):
+    """
+    Send a worker process's log records to the queue of start_log_listener()
+
+    :param queue: queue returned by start_log_listener()
+    :param log_level: lowest level to send
+    """
+    verboselogs.install()
+
+    global logger
+    logger = logging.getLogger(logger_name)
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+    logger.setLevel(log_level)
+    logger.addHandler(QueueHandler(queue))
+    logging.captureWarnings(True)
@@ -0,0 +1,115 @@
+"""
+Parameter sweeps: picks obtained with each combination of parameter values
+"""
+import copy
+import csv
+import itertools
+import json
+from pathlib import Path
+
+# PickerParameters attributes (other override names are StationParameters
+# attributes, applied to every station)
+PICKER_ATTRIBUTES = ('gw', 'SNR', 'polarity', 'assoc', 'channel_mapping_rules')
+
+
+class ParameterSweep():
+    """
+    A grid of parameter overrides and the picks made with each combination
+
+    Override names are dotted attribute paths.  Names starting with 'gw',
+    'SNR', 'polarity', 'assoc' or 'channel_mapping_rules' apply to the
+    corresponding PickerParameters attribute, others apply to each
+    station's StationParameters.
+
+    >>> sweep = ParameterSweep({'kurtosis.window_lengths': [[0.5, 1, 2],
+    ...                                                     [1, 2, 4]],
+    ...                         'SNR.threshold_parameter': [0.2, 0.3]})
+    >>> len(sweep)   # 4 combinations
+    """
+    def __init__(self, overrides):
+        """
+        :param overrides: dict with key=override name, value=list of values
+        """
+        self.overrides = dict(overrides)
+        self.combinations = [dict(zip(self.overrides.keys(), values))
+                             for values in itertools.product(
+                                 *self.overrides.values())]
+        self.picks = []
+
+    def __len__(self):
+        return len(self.combinations)
+
+    def __str__(self):
+        return (f'ParameterSweep: {len(self):d} combinations of '
+                f'{", ".join(self.overrides.keys())}, {len(self.picks):d} '
+                'picks')
+
+    @staticmethod
+    def apply(params, overrides):
+        """
+        Return a copy of PickerParameters with overridden values
+
+        :param params: PickerParameters object
+        :param overrides: dict with key=override name, value=value
+        """
+        params = copy.deepcopy(params)
+        for name, value in overrides.items():
+            path = name.split('.')
+            if path[0] in PICKER_ATTRIBUTES:
+                targets = [params]
+            else:
+                targets = list(params.station_parameters.values())
+            for target in targets:
+                for attr in path[:-1]:
+                    target = getattr(target, attr)
+                if not hasattr(target, path[-1]):
+                    raise ValueError(f"Unknown parameter '{name}'")
+                setattr(target, path[-1], copy.deepcopy(value))
+        return params
+
+    def add(self, combination, event, picks, quality_thresholds=None):
+        """
+        Add the picks made on one event with one combination
+
+        :param combination: index of the combination
+        :param event: event name
+        :param picks: list of PickCandidates
+        :param quality_thresholds: SNR quality thresholds (to give the
+            pick weights)
+        """
+        for p in sorted(picks, key=lambda x: (x.station, x.phase_guess)):
+            self.picks.append({
+                'combination': combination, 'event': str(event),
+                'station': p.station, 'phase': p.phase_guess,
+                'time': str(p.time), 'snr': p.snr,
+                'weight': p._get_weight(quality_thresholds)})
+
+    def to_dict(self):
+        return {'overrides': self.overrides,
+                'combinations': self.combinations,
+                'picks': self.picks}
+
+    def write(self, filename):
+        """
+        Write to a JSON or CSV file
+
+        The CSV file has one line per pick, with the combination's index
+        and override values
+
+        :param filename: output file name (CSV if it ends in '.csv', JSON
+            otherwise)
+        """
+        if Path(filename).suffix.lower() != '.csv':
+            with open(filename, 'w') as fp:
+                json.dump(self.to_dict(), fp, indent=2)
+            return
+        names = list(self.overrides.keys())
+        columns = ['event', 'station', 'phase', 'time', 'snr', 'weight']
+        with open(filename, 'w', newline='') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(['combination'] + names + columns)
+            for p in self.picks:
+                combination = self.combinations[p['combination']]
+                writer.writerow([p['combination']]
+                                + [json.dumps(combination[n]) for n in names]
+                                + [p[c] for c in columns])
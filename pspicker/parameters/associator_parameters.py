@@ -15,7 +15,15 @@ class AssociatorParameters():
                  otime_vp_vs=1.75,
                  distri_min_values=4,
                  distri_nstd_picks=3.2,
-                 distri_nstd_delays=4):
+                 distri_nstd_delays=4,
+                 velocity_model=None,
+                 target_depth=10.,
+                 max_offset=1.,
+                 station_file=None,
+                 grid_spacing=2.,
+                 grid_margin=20.,
+                 grid_depths=(0., 5., 10., 15., 20., 30.),
+                 location_tolerance=0.5):
         """
         Initialize Associator Parameters
 
@@ -32,8 +40,26 @@ class AssociatorParameters():
         :param distri_nstd_picks: maximum number of deviations from
             standard distribution to accept for P picks, and for S picks
         :param distri_nstd_delays: same as above, for P-S delays
+        :param velocity_model: velocity model to calculate origin times
+            from P-S delays (obspy taup model name or path of a .nd or .tvel
+            file).  None: use otime_vp_vs
+        :param target_depth: event depth (km) for the velocity model delays
+        :param max_offset: maximum distance (degrees) for the velocity model
+            delays
+        :param station_file: StationXML file with the station coordinates
+            (needed by the 'location' method)
+        :param grid_spacing: horizontal spacing (km) of the 'location'
+            method's hypocentre grid
+        :param grid_margin: distance (km) that the hypocentre grid extends
+            beyond the outermost stations
+        :param grid_depths: depths (km) of the hypocentre grid
+        :param location_tolerance: maximum origin time residual (s) of
+            picks associated by the 'location' method
         """
-        assert method in ['origin_time', 'arrival_time']
+        assert method in ['origin_time', 'arrival_time', 'location']
+        if method == 'location':
+            assert station_file is not None, \
+                "The 'location' method needs a station_file"
         self.method = method
         self.cluster_window_otime = otime_vp_vs
         self.otime_vp_vs = otime_vp_vs
@@ -42,6 +68,14 @@ class AssociatorParameters():
         self.distri_min_values = float(distri_min_values)
         self.distri_nstd_picks = distri_nstd_picks
         self.distri_nstd_delays = distri_nstd_delays
+        self.velocity_model = velocity_model
+        self.target_depth = target_depth
+        self.max_offset = max_offset
+        self.station_file = station_file
+        self.grid_spacing = grid_spacing
+        self.grid_margin = grid_margin
+        self.grid_depths = grid_depths
+        self.location_tolerance = location_tolerance
 
     def __str__(self):
         str = "AssociatorParameters:\n"
@@ -54,6 +88,14 @@ class AssociatorParameters():
         str += f"    distri_min_values = {self.distri_min_values}\n"
         str += f"    distri_nstd_picks = {self.distri_nstd_picks}\n"
         str += f"    distri_nstd_delays = {self.distri_nstd_delays}\n"
+        str += f"    velocity_model = {self.velocity_model}\n"
+        str += f"    target_depth = {self.target_depth}\n"
+        str += f"    max_offset = {self.max_offset}\n"
+        str += f"    station_file = {self.station_file}\n"
+        str += f"    grid_spacing = {self.grid_spacing}\n"
+        str += f"    grid_margin = {self.grid_margin}\n"
+        str += f"    grid_depths = {self.grid_depths}\n"
+        str += f"    location_tolerance = {self.location_tolerance}\n"
         return str
 
     @classmethod
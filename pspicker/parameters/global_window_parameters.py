@@ -10,7 +10,8 @@ class GlobalWindowParameters():
                  offsets,
                  distri_secs,
                  max_candidates=5,
-                 end_cutoff=0.9):
+                 end_cutoff=0.9,
+                 distri_method='sweep'):
         """
         Initialize Global Window Parameters
 
@@ -23,8 +24,14 @@ class GlobalWindowParameters():
             time for global (all station based) rewindowing [left, right]
         :param end_cutoff: What fraction of data (from start) to
             look at for global Kurtosis window. 1.0 looks everywhere
+        :param distri_method: how to find the densest pick time:
+            'sweep': exact center of the densest window
+            'grid': best of 1000 evenly-spaced window centers (the pre-v0.6
+                    behavior)
         """
         assert len(offsets) == 2, "len(offsets) != 2"
+        assert distri_method in ('sweep', 'grid'),\
+            f"distri_method '{distri_method}' unknown"
 
         self.kurtosis = KurtosisParameters(**kurtosis)
         assert len(self.kurtosis.frequency_bands) == 1
@@ -32,6 +39,7 @@ class GlobalWindowParameters():
         self.end_cutoff = end_cutoff
         self.distri_secs = distri_secs
         self.max_candidates = max_candidates
+        self.distri_method = distri_method
 
     def __str__(self):
         str = "GlobalWindowParameters:\n"
@@ -40,6 +48,7 @@ class GlobalWindowParameters():
         str += f"    offsets = {self.offsets}\n"
         str += f"    end_cutoff = {self.end_cutoff}\n"
         str += f"    max_candidates = {self.max_candidates}\n"
+        str += f"    distri_method = '{self.distri_method}'\n"
         return str
 
     @classmethod
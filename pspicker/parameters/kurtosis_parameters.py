@@ -3,7 +3,8 @@ class KurtosisParameters():
     Kurtosis Parameters
     """
     def __init__(self, frequency_bands, window_lengths,
-                 extrema_smoothings=[40], n_smooth=1):
+                 extrema_smoothings=[40], n_smooth=1, engine='array',
+                 moments_method='lfilter'):
         """
         :param frequency_bands: frequency bands to filter data before
             calculating kurtosis
@@ -16,6 +17,16 @@ class KurtosisParameters():
         :type extrema_smoothings: list of ints
         :param n_smooth: samples over which to smooth kurtosis
         :type n_smooth: samples over which to smooth kurtosis
+        :param engine: how to calculate the kurtoses over all
+            frequency_bands and window_lengths
+            'array': in one 2-D array (faster)
+            'trace': one Trace per band and window
+        :type engine: str
+        :param moments_method: how to calculate the sliding-window moments
+            'lfilter': FIR filter (cost proportional to the window length)
+            'cumsum': cumulative sums (cost independent of the window
+                      length, differs from 'lfilter' by rounding errors)
+        :type moments_method: str
         """
         assert isinstance(frequency_bands, list)
         assert isinstance(window_lengths, list)
@@ -26,17 +37,24 @@ class KurtosisParameters():
             assert isinstance(x, (int, float))
         for x in extrema_smoothings:
             assert isinstance(x, int)
+        assert engine in ('array', 'trace'), f"engine '{engine}' unknown"
+        assert moments_method in ('lfilter', 'cumsum'),\
+            f"moments_method '{moments_method}' unknown"
 
         self.frequency_bands = frequency_bands
         self.window_lengths = window_lengths
         self.extrema_smoothings = extrema_smoothings
         self.n_smooth = n_smooth
+        self.engine = engine
+        self.moments_method = moments_method
 
     def __str__(self):
         str = "KurtosisParmeters("
         str += f"frequency_bands = {self.frequency_bands}, "
         str += f"window_lengths = {self.window_lengths}, "
-        str += f"extrema_smoothings = {self.extrema_smoothings})"
+        str += f"extrema_smoothings = {self.extrema_smoothings}, "
+        str += f"engine = '{self.engine}', "
+        str += f"moments_method = '{self.moments_method}')"
         return str
 
     @classmethod
@@ -1,3 +1,6 @@
+from ..timer import StageTimer
+
+
 class PickerRunParameters():
     """
     Parameters associated with the run of one event
@@ -9,7 +12,9 @@ class PickerRunParameters():
                  channel_maps=None,
                  first_time=None,
                  last_time=None,
-                 t_begin=None):
+                 t_begin=None,
+                 kurtosis_cache=None,
+                 stages=None):
         """
         :param database_filename: database file to read
         :param wavefile: name of the file containing the waveforms
@@ -19,6 +24,9 @@ class PickerRunParameters():
         :param t_begin: time of reference for overall_distri
         :param first_time: never look before this time
         :param last_time: never look after this time
+        :param kurtosis_cache: KurtosisCache object for this event
+        :param stages: StageTimer object for this event (None: a disabled
+            StageTimer)
         """
         self.database_filename = database_filename
         self.channel_maps = channel_maps
@@ -27,6 +35,10 @@ class PickerRunParameters():
         self.first_time = first_time
         self.last_time = last_time
         self.t_begin = t_begin
+        self.kurtosis_cache = kurtosis_cache
+        if stages is None:
+            stages = StageTimer(enabled=False)
+        self.stages = stages
 
     @property
     def stations(self):
@@ -7,7 +7,8 @@ from obspy.core import Stream  # , Trace
 
 class PickerStationParameters():
     """
-    Parameters associated with work on a single station for one event
+    Parameters and results associated with work on a single station for
+    one event
     """
     def __init__(self,
                  station=None,
@@ -32,6 +33,15 @@ class PickerStationParameters():
         self.dat_noH = self._get_noH_traces(stream)
         self.data_limits = self._find_limits()
         self.t_begin = self._find_first_time()
+        # Results, filled in by PSPicker._pick_one_station()
+        self.energy = None        # EnergySNR object
+        self.trustworthy = False  # is the SNR good enough to pick?
+        self.kurtosis = None      # Kurtosis object
+        self.DR = None            # Dip-Rectilinearity trace
+        self.c_P = None           # P PickCandidate
+        self.c_S = None           # S PickCandidate
+        self.candidates = []      # all PickCandidates
+        self.picks = []           # chosen PickCandidates
 
     def _get_traces(self, stream, comp_list):
         """
@@ -12,7 +12,8 @@ class PolarityParameters():
                  analyze_window=4,
                  DR_threshold_P=0.4,
                  DR_threshold_S=-0.4,
-                 DR_smooth_length=1):
+                 DR_smooth_length=1,
+                 covariance_method='sliding'):
         """
         Initialize Polarity Parameters
 
@@ -24,12 +25,19 @@ class PolarityParameters():
         :param DR_threshold_S: DipRect S-wave threshold
         :param DR_smooth_length: seconds over which to smooth polarity and
             rectilinearity when calculating dip-rect
+        :param covariance_method: how to calculate the windowed covariances
+            'sliding': update the sums as the window slides over consecutive
+                       samples (cost independent of analyze_window)
+            'windows': calculate each window separately
         """
+        assert covariance_method in ('sliding', 'windows'),\
+            f"covariance_method '{covariance_method}' unknown"
         self.calculate_window = calculate_window
         self.analyze_window = analyze_window
         self.DR_threshold_P = DR_threshold_P
         self.DR_threshold_S = DR_threshold_S
         self.DR_smooth_length = DR_smooth_length
+        self.covariance_method = covariance_method
 
     def __str__(self):
         str = "PolarityParameters:\n"
@@ -38,6 +46,7 @@ class PolarityParameters():
         str += f"    DR_threshold_P = {self.DR_threshold_P}\n"
         str += f"    DR_threshold_S = {self.DR_threshold_S}\n"
         str += f"    DR_smooth_length = {self.DR_smooth_length}\n"
+        str += f"    covariance_method = '{self.covariance_method}'\n"
         return str
 
     @classmethod
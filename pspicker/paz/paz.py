@@ -32,7 +32,6 @@ from pathlib import Path
 
 from obspy.core.inventory import read_inventory
 from obspy.core.inventory.response import PolesZerosResponseStage
-from matplotlib import pyplot as plt
 
 
 class PAZ():
@@ -258,6 +257,8 @@ class PAZ():
         :type sym: str
         :param sym: symbol to use on plot
         """
+        from matplotlib import pyplot as plt
+
         paz = self.copy()
         if output == 'DISP':
             paz.input_units = 'm'
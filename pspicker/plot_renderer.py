@@ -0,0 +1,243 @@
+"""
+Record plot inputs while picking and render the figures to files elsewhere
+"""
+import pickle
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+
+from .associator import Associator
+from .logger import log
+from .plotter import Plotter
+
+FIGURE_FORMATS = ('png', 'pdf', 'svg')
+
+
+class PlotRecorder():
+    """
+    Stands in for a Plotter, recording the calls to its windows
+
+    Has the same gw, pw and sw windows as Plotter, but their methods only
+    store their (pickled) arguments, so that picking never waits for
+    matplotlib.  render_plots() replays the calls on a non-interactive
+    Plotter and saves the figures.
+
+    >>> recorder = PlotRecorder(plot_global=True, plot_stations=True)
+    >>> picker._pick_stream(st, sfile, wavefile, recorder, stages)
+    >>> render_plots(recorder.calls, True, True, 'plots/sfile')
+    """
+    def __init__(self, plot_global=True, plot_stations=True):
+        """
+        :param plot_global: record global selection and picks plots
+        :param plot_stations: record individual station plots
+        """
+        self.plot_global = plot_global
+        self.plot_stations = plot_stations
+        self.gw = _WindowRecorder(self, 'gw', plot_global)
+        self.pw = _WindowRecorder(self, 'pw', plot_global)
+        self.sw = _WindowRecorder(self, 'sw', plot_stations)
+        self.calls = []
+
+    def __len__(self):
+        return len(self.calls)
+
+    def __str__(self):
+        return f'PlotRecorder: {len(self):d} calls'
+
+    def record(self, window, method, args, kwargs):
+        """
+        Record a call to a window's method
+
+        The arguments are pickled immediately, so later changes to them
+        (the picks are modified by the association, for example) are not
+        recorded
+
+        :param window: window name ('gw', 'pw' or 'sw')
+        :param method: method name
+        :param args: positional arguments
+        :param kwargs: keyword arguments
+        """
+        args = [_AssociatorSnapshot(x) if isinstance(x, Associator) else x
+                for x in args]
+        kwargs = {k: _AssociatorSnapshot(v) if isinstance(v, Associator)
+                  else v for k, v in kwargs.items()}
+        self.calls.append(pickle.dumps((window, method, args, kwargs),
+                                       protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class _WindowRecorder():
+    """
+    Records the calls to one Plotter window's methods
+    """
+    def __init__(self, recorder, name, plot=True):
+        self.recorder = recorder
+        self.name = name
+        self.plot = plot
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+
+        def record(*args, **kwargs):
+            if self.plot:
+                self.recorder.record(self.name, method, args, kwargs)
+        return record
+
+
+class _AssociatorSnapshot():
+    """
+    The parts of an Associator that Picks_Window uses
+
+    Avoids pickling the Associator's delay tables and travel-time grid
+    """
+    calc_origin_time = staticmethod(Associator.calc_origin_time)
+
+    def __init__(self, assoc):
+        self.p_cluster = dict(assoc.p_cluster)
+        self.s_cluster = dict(assoc.s_cluster)
+        self.o_cluster = dict(assoc.o_cluster)
+
+
+def render_plots(calls, plot_global, plot_stations, basename,
+                 formats=('png',), dpi=100):
+    """
+    Replay recorded Plotter calls and save the figures
+
+    Uses figures that are not managed by pyplot, so nothing is shown and
+    the figures are rendered with the Agg (or PDF, SVG) backend.
+
+    :param calls: PlotRecorder.calls
+    :param plot_global: plot the global selection and picks
+    :param plot_stations: plot the individual stations
+    :param basename: output file path, without the suffix: the figures
+        are written to {basename}_overview.{format},
+        {basename}_picks.{format} and {basename}_{station}.{format}
+    :param formats: figure formats
+    :param dpi: figure resolution (dots per inch)
+    :returns: list of written files
+    """
+    plotter = Plotter(plot_global, plot_stations, interactive=False)
+    figures = []
+    for call in calls:
+        window, method, args, kwargs = pickle.loads(call)
+        getattr(getattr(plotter, window), method)(*args, **kwargs)
+        if window == 'sw' and method == 'setup':
+            figures.append((args[0].stats.station, plotter.sw.fig))
+    if plot_global:
+        figures = [('overview', plotter.gw.fig),
+                   ('picks', plotter.pw.fig)] + figures
+    basename = Path(basename)
+    basename.parent.mkdir(parents=True, exist_ok=True)
+    filenames = []
+    for name, fig in figures:
+        for fmt in formats:
+            filename = basename.parent / f'{basename.name}_{name}.{fmt}'
+            fig.savefig(filename, format=fmt, dpi=dpi)
+            filenames.append(str(filename))
+    return filenames
+
+
+class PlotRenderer():
+    """
+    Renders recorded plots to files in a pool of worker processes
+
+    >>> with PlotRenderer('plots', workers=2) as renderer:
+    ...     for sfile in sfiles:
+    ...         recorder = PlotRecorder()
+    ...         # ... pick sfile using recorder as the Plotter ...
+    ...         renderer.submit(recorder, Path(sfile).name)
+    """
+    def __init__(self, plot_dir, workers=1, formats=('png',), dpi=100):
+        """
+        :param plot_dir: directory to write the figures to
+        :param workers: number of worker processes.  0: render in this
+            process, when the recorder is submitted
+        :param formats: figure formats ('png', 'pdf' and/or 'svg')
+        :param dpi: figure resolution (dots per inch)
+        """
+        if isinstance(formats, str):
+            formats = (formats,)
+        for fmt in formats:
+            if fmt not in FIGURE_FORMATS:
+                raise ValueError(f"Unknown figure format '{fmt}', choose "
+                                 f"from {FIGURE_FORMATS}")
+        self.plot_dir = Path(plot_dir)
+        self.workers = workers
+        self.formats = tuple(formats)
+        self.dpi = dpi
+        self.filenames = []
+        self._futures = []
+        self._executor = None
+        if workers > 0:
+            self._executor = ProcessPoolExecutor(max_workers=workers,
+                                                 initializer=_init_worker)
+
+    def __str__(self):
+        return (f'PlotRenderer: {self.plot_dir}, {self.workers:d} workers, '
+                f'{len(self.filenames):d} files written')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, recorder, name):
+        """
+        Render a PlotRecorder's figures
+
+        :param recorder: PlotRecorder object
+        :param name: file name prefix of the figures (usually the event's
+            database file name)
+        :returns: Future, whose result is the list of written files
+        """
+        args = (recorder.calls, recorder.plot_global, recorder.plot_stations,
+                self.plot_dir / name, self.formats, self.dpi)
+        if self._executor is None:
+            future = Future()
+            try:
+                future.set_result(render_plots(*args))
+            except Exception as err:
+                future.set_exception(err)
+        else:
+            future = self._executor.submit(render_plots, *args)
+        self._futures.append((name, future))
+        self._collect(wait=False)
+        return future
+
+    def wait(self):
+        """
+        Wait for all submitted figures to be written
+        """
+        self._collect(wait=True)
+
+    def close(self):
+        """
+        Wait for all submitted figures to be written and stop the workers
+        """
+        self.wait()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _collect(self, wait):
+        """
+        Log the finished renderings (all of them if wait)
+        """
+        pending = []
+        for name, future in self._futures:
+            if not wait and not future.done():
+                pending.append((name, future))
+                continue
+            try:
+                self.filenames.extend(future.result())
+            except Exception as err:
+                log(f'Could not plot {name}: {err}', 'error')
+        self._futures = pending
+
+
+def _init_worker():
+    """
+    Use the non-interactive Agg backend in the worker processes
+    """
+    import matplotlib
+    matplotlib.use('Agg')
@@ -1,9 +1,14 @@
+"""
+Plots of the picking steps
+
+matplotlib is only imported when a figure is made, so that picking
+without plots does not load it
+"""
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle
 from obspy.core.stream import Stream
 
 from .logger import log
+from .utils import as_trace
 from .associator import Associator
 
 
@@ -11,16 +16,21 @@ class Plotter():
     """
     Class to plot figures representing the work in PSPicker
     """
-    def __init__(self, plot_global=True, plot_stations=True):
+    def __init__(self, plot_global=True, plot_stations=True,
+                 interactive=True):
         """
         :param plot_global: show global selection and picks plots
         :kind plot_global: bool
         :param plot_stations: show individual station plots
         :kind plot_stations: bool
+        :param interactive: show the figures on screen as they are drawn.
+            If False, the figures are not managed by pyplot and are only
+            drawn when saved (see plot_renderer)
+        :kind interactive: bool
         """
-        self.gw = Global_Window(plot_global)
-        self.pw = Picks_Window(plot_global)
-        self.sw = Station_Window(plot_stations)
+        self.gw = Global_Window(plot_global, interactive)
+        self.pw = Picks_Window(plot_global, interactive)
+        self.sw = Station_Window(plot_stations, interactive)
 
 
 class Global_Window():
@@ -30,13 +40,13 @@ class Global_Window():
     Shows the entire time span for all stations, the initial picks and the
     selected pick window
     """
-    def __init__(self, plot=True):
+    def __init__(self, plot=True, interactive=True):
         self.plot = plot
+        self.interactive = interactive
         if not plot:
             self.fig, self.ax = None, None
         else:
-            self.fig, self.ax = plt.subplots(num="PSPicker: Overview",
-                                             clear=True)
+            self.fig, self.ax = _subplots("PSPicker: Overview", interactive)
         self.stations = []  # ordered list of stations
 
     def setup(self, starttime, endtime, stations):
@@ -58,10 +68,7 @@ class Global_Window():
         self.ax.set_yticks(np.arange(0, N))
         self.ax.set_yticklabels(stations)
         self.ax.set_xlabel(starttime.strftime('%Y-%m-%d'))
-        plt.draw()
-        self.fig.canvas.draw_idle()
-        plt.show(block=False)
-        plt.pause(0.001)
+        _draw(self.interactive, self.fig)
 
     def plot_trace(self, trace, station, candidates):
         """
@@ -94,6 +101,7 @@ class Global_Window():
         """
         if not self.plot:
             return
+        from matplotlib.patches import Rectangle
         N = len(self.stations)
         width = rect_end_time - rect_start_time
         patch = Rectangle((rect_start_time.matplotlib_date, -0.5),
@@ -102,10 +110,7 @@ class Global_Window():
         self.ax.axvline(rect_start_time.matplotlib_date)
         self.ax.axvline(rect_end_time.matplotlib_date)
         self.ax.add_patch(patch)
-        # plt.draw()
-        self.fig.canvas.draw_idle()
-        plt.show(block=False)
-        plt.pause(0.001)
+        _draw(self.interactive, self.fig)
 
 
 class Picks_Window():
@@ -117,13 +122,13 @@ class Picks_Window():
              2: initial p-s candidates, (wide, alpha=0.5), 3: trace,
              4: cluster candidates, 5: final picks
     """
-    def __init__(self, plot=True):
+    def __init__(self, plot=True, interactive=True):
         self.plot = plot
+        self.interactive = interactive
         if not plot:
             self.fig, self.ax = None, None
         else:
-            self.fig, self.ax = plt.subplots(num="PSPicker: all picks",
-                                             clear=True)
+            self.fig, self.ax = _subplots("PSPicker: all picks", interactive)
         self.stations = []  # ordered list of stations
 
     def setup(self, starttime, endtime, stations):
@@ -145,9 +150,7 @@ class Picks_Window():
         self.ax.set_yticks(np.arange(0, N))
         self.ax.set_yticklabels(stations)
         self.ax.set_xlabel(starttime.strftime('%Y-%m-%d'))
-        plt.draw()
-        plt.show(block=False)
-        plt.pause(0.001)
+        _draw(self.interactive)
 
     def plot_traces_candidates(self, traces, c_P, c_S, candidates, station,
                                assoc=Associator):
@@ -183,9 +186,7 @@ class Picks_Window():
         if c_S is not None and c_P is not None:
             o_time = assoc.calc_origin_time(c_P.time, c_S.time)
             ax.plot(o_time.matplotlib_date, i_sta, 'k+')
-        plt.draw()
-        plt.show(block=False)
-        plt.pause(0.001)
+        _draw(self.interactive)
 
     def plot_picks(self, picks, t_begin, assoc):
         """
@@ -205,9 +206,7 @@ class Picks_Window():
         self._add_cluster_rectangle(assoc.p_cluster, 'b', '#a0a0ff')
         self._add_cluster_rectangle(assoc.s_cluster, 'r', '#ffa0a0')
         self._add_cluster_rectangle(assoc.o_cluster, 'g', '#a0ffa0')
-        plt.draw()
-        plt.show(block=False)
-        plt.pause(0.001)
+        _draw(self.interactive)
 
     def _add_picks(self, picks, color):
         """
@@ -222,13 +221,12 @@ class Picks_Window():
             j = self.stations.index(pick.station)
             self.ax.vlines(pick.time.datetime, j - 0.5, j + 0.5, colors=color,
                            zorder=5)
-        plt.draw()
-        plt.show(block=False)
-        plt.pause(0.001)
+        _draw(self.interactive)
 
     def _add_cluster_rectangle(self, cluster, color, face_color):
         if len(cluster) == 0:
             return
+        from matplotlib.patches import Rectangle
         for sta, t in cluster.items():
             self.ax.plot(t.matplotlib_date, self.stations.index(sta),
                          color=color, marker='x', ls=None, zorder=4)
@@ -254,11 +252,12 @@ class Station_Window():
         4) Energy and signal-to-noise level
         5) Polarity
     """
-    def __init__(self, plot=True):
+    def __init__(self, plot=True, interactive=True):
         """
         Initialize station window object (but not the window)
         """
         self.plot = plot
+        self.interactive = interactive
         self.fig = None
         self.ax_picks = None
         self.ax_data = None
@@ -276,7 +275,7 @@ class Station_Window():
             return
         # Pick_Function.m:334
         name = trace.stats.station
-        self.fig, axs = plt.subplots(5, 1, sharex=True, num=name, clear=True)
+        self.fig, axs = _subplots(name, self.interactive, 5, 1, sharex=True)
         self.fig.subplots_adjust(hspace=0)
         self.ax_picks = axs[0]
         self.ax_cand = axs[1]
@@ -330,9 +329,7 @@ class Station_Window():
         self.fig.tight_layout()   # (to avoid clipping right labels)
         self.fig.subplots_adjust(hspace=0.1)
 
-        plt.draw()
-        plt.show(block=False)
-        plt.pause(0.001)
+        _draw(self.interactive)
 
     @staticmethod
     def _plot_picks(ax, trace):
@@ -351,11 +348,12 @@ class Station_Window():
 
     @staticmethod
     def _plot_kurt(ax, kurto):
-        kurto_mean = kurto.mean_kurtosis
-        kurto_cum_mean = kurto.mean_cumulative_kurtosis
+        kurto_mean = as_trace(kurto.mean_kurtosis)
+        kurto_cum_mean = as_trace(kurto.mean_cumulative_kurtosis)
         smoov = kurto.params.extrema_smoothings
         tmin, tmax = kurto_mean.stats.starttime, kurto_mean.stats.endtime
-        kurto_grad = Stream(kurto.kurto_gradients).slice(tmin, tmax)
+        kurto_grad = Stream([as_trace(x) for x in kurto.kurto_gradients]
+                            ).slice(tmin, tmax)
 
         ax.plot(kurto_mean.times(type='matplotlib'), kurto_mean.data, 'b',
                 label='mean')
@@ -378,11 +376,10 @@ class Station_Window():
 
     @staticmethod
     def _plot_snr(ax, energy, snr_quality_thresholds):
-        nrgdB = energy.nrg.copy()
-        nrgdB.data = 20 * np.log10(nrgdB.data)
-        # ax.plot_date(energy.nrg.times(type='matplotlib'), energy.nrg.data,
+        nrg, snr = as_trace(energy.nrg), as_trace(energy.snr)
+        # ax.plot_date(nrg.times(type='matplotlib'), nrg.data,
         #              'r', zorder=0., alpha=0.5)
-        ax.semilogy(energy.nrg.times(type='matplotlib'), energy.nrg.data,
+        ax.semilogy(nrg.times(type='matplotlib'), nrg.data,
                     'r', zorder=0., alpha=0.5)
         ax.set_ylabel('Energy', color='r')
         ax.tick_params(axis='y', labelcolor='r')
@@ -390,7 +387,7 @@ class Station_Window():
         # axb.semilogy(energy.snr.times(type='matplotlib'), energy.snr.data,
         #               'b', zorder=1.)
         # axb.set_ylim(bottom=1.)
-        axb.plot(energy.snr.times(type='matplotlib'), energy.snr.data,
+        axb.plot(snr.times(type='matplotlib'), snr.data,
                  'b', zorder=1.)
         axb.set_ylim(bottom=0, top=1.5*max(snr_quality_thresholds))
         if energy.snr_threshold is not None:
@@ -407,7 +404,7 @@ class Station_Window():
         :param dip_thresh_S: maximum S-wave dip-rect
         """
         if trace is not None:
-            tr = trace.copy()
+            tr = as_trace(trace).copy()
             tr.data[tr.data == 0] = np.nan
             ax.plot_date(tr.times(type='matplotlib'), tr.data, 'k')
             ax.axhline(0, color='k', ls='-', lw=0.1, zorder=0.5)
@@ -459,9 +456,7 @@ class Station_Window():
         axb.set_ylabel('dip-rect', color='b')
         axb.tick_params(axis='y', labelcolor='b')
         axb.set_ylim(-1, 1)
-        plt.draw()
-        plt.show(block=False)
-        plt.pause(0.001)
+        _draw(self.interactive)
 
     def onsets(self, onset_P, onset_S, data_limits):
         """
@@ -485,6 +480,39 @@ class Station_Window():
             self.ax_picks.plot(t, data_limits[0], data_limits[1], 'r')
             # self.ax_extrem.plot(t, data_limits[0], data_limits[1], 'r')
             self.ax_kurt.plot(t, self.kmin, self.kmax, 'r')
-        plt.draw()
-        plt.show(block=False)
-        plt.pause(0.001)
+        _draw(self.interactive)
+
+
+def _subplots(num, interactive, *args, **kwargs):
+    """
+    Return a new figure and its axes
+
+    :param num: figure name (if interactive)
+    :param interactive: make a pyplot figure.  If False, make a Figure that
+        pyplot doesn't manage (no GUI, can be drawn in any thread or
+        process)
+    :param args, kwargs: Figure.subplots() arguments
+    """
+    if interactive:
+        import matplotlib.pyplot as plt
+        return plt.subplots(*args, num=num, clear=True, **kwargs)
+    from matplotlib.figure import Figure
+    fig = Figure()
+    return fig, fig.subplots(*args, **kwargs)
+
+
+def _draw(interactive, fig=None):
+    """
+    Update the figures on screen (nothing if not interactive)
+
+    :param interactive: the figures are on screen
+    :param fig: figure to redraw, in addition to the current one
+    """
+    if not interactive:
+        return
+    import matplotlib.pyplot as plt
+    plt.draw()
+    if fig is not None:
+        fig.canvas.draw_idle()
+    plt.show(block=False)
+    plt.pause(0.001)
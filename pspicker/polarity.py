@@ -1,9 +1,11 @@
 import numpy as np
-from scipy import signal, linalg
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import signal
 from obspy.core import UTCDateTime
 from obspy.core.stream import Stream
 
 from .logger import log
+from .utils import rolling_mean, ArrayTrace
 # from .timer import Timer
 
 
@@ -26,19 +28,20 @@ class Polarity:
         self.params = params
         self.verbose = verbose
         self.sr = stream[0].stats.sampling_rate
+        self.n_samples_analyzed = 0
         self.tracez = None
         self.tracen = None
         self.tracee = None
         for tr in stream:
             if tr.stats.channel[-1] in zcomponents:
                 assert self.tracez is None, 'already have a z trace!'
-                self.tracez = tr.copy()
+                self.tracez = ArrayTrace.from_trace(tr)
             elif tr.stats.channel[-1] in ncomponents:
                 assert self.tracen is None, 'already have a n trace!'
-                self.tracen = tr.copy()
+                self.tracen = ArrayTrace.from_trace(tr)
             elif tr.stats.channel[-1] in ecomponents:
                 assert self.tracee is None, 'already have a e trace!'
-                self.tracee = tr.copy()
+                self.tracee = ArrayTrace.from_trace(tr)
             else:
                 msg = f"Unexpected channel code {tr.stats.channel}"
                 raise ValueError(msg)
@@ -89,7 +92,7 @@ class Polarity:
         :param times: list of UTCDateTimes
         :param min_dip_threshold: do not calculate dip-rectilinearity if there
             is no calculated dip with at least this absolute angle (degrees)
-        :returns: DR: Dip-rectilinearity trace
+        :returns: DR: Dip-rectilinearity ArrayTrace
         """
         if len(times) == 0:
             return None
@@ -112,15 +115,14 @@ class Polarity:
         smooth_dipp = signal.lfilter(a, 1, dipp)
         smooth_rectP = signal.lfilter(a, 1, rectP.data)
         Drb = np.sign(1.3 * smooth_dipp - smooth_rectP)  # pos for P, neg for S
-        DR = rectP.copy()
-        DR.data *= Drb
-        DR.data = signal.lfilter(a2, 1, DR.data)
+        DR = rectP.with_data(signal.lfilter(a2, 1, rectP.data * Drb))
         # DR.data = signal.lfilter(a2, 1, np.multiply(rectP.data, Drb))
         DR.data[rectP.data == 0] = 0
         if plot:
             DR.stats.channel = 'DR'
             dipP.stats.channel = 'DIP'
-            Stream([DR, dipP, self.tracez, self.tracen, self.tracee]).plot(
+            Stream([x.to_trace() for x in (DR, dipP, self.tracez,
+                                           self.tracen, self.tracee)]).plot(
                 equal_scale=False)
         return DR
 
@@ -131,35 +133,107 @@ class Polarity:
         Only computes around user specified times since this analysis is time
         consuming.  Other values are set to zero
         :param times: list of times around which to compute polarity
-        :returns: rect, azi (degrees), dip (degrees)
+        :returns: rect, azi (degrees), dip (degrees) ArrayTraces
         """
         # fast_polar_analysis.m:17
         # with Timer(text="polarity.polar_analysis() calc_indices: {:0.4f}s"):
         ind_vec, n_half_analyze = self._calc_indices(times)
+        self.n_samples_analyzed += len(ind_vec)
 
         # with Timer(text="    polarity.polar_analysis() rest: {:0.4f}s"):
-        rectP = self.tracez.copy()
-        rectP.data[:] = 0.
-        aziP = rectP.copy()
-        dipP = rectP.copy()
-        for k in ind_vec:
-            eP = self.tracee.data[k - n_half_analyze: k + n_half_analyze]
-            nP = self.tracen.data[k - n_half_analyze: k + n_half_analyze]
-            zP = self.tracez.data[k - n_half_analyze: k + n_half_analyze]
-            MP = np.cov(np.array([eP, nP, zP]))
-            D, V = linalg.eig(MP)
-            i_sort = np.argsort(D)  # sort from min (0) to max (2)
-            D = np.abs(D[i_sort])
-            V = V[:, i_sort]
-            # 2 = major axis, 0 = minor axis, 1 = intermediate
-            rectP.data[k] = 1 - ((D[0] + D[1]) / (2 * D[2]))
-            V_major = V[:, 2]
-            aziP.data[k] = np.degrees(np.arctan(V_major[1] / V_major[0]))
-            dipP.data[k] = np.degrees(np.arctan(V_major[2]
-                                                / np.sqrt(V_major[1]**2
-                                                          + V_major[0]**2)))
+        zeros = np.zeros_like(self.tracez.data)
+        rectP = self.tracez.with_data(zeros)
+        aziP = self.tracez.with_data(zeros.copy())
+        dipP = self.tracez.with_data(zeros.copy())
+        if len(ind_vec) == 0:
+            return rectP, aziP, dipP
+        if self.params.covariance_method == 'sliding':
+            covs = self._calc_sliding_covariances(ind_vec, n_half_analyze)
+        else:
+            covs = self._calc_covariances(ind_vec, n_half_analyze)
+        rectP.data[ind_vec], aziP.data[ind_vec], dipP.data[ind_vec] =\
+            self._calc_polar_params(covs)
         return rectP, aziP, dipP
 
+    def _calc_covariances(self, ind_vec, n_half_analyze, chunk_size=1024):
+        """
+        Return the E, N, Z covariance matrix around each index
+
+        Same as np.cov() of the E, N and Z data between
+        k - n_half_analyze and k + n_half_analyze, for each k in ind_vec
+
+        :param ind_vec: array of sample indices
+        :param n_half_analyze: half-width of each window, in samples
+        :param chunk_size: number of windows to process at once (limits
+            memory use)
+        :returns: (len(ind_vec), 3, 3) array of covariance matrices
+        """
+        data = np.array([self.tracee.data, self.tracen.data,
+                         self.tracez.data], dtype='float64')
+        windows = sliding_window_view(data, 2 * n_half_analyze, axis=-1)
+        covs = np.empty((len(ind_vec), 3, 3))
+        for first in range(0, len(ind_vec), chunk_size):
+            inds = ind_vec[first: first + chunk_size]
+            w = windows[:, inds - n_half_analyze]  # (3, len(inds), n_window)
+            w = w - w.mean(axis=-1, keepdims=True)
+            covs[first: first + len(inds)] = np.einsum(
+                'ikw,jkw->kij', w, w) / (2 * n_half_analyze - 1)
+        return covs
+
+    def _calc_sliding_covariances(self, ind_vec, n_half_analyze):
+        """
+        Return the E, N, Z covariance matrix around each index
+
+        Same as _calc_covariances(), but for each run of consecutive indices
+        the channel sums and cross-products are updated as the window slides,
+        rather than recalculated for every window
+
+        :param ind_vec: sorted array of unique sample indices
+        :param n_half_analyze: half-width of each window, in samples
+        :returns: (len(ind_vec), 3, 3) array of covariance matrices
+        """
+        n_window = 2 * n_half_analyze
+        data = np.array([self.tracee.data, self.tracen.data,
+                         self.tracez.data], dtype='float64')
+        i_rows, i_cols = np.triu_indices(3)
+        covs = np.empty((len(ind_vec), 3, 3))
+        run_starts = np.flatnonzero(np.diff(ind_vec, prepend=-2) != 1)
+        run_ends = np.append(run_starts[1:], len(ind_vec))
+        for first, last in zip(run_starts, run_ends):
+            span = data[:, ind_vec[first] - n_half_analyze:
+                        ind_vec[last - 1] + n_half_analyze]
+            # Removing the span mean changes nothing but the rounding errors
+            span = span - span.mean(axis=-1, keepdims=True)
+            sums = rolling_mean(np.concatenate((span,
+                                                span[i_rows] * span[i_cols])),
+                                n_window)[:, n_window - 1:]
+            means, products = sums[:3], sums[3:]
+            cov = ((products - means[i_rows] * means[i_cols])
+                   * n_window / (n_window - 1))
+            covs[first: last, i_rows, i_cols] = cov.T
+            covs[first: last, i_cols, i_rows] = cov.T
+        return covs
+
+    @staticmethod
+    def _calc_polar_params(covs):
+        """
+        Return rectilinearity, azimuth and dip from E, N, Z covariances
+
+        :param covs: (n, 3, 3) array of covariance matrices
+        :returns: rect, azi (degrees), dip (degrees), each of length n
+        """
+        # eigh() returns eigenvalues sorted from min (0) to max (2)
+        D, V = np.linalg.eigh(covs)
+        D = np.abs(D)
+        # 2 = major axis, 0 = minor axis, 1 = intermediate
+        rect = 1 - ((D[:, 0] + D[:, 1]) / (2 * D[:, 2]))
+        V_major = V[:, :, 2]
+        azi = np.degrees(np.arctan(V_major[:, 1] / V_major[:, 0]))
+        dip = np.degrees(np.arctan(V_major[:, 2]
+                                   / np.sqrt(V_major[:, 1]**2
+                                             + V_major[:, 0]**2)))
+        return rect, azi, dip
+
     def _calc_indices(self, pick_times):
         """
         Create list of indices to investigate
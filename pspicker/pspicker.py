@@ -3,6 +3,7 @@
 
 # Standard libraries
 from pathlib import Path
+import copy
 import shutil
 import warnings
 # import glob
@@ -10,33 +11,39 @@ import warnings
 # from logging import info
 from datetime import datetime
 from fnmatch import fnmatch
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 # import sys
 
 # Publicly available libraries
 import numpy as np
-from scipy import stats
 from obspy.core import UTCDateTime
 from obspy.core.event import Catalog as obspy_Catalog
 # from obspy.core.inventory.response import PolesZerosResponseStage
 from obspy.core.event.origin import Origin as obspy_Origin
 from obspy.core.event import Event as obspy_Event
 # from obspy.signal.invsim import simulate_seismometer
-from obspy.io.nordic.core import read_nordic
-from obspy.core import read as obspy_read
 
 # module libraries
 from .parameters import (PickerParameters, PickerRunParameters,
                          PickerStationParameters)
-from .kurtosis import Kurtosis
-from .energy_snr import EnergySNR
+from .kurtosis import Kurtosis, KurtosisCache
+from .filter_bank import FILTER_BANK
+from .energy_snr import EnergySNR, EnergySNRBatch
 from .polarity import Polarity
 from .pick_candidate import PickCandidate
 from .associator import Associator
 from .plotter import Plotter
+from .plot_renderer import PlotRecorder, PlotRenderer
 from .local_amplitude import LocalAmplitude
-from .utils import (select_traces, smooth_filter, picks_ps_times)
-from .logger import setup_log, log
-from .timer import Timer
+from .utils import (select_traces, smooth_filter, picks_ps_times,
+                    ArrayTrace)
+from .logger import (setup_log, log, start_log_listener, setup_worker_log,
+                     get_log_level)
+from .timer import Timer, StageTimer, TimingReport
+from .database_index import DatabaseIndex
+from .waveform_source import SEISANSource, WaveformRequest
+from .result_cache import ResultCache, content_hash
+from .parameter_sweep import ParameterSweep
 
 warnings.filterwarnings("ignore",
                         message="Lines of type I have not been implemented "
@@ -50,7 +57,8 @@ class PSPicker():
     """
     def __init__(self, parm_file, wav_base_path, database_path_in,
                  database_path_out='./Sfile_directory',
-                 database_format='NORDIC'):
+                 database_format='NORDIC', waveform_source=None,
+                 cache_dir=None):
         """
         :param parm_file: path/name of the parameter file
         :param wav_base_path: absolute basepath to the waveform files
@@ -62,11 +70,21 @@ class PSPicker():
             'NORDIC': assume waveform files and database files are named using
                 SEISAN conventions and located in YEAR/MONTH subdirectories
                 under wav_base_path and database_path_in, respectively
+        :param waveform_source: WaveformSource to read the waveforms from
+            (for example an SDSSource or a ClientSource).  None:
+            SEISANSource(wav_base_path)
+        :param cache_dir: directory to cache the global windows, station
+            SNRs and station candidates in, so that reruns only recalculate
+            the stages whose waveforms or parameters changed (see
+            ResultCache).  None: no cache
         """
         self.parm_file = parm_file
         self.wav_base_path = Path(wav_base_path)
         self.database_path_in = Path(database_path_in)
         self.database_path_out = Path(database_path_out)
+        if waveform_source is None:
+            waveform_source = SEISANSource(self.wav_base_path)
+        self.waveform_source = waveform_source
         if not self.database_path_out.is_dir():
             assert not self.database_path_out.exists()
             self.database_path_out.mkdir()
@@ -75,6 +93,10 @@ class PSPicker():
         self.plot_debug = False
         self.run = None
         self.assoc = None
+        self.database_index = None
+        self.result_cache = (ResultCache(cache_dir) if cache_dir is not None
+                             else None)
+        self.plot_renderer = None
         # self.log_level = None
 
     def __str__(self):
@@ -82,13 +104,16 @@ class PSPicker():
         """
         str = "PSPicker\n"
         str += f"    wav_base: {self.wav_base_path}\n"
+        str += f"    waveform source: {self.waveform_source}\n"
         str += f"    input db directory: {self.database_path_in}\n"
         str += f"    output db directory: {self.database_path_out}\n"
         str += f"    parameters: {self.param}\n"
         return str
 
     def run_many(self, start_date, end_date, plot_global=False,
-                 plot_stations=False, ignore_fails=True, log_level='info'):
+                 plot_stations=False, ignore_fails=True, log_level='info',
+                 workers=1, timing_file=None, index_file=None, prefetch=0,
+                 plot_dir=None, plot_workers=1, plot_formats=('png',)):
         """
         Loops over events in a date range
 
@@ -100,6 +125,30 @@ class PSPicker():
         :param ignore_fails: keep going if one run fails
         :param log_level: console log level (choices = 'debug', 'verbose',
             'info', 'warning', 'error', 'critical'), default='info'
+        :param workers: number of processes to pick events in.  If > 1,
+            events are sent to a process pool, plots are turned off and
+            the workers' logs are merged into this process's log
+        :param timing_file: write the time spent in each stage, and the
+            numbers of stations, candidates and polarity samples, for each
+            event and in total, to this file (JSON, or CSV if the name ends
+            in '.csv').  None: no timing
+        :param index_file: SQLite index of database_path_in (see
+            DatabaseIndex), created or updated before running.  The
+            database files to run and their waveform files are read from
+            the index instead of globbing each day's directory and parsing
+            each file.  None: don't use an index
+        :param prefetch: read the waveforms of the next `prefetch` events
+            (in one request to the waveform source) in a background thread
+            while picking the current ones.  0: no prefetch.  Not used if
+            workers > 1
+        :param plot_dir: save the plots selected by plot_global and
+            plot_stations to this directory instead of showing them.  The
+            plot inputs are recorded while picking and the figures are
+            rendered in `plot_workers` background processes (or, if
+            workers > 1, by each event's worker).  None: show the plots
+        :param plot_workers: number of processes to render plots in
+        :param plot_formats: figure formats ('png', 'pdf' and/or 'svg')
+        :returns: TimingReport if timing_file is not None, otherwise None
         """
         setup_log(log_level)
         # self.log_level = log_level
@@ -113,6 +162,93 @@ class PSPicker():
         # Print parameter information
         log(str(self), 'verbose')
 
+        timing = timing_file is not None
+        s_files = None
+        if index_file is not None:
+            self.database_index = DatabaseIndex(self.database_path_in,
+                                                index_file)
+            self.database_index.update()
+            s_files = self.database_index.sfiles(start_dt, end_dt)
+        if plot_dir is not None and workers == 1:
+            self.plot_renderer = PlotRenderer(plot_dir, plot_workers,
+                                              plot_formats)
+        try:
+            timings = self._run_events(
+                start_dt, end_dt, s_files, plot_global, plot_stations,
+                ignore_fails, workers, timing, prefetch, debug_fname,
+                plot_dir, plot_formats)
+        finally:
+            if self.plot_renderer is not None:
+                self.plot_renderer.close()
+                log(str(self.plot_renderer), 'verbose')
+                self.plot_renderer = None
+        if not timing:
+            return None
+        report = TimingReport()
+        for s_file, event_timing in timings:
+            report.add(Path(s_file).name, event_timing)
+        report.write(timing_file)
+        log(str(report), 'verbose')
+        return report
+
+    def _run_events(self, start_dt, end_dt, s_files, plot_global,
+                    plot_stations, ignore_fails, workers, timing, prefetch,
+                    debug_fname, plot_dir, plot_formats):
+        """
+        Run the events of run_many()
+
+        :param s_files: database files to run (None: glob each day's
+            directory)
+        :returns: list of (s_file, run_one() output)
+        """
+        timings = []
+        if workers > 1:
+            if (plot_global or plot_stations) and plot_dir is None:
+                log('Plots are not available with workers > 1, turning off',
+                    'warning')
+            if s_files is None:
+                s_files = []
+                for year, month, day, kwargs in self._iter_days(start_dt,
+                                                                end_dt):
+                    s_files.extend(self._day_sfiles(year, month, day,
+                                                    **kwargs))
+            timings = self._run_pool(s_files, ignore_fails, workers, timing,
+                                     plot_global, plot_stations, plot_dir,
+                                     plot_formats)
+        elif prefetch > 0:
+            if s_files is None:
+                s_files = []
+                for year, month, day, kwargs in self._iter_days(start_dt,
+                                                                end_dt):
+                    s_files.extend(self._day_sfiles(year, month, day,
+                                                    **kwargs))
+            timings = self._run_prefetch(s_files, plot_global, plot_stations,
+                                         ignore_fails, timing, prefetch)
+        elif s_files is not None:
+            log(f'Running {len(s_files):d} events')
+            for s_file in s_files:
+                timings.append((s_file, self._run_one_event(
+                    s_file, plot_global, plot_stations, ignore_fails,
+                    timing)))
+        else:
+            for year, month, day, kwargs in self._iter_days(start_dt,
+                                                            end_dt):
+                timings.extend(self._run_one_day(
+                    year, month, day, plot_global, plot_stations,
+                    ignore_fails, debug_fname, timing=timing, **kwargs))
+        return timings
+
+    @staticmethod
+    def _iter_days(start_dt, end_dt):
+        """
+        Yield each day between two datetimes
+
+        :param start_dt: first datetime
+        :param end_dt: last datetime
+        :returns: generator of (year, month, day, kwargs), where kwargs
+            contains first_hour and first_minute on the first day and
+            last_hour and last_minute on the last day
+        """
         def _date_match(y, m, d, ref):
             return y == ref.year and m == ref.month and d == ref.day
 
@@ -140,12 +276,110 @@ class PSPicker():
                     if _date_match(year, month, day, end_dt):
                         kwargs['last_hour'] = end_dt.hour
                         kwargs['last_minute'] = end_dt.minute
-                    self._run_one_day(year, month, day, plot_global,
-                                      plot_stations, ignore_fails,
-                                      debug_fname, **kwargs)
+                    yield year, month, day, kwargs
+
+    def _run_prefetch(self, s_files, plot_global, plot_stations,
+                      ignore_fails, timing, batch_size):
+        """
+        Run events, reading the next events' waveforms in the background
+
+        :param s_files: sorted list of database files to run
+        :param plot_global: show global and overall pick plots
+        :param plot_stations: show individual station plots
+        :param ignore_fails: keep going if one run fails
+        :param timing: time each event's stages
+        :param batch_size: number of events to read in one request
+        :returns: list of (s_file, run_one() output)
+        """
+        log(f'Running {len(s_files):d} events, prefetching {batch_size:d} '
+            'at a time')
+        requests = []
+        for s_file in s_files:
+            try:
+                requests.append(WaveformRequest.from_sfile(
+                    s_file, self.database_index))
+            except Exception as err:
+                requests.append(WaveformRequest(s_file))
+                log(f'Could not read {s_file}: {err}', 'error')
+        timings = []
+        for request, waveforms in self.waveform_source.prefetch(requests,
+                                                                batch_size):
+            timings.append((request.sfile, self._run_one_event(
+                request.sfile, plot_global, plot_stations, ignore_fails,
+                timing, waveforms)))
+        return timings
+
+    def _run_pool(self, s_files, ignore_fails, workers, timing=False,
+                  plot_global=False, plot_stations=False, plot_dir=None,
+                  plot_formats=('png',)):
+        """
+        Run events in a process pool
+
+        Each event is written to its own database file, so the output does
+        not depend on the order in which the workers finish.  Results are
+        collected (and failures raised) in s_file order.
+
+        :param s_files: sorted list of database files to run
+        :param ignore_fails: keep going if one run fails
+        :param workers: number of worker processes
+        :param timing: time each event's stages
+        :param plot_global: save global and overall pick plots
+        :param plot_stations: save individual station plots
+        :param plot_dir: directory to save the plots in (each worker
+            renders its events' plots).  None: no plots
+        :param plot_formats: figure formats
+        :returns: list of (s_file, run_one() output)
+        """
+        log(f'Running {len(s_files):d} events using {workers:d} workers')
+        if plot_dir is None:
+            plot_global, plot_stations = False, False
+        # The last event's stream, Kurtosis cache and station results
+        self.run = None
+        queue, listener = start_log_listener()
+        try:
+            # The picker is sent once to each worker, not with each event
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=_init_pool_worker,
+                                     initargs=(self._worker_copy(), queue,
+                                               get_log_level())
+                                     ) as executor:
+                futures = [executor.submit(_run_pool_event, s_file,
+                                           plot_global, plot_stations,
+                                           ignore_fails, timing,
+                                           plot_dir=plot_dir,
+                                           plot_formats=plot_formats)
+                           for s_file in s_files]
+                try:
+                    timings = [(s_file, future.result())
+                               for s_file, future in zip(s_files, futures)]
+                except Exception:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            listener.stop()
+        return timings
+
+    def _worker_copy(self):
+        """
+        Return a copy of the picker to send to run_many() worker processes
+
+        Leaves out what each worker recalculates or doesn't need: the last
+        event's results, the Associator, the plot renderer and the results
+        cached in memory
+        """
+        picker = copy.copy(self)
+        picker.run = None
+        picker.assoc = None
+        picker.plot_renderer = None
+        if self.result_cache is not None:
+            picker.result_cache = ResultCache(self.result_cache.cache_dir)
+        return picker
 
     def run_one(self, database_filename, plot_global=True, plot_stations=False,
-                assoc=None, log_level='verbose', plot_debug=None):
+                assoc=None, log_level='verbose', plot_debug=None,
+                station_workers=1, timing=False, waveforms=None,
+                plot_dir=None, plot_formats=('png',)):
         """
         Picks P and S arrivals on one waveform, using the Kurtosis
 
@@ -160,6 +394,23 @@ class PSPicker():
                              'info', 'warning', 'error', 'critical').
                              If None, do not setup log
             plot_debug (bool): plot some "debugging" plots
+            station_workers (int): number of threads to pick stations in.
+                                   Plots are drawn once all stations are
+                                   picked.  plot_debug is ignored if > 1
+            timing (bool): time each stage and count stations, candidates
+                           and polarity samples
+            waveforms (tuple): (stream, wavefile) already read from the
+                               waveform source.  None: read them
+            plot_dir (str): save the plots selected by plot_global and
+                            plot_stations to files named after the
+                            database file in this directory, instead of
+                            showing them.  Ignored if run by run_many(),
+                            which sets the directory.  None: show the plots
+            plot_formats (tuple): figure formats ('png', 'pdf', 'svg')
+
+        Returns:
+            stage times and counts (see StageTimer.to_dict()) if timing is
+            True, otherwise None
         """
         if log_level is not None:
             setup_log(log_level)
@@ -167,15 +418,30 @@ class PSPicker():
             self.assoc = Associator(self.param.assoc)
         if plot_debug is not None:
             self.plot_debug = plot_debug
+        if station_workers > 1 and self.plot_debug:
+            log('plot_debug is not available with station_workers > 1, '
+                'turning off', 'warning')
+            self.plot_debug = False
         log(f'running {database_filename}', 'debug')
         timer = Timer(logger=None)
         timer.start()
+        stages = StageTimer(enabled=timing)
 
         # Run basic Kurtosis/Associator to find most likely pick window
-        plotter = Plotter(plot_global, plot_stations)
+        renderer = self.plot_renderer
+        if renderer is None and plot_dir is not None:
+            # Rendered in this process, once the event is picked
+            renderer = PlotRenderer(plot_dir, workers=0,
+                                    formats=plot_formats)
+        if renderer is not None:
+            plotter = PlotRecorder(plot_global, plot_stations)
+        else:
+            plotter = Plotter(plot_global, plot_stations)
         # Read in data and select global pick window
-        st, wavefile = self._read_waveforms(
-            self._full_nordic_database_filename(database_filename))
+        with stages.stage('read_waveforms'):
+            st, wavefile = self._read_waveforms(
+                self._full_nordic_database_filename(database_filename),
+                waveforms=waveforms)
         # print(st.__str__(extended=True))
         if len(st) == 0:
             log('No data found in {wavefile}, referred by {database_filename}',
@@ -184,17 +450,404 @@ class PSPicker():
         sta_list = sorted(list(set([tr.stats.station for tr in st])))
         log('Read waveforms from stations {}'.format(', '.join(sta_list)),
             'verbose')
-        # with Timer(text="Choose global window: {:0.4f}s"):
-        cmaps, ft, lt = self._choose_global_window(st, plotter)
+        obspy_picks, amplitudes, cmaps = self._pick_stream(
+            st, database_filename, wavefile, plotter, stages, station_workers)
+        if renderer is not None:
+            with stages.stage('plots'):
+                renderer.submit(plotter, Path(database_filename).name)
+        elapsed_time = timer.stop()
+        try:
+            dbfname = str(Path(database_filename)
+                         .relative_to(self.database_path_in))
+        except Exception:
+            dbfname = database_filename
+        log('    {}: {:2d} Picks and {:2d} Amplitudes on {:2d} stations in '
+            '{:0.2f} seconds'.format(dbfname,
+                                     len(obspy_picks) - len(amplitudes),
+                                     len(amplitudes), len(cmaps),
+                                     elapsed_time))
+        if timing:
+            stages.add_time('total', elapsed_time)
+            return stages.to_dict()
+
+    def run_continuous(self, starttime, endtime, window_length=300.,
+                       window_step=None, min_stations=3, min_snr=None,
+                       segment_length=86400., event_padding=60., stream=None,
+                       plot_global=False, plot_stations=False,
+                       log_level='info', station_workers=1):
+        """
+        Detect and pick events in continuous data, without database files
+
+        The data are read in segments (by default day-long) from the
+        waveform source (or sliced from `stream`), then walked in
+        overlapping windows.  In each window, the global window Kurtosis
+        picks each station and an event is declared if at least
+        `min_stations` stations have a candidate in the densest cluster of
+        candidates and an SNR above `min_snr` at that candidate.  Declared
+        events are picked (as in run_one()) on the segment's data, sliced
+        around the global window, and written to database_path_out with no
+        waveform file.
+
+        Each segment is filtered once for the Kurtosis (in each frequency
+        band) and the SNR, and the windows reuse the filtered data.
+
+        :param starttime: first time to process
+        :param endtime: last time to process
+        :type starttime, endtime: UTCDateTime or str
+        :param window_length: trigger window length (seconds)
+        :param window_step: time between trigger windows (seconds).  None:
+            window_length/2
+        :param min_stations: minimum number of triggered stations to declare
+            an event
+        :param min_snr: minimum SNR for a station to trigger.  None: the
+            lowest SNR quality threshold
+        :param segment_length: length of data read at once (seconds)
+        :param event_padding: data kept on each side of an event's global
+            window to pick it (seconds)
+        :param stream: continuous data to use instead of reading them from
+            the waveform source
+        :param plot_global: show global and overall pick plots
+        :param plot_stations: show individual station plots
+        :param log_level: console log level (choices = 'debug', 'verbose',
+            'info', 'warning', 'error', 'critical').  If None, do not setup
+            log
+        :param station_workers: number of threads to pick stations in
+        :returns: list of declared event times (global window cluster
+            centers)
+        """
+        if log_level is not None:
+            setup_log(log_level)
+        if self.assoc is None:
+            self.assoc = Associator(self.param.assoc)
+        starttime, endtime = UTCDateTime(starttime), UTCDateTime(endtime)
+        if window_step is None:
+            window_step = window_length / 2
+        assert 0 < window_step <= window_length,\
+            'window_step must be > 0 and <= window_length'
+        if min_snr is None:
+            min_snr = min(self.param.SNR.quality_thresholds)
+        # Each window's central window_step seconds (its "core") tile the
+        # data: an event is only declared by the window whose core holds it
+        half_overlap = (window_length - window_step) / 2
+        events = []
+        seg_start = starttime
+        while seg_start < endtime:
+            seg_end = min(seg_start + segment_length, endtime)
+            st = self._read_continuous(max(seg_start - half_overlap,
+                                           starttime),
+                                       min(seg_end + half_overlap, endtime),
+                                       stream)
+            if len(st) == 0:
+                log(f'No data found from {seg_start} to {seg_end}', 'warning')
+            else:
+                log(f'Scanning {seg_start} to {seg_end}', 'verbose')
+                events.extend(self._run_segment(
+                    st, seg_start, seg_end, window_step, half_overlap,
+                    min_stations, min_snr, event_padding,
+                    events[-1] if len(events) > 0 else None,
+                    plot_global, plot_stations, station_workers))
+            seg_start = seg_end
+        log(f'{len(events):d} events declared from {starttime} to {endtime}')
+        return events
+
+    def run_sweep(self, overrides, database_filenames, output=None,
+                  log_level='info', station_workers=1):
+        """
+        Pick events with every combination of a grid of parameter values
+
+        Each event's waveforms are read once.  Filtered data and kurtoses
+        (for each frequency band and window length) are shared by all
+        combinations, as are the global window, station SNRs and station
+        candidates of combinations whose parameters for that stage are
+        the same.  Nothing is written to database_path_out and amplitudes
+        are not calculated.
+
+        :param overrides: dict with key=parameter name, value=list of
+            values (see ParameterSweep)
+        :param database_filenames: database files of the events to pick
+        :param output: write the picks of each combination to this file
+            (JSON, or CSV if the name ends in '.csv').  None: don't write
+        :param log_level: console log level (choices = 'debug', 'verbose',
+            'info', 'warning', 'error', 'critical').  If None, do not setup
+            log
+        :param station_workers: number of threads to pick stations in
+        :returns: ParameterSweep object, with the picks
+        """
+        if log_level is not None:
+            setup_log(log_level)
+        sweep = ParameterSweep(overrides)
+        base_param, base_assoc = self.param, self.assoc
+        base_cache = self.result_cache
+        combination_params = [sweep.apply(base_param, c)
+                              for c in sweep.combinations]
+        associators = {}
+        if self.result_cache is None:
+            self.result_cache = ResultCache()
+        log(f'Sweeping {len(sweep):d} parameter combinations over '
+            f'{len(database_filenames):d} events')
+        try:
+            for database_filename in database_filenames:
+                st, wavefile = self._read_waveforms(
+                    self._full_nordic_database_filename(database_filename))
+                kurtosis_cache = KurtosisCache()
+                for i, param in enumerate(combination_params):
+                    self.param = param
+                    assoc_key = content_hash(param.assoc)
+                    if assoc_key not in associators:
+                        associators[assoc_key] = Associator(param.assoc)
+                    self.assoc = associators[assoc_key]
+                    picks = self._associate_stream(
+                        st, database_filename, wavefile,
+                        Plotter(False, False), StageTimer(enabled=False),
+                        station_workers, kurtosis_cache)
+                    sweep.add(i, database_filename, picks,
+                              param.SNR.quality_thresholds)
+                log(f'    {database_filename}: {len(sweep):d} combinations, '
+                    f'{len(kurtosis_cache):d} filtered data and kurtoses')
+                if base_cache is None:
+                    self.result_cache.clear()
+        finally:
+            self.param, self.assoc = base_param, base_assoc
+            self.result_cache = base_cache
+        if output is not None:
+            sweep.write(output)
+        return sweep
+
+    def _read_continuous(self, starttime, endtime, stream=None):
+        """
+        Return demeaned continuous data
+
+        :param starttime: first time
+        :param endtime: last time
+        :param stream: stream to slice the data from.  None: read them from
+            the waveform source
+        """
+        if stream is None:
+            st = self.waveform_source.get_window(starttime, endtime)
+        else:
+            st = stream.slice(starttime, endtime).copy()
+        for tr in st:
+            tr.detrend(type='demean')
+        return st
+
+    def _run_segment(self, st, seg_start, seg_end, window_step, half_overlap,
+                     min_stations, min_snr, event_padding, last_event,
+                     plot_global, plot_stations, station_workers):
+        """
+        Detect and pick the events in one segment of continuous data
+
+        :param st: the segment's data (including the overlaps)
+        :param seg_start: first window core start
+        :param seg_end: last window core end
+        :param last_event: last event time declared before this segment
+        :returns: list of declared event times
+        """
+        t_begin = min([tr.stats.starttime for tr in st])
+        t_end = max([tr.stats.endtime for tr in st])
+        cmaps = select_traces(st, self.param.channel_mapping_rules)
+        cmaps = {s: v for s, v in cmaps.items()
+                 if self._station_params(s) is not None}
+        log(self._channel_maps_str(cmaps), 'verbose')
+        kurtosis_cache = KurtosisCache()
+        snrs = self._trigger_snrs(st, cmaps)
+        min_separation = self.param.gw.offsets[1] - self.param.gw.offsets[0]
+        no_plots = Plotter(False, False)
+        events = []
+        core_start = seg_start
+        while core_start < seg_end:
+            core_end = min(core_start + window_step, seg_end)
+            candidates, w_cmaps = self._gw_get_distri(
+                st, cmaps, no_plots, kurtosis_cache=kurtosis_cache,
+                starttime=max(core_start - half_overlap, t_begin),
+                endtime=min(core_end + half_overlap, t_end))
+            # The kurtoses are only used by this window
+            kurtosis_cache.discard('kurtosis')
+            center, triggered = self._trigger(candidates, snrs, min_snr)
+            if (center is not None
+                    and core_start <= center < core_end
+                    and len(triggered) >= min_stations
+                    and (last_event is None
+                         or center - last_event > min_separation)):
+                log(f'Event declared at {center}, triggered stations: '
+                    f'{", ".join(sorted(triggered))}', 'verbose')
+                self._pick_continuous_event(
+                    st, w_cmaps, center, triggered, candidates,
+                    event_padding, Plotter(plot_global, plot_stations),
+                    station_workers)
+                events.append(center)
+                last_event = center
+            core_start = core_end
+        return events
+
+    def _trigger_snrs(self, st, channel_maps):
+        """
+        Return the SNR of each station's Z, N and E traces
+
+        Filtered in the station's SNR frequency band.  The SNRs of the
+        stations whose traces are aligned are calculated together
+        (EnergySNRBatch)
+
+        :param st: continuous data
+        :param channel_maps: ChannelMaps, by station
+        :returns: {station: SNR ArrayTrace}
+        """
+        streams = {}
+        for station, cmap in channel_maps.items():
+            band = self._station_params(station).SNR_energy.frequency_band
+            traces = st.select(id=cmap.Z)
+            for comp in 'NE':
+                if getattr(cmap, comp) is not None:
+                    traces += st.select(id=getattr(cmap, comp))
+            streams[station] = FILTER_BANK.filter_stream(traces, band)
+        snrs = {}
+        for energy in EnergySNRBatch.from_streams(streams, self.param.SNR):
+            if isinstance(energy, EnergySNRBatch):
+                for i, station in enumerate(energy.stations):
+                    snrs[station] = energy.snr_trace(i)
+            else:
+                snrs[energy.station] = energy.snr
+        return {s: snr for s, snr in snrs.items() if snr is not None}
+
+    def _trigger(self, candidates, snrs, min_snr):
+        """
+        Return the center of the densest cluster of global window candidates
+        and the stations that trigger on it
+
+        A station triggers if one of its candidates is less than
+        global_window:distri_secs/2 from the center and the SNR within a
+        second of that candidate exceeds min_snr
+
+        :param candidates: global window PickCandidates (with stations)
+        :param snrs: {station: SNR ArrayTrace}
+        :param min_snr: minimum SNR
+        :returns: center (UTCDateTime or None), set of triggered stations
+        """
+        if len(candidates) == 0:
+            return None, set()
+        gw = self.param.gw
+        center = UTCDateTime(center_distri(
+            [c.time.timestamp for c in candidates], gw.distri_secs,
+            method=gw.distri_method))
+        triggered = set()
+        for c in candidates:
+            if c.station in triggered or c.station not in snrs:
+                continue
+            if abs(c.time - center) > gw.distri_secs / 2:
+                continue
+            snr = snrs[c.station].slice(c.time - 1., c.time + 1.).data
+            if len(snr) > 0 and np.nanmax(snr) >= min_snr:
+                triggered.add(c.station)
+        return center, triggered
+
+    def _pick_continuous_event(self, st, channel_maps, center, triggered,
+                               candidates, event_padding, plotter,
+                               station_workers):
+        """
+        Pick and save an event declared in continuous data
+
+        :param st: continuous data
+        :param channel_maps: ChannelMaps of the non-flat-lined stations
+        :param center: event (candidate cluster center) time
+        :param triggered: triggered stations
+        :param candidates: the trigger window's global window candidates
+        :param event_padding: data kept on each side of the global window
+        :param plotter: Plotter object
+        :param station_workers: number of threads to pick stations in
+        """
+        t_begin = min([tr.stats.starttime for tr in st])
+        t_end = max([tr.stats.endtime for tr in st])
+        ft = max(center + self.param.gw.offsets[0], t_begin)
+        lt = min(center + self.param.gw.offsets[1], t_end)
+        event_st = st.slice(ft - event_padding, lt + event_padding)
+        plotter.gw.setup(ft - event_padding, lt + event_padding,
+                         list(channel_maps.keys()))
+        for station, cmap in channel_maps.items():
+            for tr in event_st.select(id=cmap.Z):
+                plotter.gw.plot_trace(tr, station, [c for c in candidates
+                                                    if c.station == station])
+        database_filename = center.strftime('%d-%H%M-%SL.S%Y%m')
+        obspy_picks, amplitudes, cmaps = self._pick_stream(
+            event_st, database_filename, None, plotter,
+            StageTimer(enabled=False), station_workers,
+            global_window=(channel_maps, ft, lt))
+        log('    {}: {:2d} Picks and {:2d} Amplitudes on {:2d} stations '
+            '({:d} triggered)'.format(database_filename,
+                                      len(obspy_picks) - len(amplitudes),
+                                      len(amplitudes), len(cmaps),
+                                      len(triggered)))
+
+    def _pick_stream(self, st, database_filename, wavefile, plotter, stages,
+                     station_workers=1, kurtosis_cache=None,
+                     global_window=None):
+        """
+        Pick an event's waveforms, associate the picks and save the event
+
+        :param st: the event's (demeaned) waveforms
+        :param database_filename: database file name (the output database
+            file has the same name)
+        :param wavefile: waveform file name to write in the output database
+            file (None: none)
+        :param plotter: Plotter object
+        :param stages: StageTimer object
+        :param station_workers: number of threads to pick stations in
+        :param kurtosis_cache: KurtosisCache object (None: new one)
+        :param global_window: (channel_maps, first_time, last_time) of an
+            already chosen global window.  None: choose it
+        :returns: obspy_picks, amplitudes, channel_maps
+        """
+        picks = self._associate_stream(st, database_filename, wavefile,
+                                       plotter, stages, station_workers,
+                                       kurtosis_cache, global_window)
+        obspy_pa = [x.to_obspy(self.run.channel_maps,
+                               self.param.SNR.quality_thresholds)
+                    for x in picks]
+        obspy_picks = [x[0] for x in obspy_pa]
+        obspy_arrivals = [x[1] for x in obspy_pa if x[1] is not None]
+        # amplitudes, obspy_picks = self._calc_amplitudes(obspy_picks)
+        with stages.stage('amplitudes'):
+            amplitudes, amp_picks = self._calc_amplitudes(obspy_picks)
+        obspy_picks.extend(amp_picks)
+        with stages.stage('save'):
+            self._save_event(obspy_picks, amplitudes, obspy_arrivals)
+        return obspy_picks, amplitudes, self.run.channel_maps
+
+    def _associate_stream(self, st, database_filename, wavefile, plotter,
+                          stages, station_workers=1, kurtosis_cache=None,
+                          global_window=None):
+        """
+        Pick an event's waveforms and associate the picks
+
+        Sets self.run.  Arguments are as for _pick_stream()
+
+        :returns: associated picks
+        :rtype: list of PickCandidate
+        """
+        if kurtosis_cache is None:
+            # Filtered data and kurtoses shared by the global and station
+            # passes
+            kurtosis_cache = KurtosisCache()
+        if global_window is None:
+            with stages.stage('global_window'):
+                # Not cached if plotted (the plot is drawn while choosing)
+                cmaps, ft, lt = self._cached(
+                    'global_window',
+                    (st, self.param.channel_mapping_rules, self.param.gw),
+                    lambda: self._choose_global_window(st, plotter,
+                                                       kurtosis_cache),
+                    stages, use_cache=not plotter.gw.plot)
+        else:
+            cmaps, ft, lt = global_window
         _check_timelimits(st, ft, lt)
         self.run = PickerRunParameters(
             database_filename=database_filename, wavefile=wavefile,
-            stream=st, channel_maps=cmaps, first_time=ft, last_time=lt)
+            stream=st, channel_maps=cmaps, first_time=ft, last_time=lt,
+            t_begin=min([tr.stats.starttime for tr in st]),
+            kurtosis_cache=kurtosis_cache, stages=stages)
         plotter.gw.plot_pickbounds(ft, lt)
         plotter.pw.setup(ft, lt, self.run.stations)
 
         # Pick on individual traces
-        candidates, picks = [], []
+        loops = []
         for sta, chan_map in self.run.channel_maps.items():
             # Reject stations not listed in parameter file
             if sta not in self.param.stations:
@@ -206,44 +859,56 @@ class PSPicker():
                 if not found_sta:
                     log(f'{sta} not in self.param.stations, ignored', 'warning')
                     continue
-            # with Timer(text="Pick one station: {:0.4f}s"):
-            p, c = self._pick_one_station(sta, chan_map, plotter)
-            picks.extend(p)
-            candidates.extend(c)
-
-        # with Timer(text="Associate: {:0.4f}s"):
-        picks = self.assoc.run(picks, candidates)
-        plotter.pw.plot_picks(picks, self.loop.t_begin, self.assoc)
-        # with Timer(text="Save picks: {:0.4f}s"):
+            loops.append(self._station_context(sta, chan_map))
+        stages.count('stations', len(loops))
+        if station_workers > 1:
+            with ThreadPoolExecutor(max_workers=station_workers) as executor:
+                # list() waits for all stations and raises their exceptions
+                list(executor.map(self._pick_one_station, loops))
+        else:
+            for loop in loops:
+                self._pick_one_station(loop)
+        candidates, picks = [], []
+        with stages.stage('plot_stations'):
+            for loop in loops:
+                self._plot_one_station(loop, plotter)
+        for loop in loops:
+            picks.extend(loop.picks)
+            candidates.extend(loop.candidates)
+        stages.count('candidates', len(candidates))
+
+        with stages.stage('associate'):
+            picks = self.assoc.run(picks, candidates)
+        plotter.pw.plot_picks(picks, self.run.t_begin, self.assoc)
         # log(f'picks = {picks}', 'debug')
-        picks = PickCandidate.remove_duplicates(picks)
-        obspy_pa = [x.to_obspy(self.run.channel_maps,
-                               self.param.SNR.quality_thresholds)
-                    for x in picks]
-        obspy_picks = [x[0] for x in obspy_pa]
-        obspy_arrivals = [x[1] for x in obspy_pa if x[1] is not None]
-        # amplitudes, obspy_picks = self._calc_amplitudes(obspy_picks)
-        amplitudes, amp_picks = self._calc_amplitudes(obspy_picks)
-        obspy_picks.extend(amp_picks)
-        self._save_event(obspy_picks, amplitudes, obspy_arrivals)
-        elapsed_time = timer.stop()
-        try:
-            dbfname = str(Path(database_filename)
-                         .relative_to(self.database_path_in))
-        except Exception:
-            dpfname = database_filename
-        log('    {}: {:2d} Picks and {:2d} Amplitudes on {:2d} stations in '
-            '{:0.2f} seconds'.format(dbfname,
-                                     len(obspy_picks) - len(amplitudes),
-                                     len(amplitudes), len(cmaps),
-                                     elapsed_time))
+        return PickCandidate.remove_duplicates(picks)
 
     def _run_one_day(self, year, month, day, plot_global, plot_stations,
                      ignore_fails, debug_fname, first_hour=None,
-                     first_minute=None, last_hour=None, last_minute=None):
-        """Select and run events for one day"""
+                     first_minute=None, last_hour=None, last_minute=None,
+                     timing=False):
+        """
+        Select and run events for one day
+
+        :returns: list of (s_file, run_one() output)
+        """
         log(f'Running {year}-{month}-{day}, {first_hour=}, '
             f'{first_minute=}, {last_hour=}, {last_minute=}', 'debug')
+        s_files = self._day_sfiles(year, month, day, first_hour,
+                                   first_minute, last_hour, last_minute)
+        timings = []
+        if len(s_files) > 0:
+            log('Running {:d} events on {:04d}-{:02d}-{:02d}'.format(
+                len(s_files), year, month, day))
+            for s_file in s_files:
+                timings.append((s_file, self._run_one_event(
+                    s_file, plot_global, plot_stations, ignore_fails,
+                    timing)))
+        return timings
+
+    def _day_sfiles(self, year, month, day, first_hour=None,
+                    first_minute=None, last_hour=None, last_minute=None):
+        """Return the sorted list of database files for one day"""
         db_path_in = self.database_path_in / f'{year:04d}' / f'{month:02d}'
         s_files = list(db_path_in.glob(f'{day:02d}-*.S*'))
         if len(s_files) > 0:
@@ -254,27 +919,41 @@ class PSPicker():
                 s_files = [f for f in s_files if self._nordic_fname_before(
                            f.name, last_hour, last_minute)]
         s_files.sort()
-        if len(s_files) > 0:
-            log('Running {:d} events on {:04d}-{:02d}-{:02d}'.format(
-                len(s_files), year, month, day))
-            for s_file in s_files:
-                log("   Running {}...".format(s_file), 'verbose')
-                t = Timer(logger=None)
-                t.start()
-                try:
-                    self.run_one(s_file, plot_global=plot_global,
-                                 plot_stations=plot_stations, log_level=None)
-                except Exception as err:
-                    log(f'run_one() failed for {s_file}', 'critical')
-                    log(err, 'error')
-                    if not ignore_fails:
-                        raise Exception(err)
-                    log('copying original s-file to dest', 'info')
-                    inf = s_file
-                    outf = self.database_path_out / Path(s_file).name
-                    log(f'{inf} to {outf}')
-                    shutil.copyfile(inf, outf)
-                # elapsed_time = t.stop()
+        return s_files
+
+    def _run_one_event(self, s_file, plot_global, plot_stations,
+                       ignore_fails, timing=False, waveforms=None,
+                       plot_dir=None, plot_formats=('png',)):
+        """
+        Run one event, copying the input database file if run_one() fails
+
+        :param s_file: database file
+        :param plot_global: show global and overall pick plots
+        :param plot_stations: show individual station plots
+        :param ignore_fails: keep going if the run fails
+        :param timing: time the event's stages
+        :param waveforms: (stream, wavefile) already read from the waveform
+            source, or the Exception raised while reading them
+        :param plot_dir: directory to save the plots in (None: show them)
+        :param plot_formats: figure formats
+        :returns: run_one() output (None if it failed)
+        """
+        log("   Running {}...".format(s_file), 'verbose')
+        try:
+            return self.run_one(s_file, plot_global=plot_global,
+                                plot_stations=plot_stations, log_level=None,
+                                timing=timing, waveforms=waveforms,
+                                plot_dir=plot_dir, plot_formats=plot_formats)
+        except Exception as err:
+            log(f'run_one() failed for {s_file}', 'critical')
+            log(err, 'error')
+            if not ignore_fails:
+                raise Exception(err)
+            log('copying original s-file to dest', 'info')
+            inf = s_file
+            outf = self.database_path_out / Path(s_file).name
+            log(f'{inf} to {outf}')
+            shutil.copyfile(inf, outf)
 
     @staticmethod
     def _nordic_fname_after(f, hour, minute):
@@ -322,92 +1001,179 @@ class PSPicker():
             return datetime(int(d[:4]), int(d[4:6]), int(d[6:8]), int(d[8:10]),
                             int(d[10:]))
 
-    def _pick_one_station(self, station_name, chan_map, plotter):
+    def _station_context(self, station_name, chan_map):
         """
-        Calculate picks and candidates for one station
+        Return the per-station context used to pick one station
 
         :param station_name: station name
         :param chan_map: ChannelMap object for the station
-        :param plotter: Plotter object
+        :returns: PickerStationParameters object
+        """
+        return PickerStationParameters(
+            station=station_name,
+            station_params=self._station_params(station_name),
+            channel_map=chan_map,
+            stream=self.run.stream)
+
+    def _station_params(self, station_name):
+        """
+        Return a station's StationParameters (matching wildcards if needed)
+
+        :param station_name: station name
         """
-        # make shortened reference to often-used station_parameters
-        # with Timer(text="  pick_one_station(): setup {:0.4f}s"):
         if station_name in self.param.station_parameters:
-            station_params = self.param.station_parameters[station_name]
-        else:
-            for pattern in self.param.station_parameters.keys():
-                if fnmatch(station_name, pattern):
-                    station_params = self.param.station_parameters[pattern]
-                    break
-        self.loop = PickerStationParameters(station=station_name,
-                                            station_params=station_params,
-                                            channel_map=chan_map,
-                                            stream=self.run.stream)
-        plotter.sw.setup(self.loop.datP[0])
-        c_P, c_S, candidates = None, None, []
+            return self.param.station_parameters[station_name]
+        for pattern in self.param.station_parameters.keys():
+            if fnmatch(station_name, pattern):
+                return self.param.station_parameters[pattern]
+
+    def _pick_one_station(self, loop):
+        """
+        Calculate picks and candidates for one station
+
+        Only reads self.run and self.param, everything it calculates is put
+        in loop, so that stations can be picked in parallel threads
+
+        :param loop: PickerStationParameters object for the station
+        """
+        station_name = loop.station
+        station_params = loop.station_params
+        stages = self.run.stages
+
+        # Filtered on first use, so that cached stages don't filter
+        filtered = []
+
+        def datS_filt():
+            if not filtered:
+                filtered.append(FILTER_BANK.filter_stream(
+                    loop.datS, station_params.SNR_energy.frequency_band))
+            return filtered[0]
 
         # SNR analysis
-        # with Timer(text="  pick_one_station(): SNR {:0.4f}s"):
-        datS_filt = self.loop.datS.copy().filter(
-            'bandpass', corners=3,
-            freqmin=station_params.SNR_energy.frequency_band[0],
-            freqmax=station_params.SNR_energy.frequency_band[1])
-        energy = EnergySNR(datS_filt, self.param.SNR, plot=self.plot_debug)
-        trust, message = energy.slice(self.run.first_time,
-                                      self.run.last_time).is_trustworthy()
+        with stages.stage('snr'):
+            # The energy and SNR traces only depend on the SNR windows
+            energy = self._cached(
+                'snr', (loop.datS, station_params.SNR_energy.frequency_band,
+                        self.param.SNR.signal_window,
+                        self.param.SNR.noise_window),
+                lambda: EnergySNR(datS_filt(), self.param.SNR,
+                                  plot=self.plot_debug),
+                stages)
+            energy.params = self.param.SNR
+            trust, message = energy.slice(self.run.first_time,
+                                          self.run.last_time).is_trustworthy()
         log(f"{station_name}: SNR {message}", 'verbose')
+        loop.energy = energy
+        loop.trustworthy = trust
         if trust:
-            # with Timer(text="  pick_one_station(): Kurtosis {:0.4f}s"):
-            c_P, c_S, kurt, candidates = self._run_Kurtosis(energy, plotter)
-            for c in candidates:
-                c.station = station_name
-
-            # Verify phases using Polarity analysis
-            DR = None
-            # with Timer(text="  pick_one_station(): Polarity analysis
-            #      {:0.4f}s"):
-            if station_params.use_polarity and (len(datS_filt) == 3):
+            loop.c_P, loop.c_S, loop.kurtosis, loop.candidates, loop.DR = \
+                self._cached('candidates',
+                             (loop.datP, loop.datS, station_params,
+                              self.param.SNR, self.param.polarity,
+                              self.param.channel_mapping_rules,
+                              self.run.first_time, self.run.last_time),
+                             lambda: self._station_candidates(
+                                 loop, energy, datS_filt()),
+                             stages)
+        loop.picks = self._make_picks(loop.c_P, loop.c_S)
+
+    def _station_candidates(self, loop, energy, datS_filt):
+        """
+        Return a station's candidates, verified by polarity if possible
+
+        :param loop: PickerStationParameters object for the station
+        :param energy: EnergySNR object
+        :param datS_filt: filtered S-picking traces
+        :returns: c_P, c_S, Kurtosis object, candidates, DR trace
+        """
+        stages = self.run.stages
+        DR = None
+        with stages.stage('kurtosis'):
+            c_P, c_S, kurt, candidates = self._run_Kurtosis(loop, energy)
+        for c in candidates:
+            c.station = loop.station
+
+        # Verify phases using Polarity analysis
+        if loop.station_params.use_polarity and (len(datS_filt) == 3):
+            with stages.stage('polarity'):
                 c_P, c_S, DR, candidates = self._polarity_analysis(
                         c_P, c_S, candidates, datS_filt)
+        return c_P, c_S, kurt, candidates, DR
+
+    def _cached(self, stage, inputs, calculate, stages, use_cache=True):
+        """
+        Return calculate(), or its result cached for the same inputs
+
+        :param stage: stage name
+        :param inputs: everything that calculate()'s result depends on
+        :param calculate: function calculating the result
+        :param stages: StageTimer object (counts cache hits and misses)
+        :param use_cache: use the result cache (if there is one)
+        """
+        if self.result_cache is None or not use_cache or self.plot_debug:
+            return calculate()
+        key = self.result_cache.key(stage, *inputs)
+        result = self.result_cache.get(key)
+        if result is not None:
+            stages.count('cache_hits')
+            return result
+        stages.count('cache_misses')
+        result = calculate()
+        self.result_cache.put(key, result)
+        return result
+
+    def _plot_one_station(self, loop, plotter):
+        """
+        Plot the results of _pick_one_station()
+
+        :param loop: PickerStationParameters object for the station
+        :param plotter: Plotter object
+        """
+        plotter.sw.setup(loop.datP[0])
+        if loop.trustworthy:
             plotter.sw.plot_data(self.run.first_time, self.run.last_time,
                                  self.param.SNR.quality_thresholds,
-                                 self.loop.datP[0],
-                                 energy,
-                                 kurt,
-                                 DR,
+                                 loop.datP[0],
+                                 loop.energy,
+                                 loop.kurtosis,
+                                 loop.DR,
                                  self.param.polarity.DR_threshold_P,
                                  self.param.polarity.DR_threshold_S)
-            if len(candidates) > 0:
-                plotter.sw.candidates(candidates,
+            if len(loop.candidates) > 0:
+                plotter.sw.candidates(loop.candidates,
                                       self.param.polarity.DR_threshold_P,
                                       self.param.polarity.DR_threshold_S)
 
-        plotter.pw.plot_traces_candidates(self.loop.datP, c_P, c_S,
-                                          candidates, station_name, self.assoc)
-        plotter.sw.onsets(c_P, c_S, self.loop.data_limits)
+        plotter.pw.plot_traces_candidates(loop.datP, loop.c_P, loop.c_S,
+                                          loop.candidates, loop.station,
+                                          self.assoc)
+        plotter.sw.onsets(loop.c_P, loop.c_S, loop.data_limits)
 
-        new_picks = self._make_picks(c_P, c_S)
-        return new_picks, candidates
+    def _read_waveforms(self, database_filename, format='NORDIC',
+                        waveforms=None):
+        """
+        Return an event's demeaned waveforms and waveform file name
 
-    def _read_waveforms(self, database_filename, format='NORDIC'):
-        if format == 'NORDIC':
-            full_wavefile = self._get_nordic_wavefile_name(database_filename)
-        else:
-            raise NameError(f'type {type} not implemented')
-        stream = obspy_read(full_wavefile, 'MSEED')
-        # get rid of bad last sample in some streams, and detrend
+        :param database_filename: database file
+        :param format: database file format
+        :param waveforms: (stream, wavefile) already read from the waveform
+            source, or the Exception raised while reading them.  None: read
+            them
+        """
+        if isinstance(waveforms, Exception):
+            raise waveforms
+        if waveforms is None:
+            if format == 'NORDIC':
+                log(f'database filename = {database_filename}', 'verbose')
+                request = WaveformRequest.from_sfile(database_filename,
+                                                     self.database_index)
+            else:
+                raise NameError(f'type {type} not implemented')
+            waveforms = self.waveform_source.get(request)
+        stream, wavefile = waveforms
         for tr in stream:
-            tr.data = tr.data[:-10]
             tr.detrend(type='demean')
-        return stream, full_wavefile
-
-    def _get_nordic_wavefile_name(self, database_filename):
-        log(f'database filename = {database_filename}', 'verbose')
-        cat, wav_names = read_nordic(database_filename, return_wavnames=True)
-        assert len(wav_names) == 1, 'More than one wav_name in database file'
-        pts = wav_names[0][0].split('-')
-        full_wav_name = self.wav_base_path / pts[0] / pts[1] / wav_names[0][0]
-        return str(full_wav_name)
+        return stream, wavefile
 
     def _full_nordic_database_filename(self, filename):
         """
@@ -436,20 +1202,23 @@ class PSPicker():
         else:
             raise NameError(f'database file "{filename}" not found')
 
-    def _choose_global_window(self, stream, plotter):
+    def _choose_global_window(self, stream, plotter, kurtosis_cache=None):
         """
         Choose the global pick window
 
         :param stream: all the data read in
         :param plotter: Plotter object
+        :param kurtosis_cache: KurtosisCache object
         """
         t_begin = min([t.stats.starttime for t in stream])
         t_end = max([t.stats.endtime for t in stream])
         chan_maps = select_traces(stream, self.param.channel_mapping_rules)
         plotter.gw.setup(t_begin, t_end, [s for s in chan_maps.keys()])
         log(self._channel_maps_str(chan_maps), 'verbose')
-        distri, chan_maps = self._gw_get_distri(stream, chan_maps, plotter)
-        ft, lt, distri = self._gw_set_window(t_begin, t_end, distri)
+        candidates, chan_maps = self._gw_get_distri(
+            stream, chan_maps, plotter, kurtosis_cache=kurtosis_cache)
+        ft, lt, distri = self._gw_set_window(t_begin, t_end,
+                                             [c.time for c in candidates])
         log(f'Global window bounds: {ft} to {lt}', 'verbose')
         return chan_maps, ft, lt
 
@@ -463,7 +1232,8 @@ class PSPicker():
             s += f'{key:8s}|{v.__str__(format="table_row")}\n'
         return s
 
-    def _gw_get_distri(self, stream, channel_maps, plotter, n_smooth=15):
+    def _gw_get_distri(self, stream, channel_maps, plotter, n_smooth=15,
+                       kurtosis_cache=None, starttime=None, endtime=None):
         """
         Get overall pick distribution (and remove flat-lined stations)
 
@@ -474,10 +1244,17 @@ class PSPicker():
         :param channel_maps: mapping of channel names to components
         :param plotter: the plotter object
         :n_smooth: samples to smooth kurtosis over
-        :returns: overall_distribution of extrema, channel_maps, plotter
+        :param kurtosis_cache: KurtosisCache object
+        :param starttime: first time to look for extrema (None: trace start)
+        :param endtime: last time to look for extrema (None: trace end)
+        :returns: overall distribution of extrema (PickCandidates, with
+            their stations), channel_maps
         """
         # Pick_Function.m:134
         p = self.param
+        # A copy, so that the parameters (and their hash) are not modified
+        gw_kurtosis = copy.copy(p.gw.kurtosis)
+        gw_kurtosis.n_smooth = n_smooth
         overall_distri = []
         rm_stations = []
         for station, channel_map in channel_maps.items():
@@ -485,22 +1262,26 @@ class PSPicker():
             assert station == trace.stats.station,\
                 'trace station ({}) != iteration station ({})'.format(
                     trace.stats.station, station)
-            if np.all(np.diff(trace.data) == 0):
+            data = trace.data
+            if starttime is not None or endtime is not None:
+                data = ArrayTrace.from_trace(trace).slice(starttime,
+                                                          endtime).data
+            if np.all(np.diff(data) == 0):
                 log(f'Station {station} flat-lined, ignoring', 'warning')
                 rm_stations.append(station)
                 continue
-            p.gw.kurtosis.n_smooth = n_smooth
-            k = Kurtosis(p.gw.kurtosis)
-            candidates = k.pick_trace(trace, p.gw.max_candidates)
+            k = Kurtosis(gw_kurtosis, cache=kurtosis_cache)
+            candidates = k.pick_trace(trace, p.gw.max_candidates, starttime,
+                                      endtime)
             for x in candidates:
                 x.station = station
-            overall_distri.extend([x.time for x in candidates])
+            overall_distri.extend(candidates)
             plotter.gw.plot_trace(trace, station, candidates)
 
         # REMOVE PROBLEM STATIONS (if necessary)
         channel_maps = {s: v for s, v in channel_maps.items()
                         if s not in rm_stations}
-        log(f'all global picks: {overall_distri}', 'debug')
+        log('all global picks: %s', 'debug', [x.time for x in overall_distri])
         return overall_distri, channel_maps
 
     def _gw_set_window(self, t_begin, t_end, overall_distri):
@@ -518,7 +1299,8 @@ class PSPicker():
         # Cut down picks to those within global bounds
         overall_distri = [t for t in overall_distri if t <= max_time]
         min_global = UTCDateTime(center_distri(
-            [t.timestamp for t in overall_distri], self.param.gw.distri_secs))
+            [t.timestamp for t in overall_distri], self.param.gw.distri_secs,
+            method=self.param.gw.distri_method))
 
         first_time = max(min_global + self.param.gw.offsets[0], t_begin)
         last_time = min(min_global + self.param.gw.offsets[1], t_end)
@@ -528,24 +1310,25 @@ class PSPicker():
         #     last_time = t_end
         return first_time, last_time, overall_distri
 
-    def _run_Kurtosis(self, energy, plotter, debug=False):
+    def _run_Kurtosis(self, loop, energy, debug=False):
         """
         calculate extrema and estimate P and S onsets using the Kurtosis
 
+        :param loop: PickerStationParameters object
         :param energy: EnergySNR object
-        :param plotter: Plotter object
         :returns:
             c_P: P PickCandidate
             c_S: S PickCandidate
             kurtosis: Kurtosis object
             candidates: list of all PickCandidtes
         """
-        first_time, last_time = self._refine_pick_window(energy.nrg)
-        if len(self.loop.datP) > 1:
+        first_time, last_time = self._refine_pick_window(loop, energy.nrg)
+        if len(loop.datP) > 1:
             warnings.warn('Only working on first trace in datP')
-        k = Kurtosis(self.loop.station_params.kurtosis)
-        candidates = k.pick_trace(self.loop.datP[0],
-                                  self.loop.station_params.max_candidates,
+        k = Kurtosis(loop.station_params.kurtosis,
+                     cache=self.run.kurtosis_cache)
+        candidates = k.pick_trace(loop.datP[0],
+                                  loop.station_params.max_candidates,
                                   first_time, last_time)
         #  Trace.times('utcdatetime') takes 0.3s per call!
         times = energy.snr.times('timestamp')
@@ -557,19 +1340,20 @@ class PSPicker():
         # calculate picks using only candidates with SNR above min threshold
         strong_candidates = [x for x in candidates
                              if x.snr > min(self.param.SNR.quality_thresholds)]
-        c_P, c_S = self._calc_follows(strong_candidates)
+        c_P, c_S = self._calc_follows(loop, strong_candidates)
         return c_P, c_S, k, candidates
 
-    def _refine_pick_window(self, energy):
+    def _refine_pick_window(self, loop, energy):
         """
         Refine pick window to account for analysis windows?
 
         Seems like a convoluted way to reduce the time window by
         the longest kurtosis window length + the station energy window?
         I mean, why are we even smoothing the energy window?
+        :param loop: PickerStationParameters object
         :param energy: energy trace
         """
-        if self.loop.station_params.SNR_energy.window == 0:
+        if loop.station_params.SNR_energy.window == 0:
             return (self.run.first_time,
                     self.run.last_time)
 
@@ -580,10 +1364,9 @@ class PSPicker():
         # print(energy_smooth, type(energy_smooth), energy_smooth.data)
         ind_max = np.nanargmax(energy_smooth.data)
         last_sample = ind_max.copy()
-        max_kurto_wind = np.max(self.loop.station_params.kurtosis
-                                                        .window_lengths)
+        max_kurto_wind = np.max(loop.station_params.kurtosis.window_lengths)
         max_precursor = np.floor(
-            sr * (self.loop.station_params.SNR_energy.window + max_kurto_wind))
+            sr * (loop.station_params.SNR_energy.window + max_kurto_wind))
         first_sample = ind_max - max_precursor
         if first_sample < 0:
             first_sample = 0
@@ -613,6 +1396,7 @@ class PSPicker():
                        ncomponents=self.param.channel_mapping_rules.component_orientation_codes.N,
                        ecomponents=self.param.channel_mapping_rules.component_orientation_codes.E)
         DR = pol.calc_dip_rect([c.time for c in candidates])
+        self.run.stages.count('polarity_samples', pol.n_samples_analyzed)
         if DR is None:
             log("DR not returned, keeping input picks", "debug")
             return c_P, c_S, DR, candidates
@@ -644,17 +1428,18 @@ class PSPicker():
         log(f'polarity-verified c_P={c_P}, c_S={c_S}', 'verbose')
         return c_P, c_S, DR, candidates
 
-    def _calc_follows(self, candidates):
+    def _calc_follows(self, loop, candidates):
         """
         returns offsets depending on number of extrema to follow
 
+        :param loop: PickerStationParameters object
         :param candidates: list of PickCandidate
         :returns candidate_P, candidate_S
         :rtype: PickCandidate, PickCandidate
         """
         # Pick_Function.m:507
         # eliminate extrema whose snr is less than SNR.thresh
-        max_candidates = self.loop.station_params.max_candidates
+        max_candidates = loop.station_params.max_candidates
         # assert max_candidates in (1, 2), 'max_candidates is not 1 or 2'
         if len(candidates) == 0:
             return None, None
@@ -688,7 +1473,7 @@ class PSPicker():
     def _calc_amplitudes(self, picks):
         amplitudes = []
         amp_picks = []
-        stations = list(set([p.waveform_id.station_code for p in picks]))
+        stations = sorted(set([p.waveform_id.station_code for p in picks]))
         for station in stations:
             sta_picks = [p.copy() for p in picks
                          if p.waveform_id.station_code == station]
@@ -774,7 +1559,8 @@ class PSPicker():
                                Path(self.run.database_filename).name,
                                amplitudes=amplitudes,
                                arrivals=arrivals,
-                               wavefiles=[self.run.wavefile])
+                               wavefiles=None if self.run.wavefile is None
+                               else [self.run.wavefile])
 
     def _write_debug_file(self, debug_fname, err, s_file):
         """
@@ -791,6 +1577,32 @@ class PSPicker():
             fid.write(f'    picker.run_one("{s_file}")\n\n')
 
 
+# PSPicker of a run_many() worker process, set by _init_pool_worker()
+_worker_picker = None
+
+
+def _init_pool_worker(picker, queue, log_level):
+    """
+    Set up a run_many() worker process
+
+    :param picker: PSPicker to run the worker's events with
+    :param queue: log queue returned by start_log_listener()
+    :param log_level: lowest level to log
+    """
+    global _worker_picker
+    setup_worker_log(queue, log_level)
+    _worker_picker = picker
+
+
+def _run_pool_event(s_file, *args, **kwargs):
+    """
+    Run one event in a run_many() worker process
+
+    Arguments are as for PSPicker._run_one_event()
+    """
+    return _worker_picker._run_one_event(s_file, *args, **kwargs)
+
+
 def _check_timelimits(st, ft, lt):
     """ Check if there are traces outside of the time limits """
     bad_traces = [tr for tr in st
@@ -802,17 +1614,26 @@ def _check_timelimits(st, ft, lt):
         log(stream, 'error')
 
 
-def center_distri(v, win_size, n_steps=1000):
+def center_distri(v, win_size, n_steps=1000, method='sweep'):
     """
     Return the center of the window containing the most values in an array
 
     :param v: array of values
     :param win_size: window size
     :param n_steps: number of values between min(v) and max(v) to test
+        (method='grid' only)
+    :param method: 'sweep': return the center of the values in the first
+                            window containing the most values
+                   'grid': return the best of n_steps window centers
+                           between min(v) and max(v)
     :returns: center of the distribution
     """
     if len(v) == 0:
         return []
+    if method == 'sweep':
+        return _center_distri_sweep(v, win_size)
+    elif not method == 'grid':
+        raise ValueError(f"method '{method}' unknown")
 
     t = []
     s = []
@@ -827,6 +1648,24 @@ def center_distri(v, win_size, n_steps=1000):
     return s[np.argmax(t)]
 
 
+def _center_distri_sweep(v, win_size):
+    """
+    Return the center of the values in the densest window
+
+    Sorts the values, then finds, for each value, the number of values
+    less than win_size after it (the window is open, as in the grid search)
+
+    :param v: array of values
+    :param win_size: window size
+    :returns: center of the distribution
+    """
+    v = np.sort(v)
+    i_ends = np.searchsorted(v, v + win_size, side='left')
+    i_first = np.argmax(i_ends - np.arange(len(v)))
+    i_last = max(i_ends[i_first] - 1, i_first)  # in case win_size <= 0
+    return (v[i_first] + v[i_last]) / 2
+
+
 def estimate_origin_time(picks, vp_over_vs=1.7):
     """
     estimate EQ origin time based on pick times
@@ -870,6 +1709,7 @@ def _average_ps_o_time(picks, vp_vs):
         return None
     else:
         # Throw out values more than 3 std away
+        from scipy import stats
         zs = np.abs(stats.zscore([x for x in o_ts]))
         # log(zs, 'debug')
         if np.any(np.isnan(zs)):
@@ -0,0 +1,150 @@
+"""
+On-disk cache of intermediate picking products, keyed by their inputs
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from obspy.core import Stream, Trace, UTCDateTime
+
+from .logger import log
+from .version import __version__
+
+
+class ResultCache():
+    """
+    Cache of stage results (global window, station SNR, candidates...)
+
+    Each result is pickled in cache_dir/{stage}/{hash}.pkl, where hash is a
+    hash of the stage's inputs: the waveforms it reads and only the
+    parameters it uses (and the pspicker version).  Changing a parameter
+    thus only invalidates the results of the stages that use it.  If
+    cache_dir is None, the pickled results are kept in memory.
+
+    The code of the stages is not hashed: pspicker's version (version.py)
+    must change whenever a cached stage's algorithm does, or results
+    calculated by the old code will be reused.
+
+    >>> cache = ResultCache('pspicker_cache')
+    >>> key = cache.key('snr', stream, snr_params)
+    >>> result = cache.get(key)   # None if not cached
+    >>> cache.put(key, result)
+    """
+    def __init__(self, cache_dir=None):
+        """
+        :param cache_dir: cache directory (created if needed).  None: keep
+            the results in memory
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self._memory = {}
+
+    def __str__(self):
+        if self.cache_dir is None:
+            return f'ResultCache: {len(self._memory):d} results in memory'
+        return f'ResultCache: {self.cache_dir}'
+
+    def clear(self):
+        """
+        Remove the results kept in memory
+        """
+        self._memory = {}
+
+    def key(self, stage, *inputs):
+        """
+        Return the cache key of a stage's result
+
+        :param stage: stage name
+        :param inputs: everything the stage's result depends on (Streams,
+            Traces, arrays, parameter objects, UTCDateTimes, numbers...)
+        """
+        return f'{stage}/{content_hash(__version__, stage, *inputs)}'
+
+    def _path(self, key):
+        return self.cache_dir / f'{key}.pkl'
+
+    def get(self, key):
+        """
+        Return a cached result, or None if there is none
+        """
+        if self.cache_dir is None:
+            data = self._memory.get(key)
+            return pickle.loads(data) if data is not None else None
+        path = self._path(key)
+        if not path.is_file():
+            return None
+        try:
+            with open(path, 'rb') as fp:
+                return pickle.load(fp)
+        except Exception as err:
+            log(f'Could not read cached {key} ({err}), ignoring', 'warning')
+            return None
+
+    def put(self, key, value):
+        """
+        Cache a result
+
+        The file is written under a temporary name and then renamed, so
+        that processes sharing the cache never read a partial file
+        """
+        if self.cache_dir is None:
+            # Pickled, so that get() returns a copy, as when read from disk
+            self._memory[key] = pickle.dumps(value,
+                                             protocol=pickle.HIGHEST_PROTOCOL)
+            return
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                pickle.dump(value, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_name, path)
+        except Exception:
+            os.unlink(tmp_name)
+            raise
+
+
+def content_hash(*objs):
+    """
+    Return a hash of the contents of objects
+
+    Streams and Traces are hashed by their ids, start times, sampling rates
+    and data; other objects by their attributes (recursively) or repr()
+    """
+    h = hashlib.sha256()
+    for obj in objs:
+        _update_hash(h, obj)
+    return h.hexdigest()[:32]
+
+
+def _update_hash(h, obj):
+    """
+    Add an object's contents to a hashlib hash
+    """
+    if isinstance(obj, Stream):
+        h.update(f'Stream:{len(obj):d}'.encode())
+        for tr in obj:
+            _update_hash(h, tr)
+    elif isinstance(obj, Trace):
+        s = obj.stats
+        h.update(f'Trace:{obj.id}:{s.starttime}:{s.sampling_rate}'.encode())
+        _update_hash(h, obj.data)
+    elif isinstance(obj, np.ndarray):
+        h.update(f'ndarray:{obj.dtype.str}:{obj.shape}'.encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        h.update(f'dict:{len(obj):d}'.encode())
+        for k in sorted(obj, key=repr):
+            _update_hash(h, k)
+            _update_hash(h, obj[k])
+    elif isinstance(obj, (list, tuple)):
+        h.update(f'{type(obj).__name__}:{len(obj):d}'.encode())
+        for x in obj:
+            _update_hash(h, x)
+    elif isinstance(obj, UTCDateTime) or not hasattr(obj, '__dict__'):
+        h.update(f'{type(obj).__name__}:{obj!r}'.encode())
+    else:
+        h.update(f'{type(obj).__name__}'.encode())
+        _update_hash(h, vars(obj))
@@ -9,21 +9,47 @@ from future.builtins import *  # NOQA @UnusedWildImport
 
 import unittest
 import inspect
+import logging
+from logging.handlers import BufferingHandler
+import json
 import difflib
 import pprint
+import tempfile
 from pathlib import Path
+from unittest import mock
 
+import numpy as np
 from obspy import read as obspy_read
 from obspy.core import UTCDateTime
 from obspy.core.event.origin import Pick, Arrival
 from obspy.core.event.magnitude import Amplitude
 from obspy.core.event.base import WaveformStreamID, QuantityError
+from obspy.io.nordic.core import read_nordic
 
 # from obsinfo.misc.info_files import _read_json_yaml
-from pspicker.pspicker import PSPicker
+from pspicker.pspicker import PSPicker, center_distri
+from pspicker.kurtosis import (Kurtosis, KurtosisCache, StreamingKurtosis,
+                               _kurtosis_array)
+from pspicker.parameters.kurtosis_parameters import KurtosisParameters
+from pspicker.polarity import Polarity
+from pspicker.parameters.polarity_parameters import PolarityParameters
 from pspicker.local_amplitude import (LocalAmplitude, get_response)
 from pspicker.paz import PAZ
-from pspicker.logger import setup_log
+from pspicker.logger import setup_log, log
+from pspicker.utils import ArrayTrace, central_moving_average
+from pspicker.energy_snr import EnergySNR, EnergySNRBatch, _central_mean
+from pspicker.parameters import PickerParameters
+from pspicker.benchmarks import (SyntheticEvent, run_benchmarks, BENCHMARKS,
+                                 import_time)
+from pspicker.timer import StageTimer
+from pspicker.filter_bank import FilterBank, FILTER_BANK
+from pspicker.database_index import DatabaseIndex
+from pspicker.delay_table import DelayTable
+from pspicker.pick_candidate import PickCandidate
+from pspicker.associator import Associator
+from pspicker.parameters.associator_parameters import AssociatorParameters
+from pspicker.waveform_source import (WaveformSource, WaveformRequest,
+                                      SDSSource)
 
 pp = pprint.PrettyPrinter(indent=4)
 setup_log()
@@ -64,6 +90,20 @@ class TestADDONSMethods(unittest.TestCase):
 
             self.fail("Multi-line strings are unequal:\n" + message)
 
+    def assertDatabasesEqual(self, first, second, n_files):
+        """
+        Assert that two directories contain the same database files
+
+        Ignores the processing time on each file's ID line
+        """
+        names = sorted(p.name for p in Path(first).iterdir())
+        self.assertEqual(len(names), n_files)
+        self.assertEqual(names, sorted(p.name for p in
+                                       Path(second).iterdir()))
+        for name in names:
+            self.assertTextFilesEqual(Path(first) / name,
+                                      Path(second) / name, ignore_lines=[1])
+
     def test_get_response(self):
         """
         Test reading response files
@@ -102,6 +142,10 @@ class TestADDONSMethods(unittest.TestCase):
         wood_calc, _ = la.get_iaml(method='wood_calc')
         wood_est, _ = la.get_iaml(method='wood_est')
         raw, _ = la.get_iaml(method='raw_disp')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            plot_file = Path(tmpdir) / 'amplitude.png'
+            la.get_iaml(method='wood_calc', plot=True, plot_file=plot_file)
+            self.assertTrue(plot_file.is_file())
         # Values obtained when response was mis-interpreted as nm/s
         # self.assertAlmostEqual(amp_wood_calc.generic_amplitude, 1097.55509106/1e9)
         # self.assertAlmostEqual(amp_wood_calc.period, 0.112)
@@ -117,6 +161,293 @@ class TestADDONSMethods(unittest.TestCase):
         #     print(f'{typ:10s} | {amp.generic_amplitude*1000:12.4g}  | {amp.period:8.3f}')
 # 
 
+    def test_log(self):
+        """
+        Test that log() formats lazily and reports its caller
+        """
+        class Counter():
+            n_str = 0
+
+            def __str__(self):
+                Counter.n_str += 1
+                return 'counter'
+
+        with self.assertLogs('pspicker', level='VERBOSE') as cm:
+            log('value: %s', 'debug', Counter())
+            log('value: %s', 'verbose', Counter())
+        self.assertEqual(Counter.n_str, 1)
+        self.assertEqual(cm.output, ['VERBOSE:pspicker:value: counter'])
+        self.assertEqual(cm.records[0].funcName, 'test_log')
+
+    def test_array_trace(self):
+        """
+        Test that ArrayTraces slice like obspy Traces, without copying
+        """
+        datafile = str(self.data_path / "20190519T060917_MONA.mseed")
+        trace = obspy_read(datafile, 'MSEED')[0]
+        atrace = ArrayTrace.from_trace(trace)
+        self.assertIs(atrace.data, trace.data)
+        self.assertEqual(atrace.stats.endtime, trace.stats.endtime)
+        t0, sr = trace.stats.starttime, trace.stats.sampling_rate
+        for offsets in [(10, 20), (10.3 / sr, 20.5 / sr), (-5, 10),
+                        (50, 1000), (None, 7.77), (0, 0), (80, None)]:
+            start, end = [None if x is None else t0 + x for x in offsets]
+            sliced = trace.slice(start, end)
+            asliced = atrace.slice(start, end)
+            self.assertEqual(asliced.stats.starttime, sliced.stats.starttime)
+            self.assertEqual(asliced.stats.endtime, sliced.stats.endtime)
+            np.testing.assert_array_equal(asliced.data, sliced.data)
+            self.assertTrue(np.shares_memory(asliced.data, trace.data)
+                            or len(sliced.data) == 0)
+        np.testing.assert_array_equal(atrace.times('timestamp'),
+                                      trace.times('timestamp'))
+        self.assertEqual(atrace.to_trace().id, trace.id)
+
+    def test_kurtosis_engines(self):
+        """
+        Test that the array and trace kurtosis engines give the same results
+        """
+        datafile = str(self.data_path / "20190519T060917_MONA.mseed")
+        trace = obspy_read(datafile, 'MSEED').select(component='3')[0]
+        starttime = trace.stats.starttime + 10
+        endtime = trace.stats.starttime + 50
+        kurtoses = {}
+        for engine in ('trace', 'array'):
+            params = KurtosisParameters([[3, 15], [8, 30]], [0.3, 1, 4],
+                                        [2, 10, 40], n_smooth=5,
+                                        engine=engine)
+            k = Kurtosis(params)
+            candidates = k.pick_trace(trace, 3, starttime, endtime)
+            kurtoses[engine] = (k, [c.time for c in candidates])
+        k_trace, t_trace = kurtoses['trace']
+        k_array, t_array = kurtoses['array']
+        self.assertEqual(k_trace.mean_cumulative_kurtosis.stats.starttime,
+                         k_array.mean_cumulative_kurtosis.stats.starttime)
+        np.testing.assert_allclose(k_array.mean_cumulative_kurtosis.data,
+                                   k_trace.mean_cumulative_kurtosis.data)
+        np.testing.assert_allclose(k_array.mean_kurtosis.data,
+                                   k_trace.mean_kurtosis.data)
+        self.assertEqual(t_trace, t_array)
+
+    def test_kurtosis_moments(self):
+        """
+        Test that cumulative-sum and lfilter kurtosis moments agree
+        """
+        datafile = str(self.data_path / "20190519T060917_MONA.mseed")
+        trace = obspy_read(datafile, 'MSEED').select(component='3')[0]
+        starttime = trace.stats.starttime + 10
+        endtime = trace.stats.starttime + 50
+        kurtoses = {}
+        for method in ('lfilter', 'cumsum'):
+            params = KurtosisParameters([[3, 15], [8, 30]], [0.3, 1, 4],
+                                        [2, 10, 40], n_smooth=5,
+                                        moments_method=method)
+            k = Kurtosis(params)
+            candidates = k.pick_trace(trace, 3, starttime, endtime)
+            kurtoses[method] = (k, [c.time for c in candidates])
+        k_lfilter, t_lfilter = kurtoses['lfilter']
+        k_cumsum, t_cumsum = kurtoses['cumsum']
+        np.testing.assert_allclose(k_cumsum.mean_kurtosis.data,
+                                   k_lfilter.mean_kurtosis.data, rtol=1e-10)
+        np.testing.assert_allclose(k_cumsum.mean_cumulative_kurtosis.data,
+                                   k_lfilter.mean_cumulative_kurtosis.data,
+                                   rtol=1e-8, atol=1e-8)
+        self.assertEqual(t_lfilter, t_cumsum)
+        # Quiet windows after a much larger signal keep their precision
+        data = np.random.default_rng(0).normal(size=20000)
+        data[5000:5500] *= 1e4
+        np.testing.assert_allclose(
+            _kurtosis_array(data, 801, 100., 'cumsum'),
+            _kurtosis_array(data, 801, 100., 'lfilter'), rtol=1e-10)
+
+    def test_kurtosis_cache(self):
+        """
+        Test that cached filtered data and kurtoses give the same results
+        """
+        datafile = str(self.data_path / "20190519T060917_MONA.mseed")
+        trace = obspy_read(datafile, 'MSEED').select(component='3')[0]
+        starttime = trace.stats.starttime + 10
+        endtime = trace.stats.starttime + 50
+        gw_params = KurtosisParameters([[3, 15]], [5], n_smooth=15)
+        params = KurtosisParameters([[3, 15], [8, 30]], [0.3, 1, 4],
+                                    [2, 10, 40], n_smooth=5)
+        cache = KurtosisCache()
+        Kurtosis(gw_params, cache=cache).pick_trace(trace, 3)
+        self.assertEqual((cache.n_hits, cache.n_misses), (0, 2))
+        k_cached = Kurtosis(params, cache=cache)
+        c_cached = k_cached.pick_trace(trace, 3, starttime, endtime)
+        self.assertEqual((cache.n_hits, cache.n_misses), (1, 9))
+        k = Kurtosis(params)
+        c = k.pick_trace(trace, 3, starttime, endtime)
+        np.testing.assert_array_equal(k_cached.mean_cumulative_kurtosis.data,
+                                      k.mean_cumulative_kurtosis.data)
+        self.assertEqual([x.time for x in c_cached], [x.time for x in c])
+        # Same bands, windows and time span: everything comes from the cache
+        Kurtosis(params, cache=cache).pick_trace(trace, 3, starttime, endtime)
+        self.assertEqual((cache.n_hits, cache.n_misses), (9, 9))
+
+    def test_streaming_kurtosis(self):
+        """
+        Test that chunk-wise kurtoses match those of the whole trace
+        """
+        datafile = str(self.data_path / "20190519T060917_MONA.mseed")
+        trace = obspy_read(datafile, 'MSEED').select(component='3')[0]
+        params = KurtosisParameters([[3, 15], [8, 30]], [0.3, 1, 4],
+                                    [2, 10, 40], n_smooth=5)
+        k = Kurtosis(params)
+        c = k.pick_trace(trace, 3)
+        sk = StreamingKurtosis(params, trace.stats.sampling_rate,
+                               trace.stats.starttime)
+        outputs = [sk.process(trace.data[i: i + 777])
+                   for i in range(0, trace.stats.npts, 777)]
+        outputs.append(sk.flush())
+        kurt = outputs[0][0].with_data(
+            np.concatenate([x[0].data for x in outputs]))
+        cum = outputs[0][1].with_data(
+            np.concatenate([x[1].data for x in outputs]))
+        self.assertEqual(kurt.stats.npts, trace.stats.npts)
+        self.assertEqual(kurt.stats.starttime, trace.stats.starttime)
+        # Away from the filter transients
+        np.testing.assert_allclose(kurt.data[1000:],
+                                   k.mean_kurtosis.data[1000:], rtol=1e-3)
+        detrended = StreamingKurtosis.detrend(cum)
+        # The batch calculation uses one-sided gradients at the ends
+        expected = k.mean_cumulative_kurtosis.data
+        np.testing.assert_allclose(detrended.data[1:-1], expected[1:-1],
+                                   atol=1e-4 * np.ptp(expected))
+        k.mean_cumulative_kurtosis = detrended
+        c_streamed = k.follow_extrem(max_candidates=3, order='max')
+        self.assertEqual([x.time for x in c_streamed], [x.time for x in c])
+
+    def test_energy_snr_batch(self):
+        """
+        Test calculating the energy and SNR of all stations at once
+        """
+        ev = SyntheticEvent(n_stations=4, duration=120.)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            params = PickerParameters.from_yaml_file(
+                ev.write_database(tmpdir)['parm_file']).SNR
+        streams = {s: ev.stream.select(station=s, channel='*[ZNE]').copy()
+                   .filter('bandpass', freqmin=3., freqmax=20.)
+                   for s in ev.stations}
+        # One station's components are not aligned
+        streams['S003'][0].trim(starttime=streams['S003'][0].stats.starttime
+                                + 1.)
+        results = EnergySNRBatch.from_streams(streams, params)
+        self.assertEqual([len(x) for x in results
+                          if isinstance(x, EnergySNRBatch)], [3])
+        batch = results[0]
+        t1, t2 = ev.origin_time - 10., ev.origin_time + 60.
+        trustworthy, messages = batch.is_trustworthy(t1, t2)
+        for i, (station, energy) in enumerate(
+                batch.to_energy_snrs().items()):
+            single = EnergySNR(streams[station], params)
+            np.testing.assert_allclose(energy.nrg.data, single.nrg.data,
+                                       rtol=1e-12)
+            np.testing.assert_allclose(energy.snr.data, single.snr.data,
+                                       rtol=1e-12)
+            self.assertEqual(energy.snr.stats.starttime,
+                             single.snr.stats.starttime)
+            self.assertEqual(single.slice(t1, t2).is_trustworthy(),
+                             (trustworthy[i], messages[i]))
+        # The central moving average, with cumulative sums
+        data = np.random.default_rng(42).random((2, 500)) ** 4
+        np.testing.assert_allclose(_central_mean(data, 20)[1],
+                                   central_moving_average(data[1], 20),
+                                   rtol=1e-12)
+
+    def test_filter_bank(self):
+        """
+        Test that filter bank outputs match obspy's Trace.filter()
+        """
+        datafile = str(self.data_path / "20190519T060917_MONA.mseed")
+        stream = obspy_read(datafile, 'MSEED')
+        sr = stream[0].stats.sampling_rate
+        bank = FilterBank()
+        filtered = bank.filter_stream(stream, [3, 15])
+        self.assertEqual(len(bank), 1)
+        expected = stream.copy().filter('bandpass', freqmin=3, freqmax=15,
+                                        corners=3)
+        for tr, tr_exp in zip(filtered, expected):
+            self.assertEqual(tr.id, tr_exp.id)
+            self.assertEqual(tr.stats.starttime, tr_exp.stats.starttime)
+            np.testing.assert_array_equal(tr.data, tr_exp.data)
+        data = np.array([tr.data for tr in stream])
+        bands = bank.bandpass_bands(data, [[3, 15], [8, 30]], sr,
+                                    zerophase=True)
+        self.assertEqual(bands.shape, (2, *data.shape))
+        self.assertEqual(len(bank), 3)
+        expected = stream.copy().filter('bandpass', freqmin=8, freqmax=30,
+                                        corners=3, zerophase=True)
+        np.testing.assert_allclose(bands[1], [tr.data for tr in expected])
+        # Highpass if the high corner is above Nyquist, as in obspy
+        with self.assertWarns(UserWarning):
+            np.testing.assert_array_equal(
+                bank.bandpass(data[0], [3, 100], sr),
+                stream[0].copy().filter('highpass', freq=3, corners=3).data)
+
+    def test_center_distri(self):
+        """
+        Test the sweep and grid methods of finding the densest window
+        """
+        def n_in_window(v, center, win_size):
+            return np.count_nonzero((v > center - win_size / 2)
+                                    & (v < center + win_size / 2))
+
+        self.assertEqual(center_distri([], 5), [])
+        self.assertEqual(center_distri([12.], 5), 12.)
+        self.assertEqual(center_distri([0., 1., 2., 10., 11., 30.], 5), 1.)
+        rng = np.random.default_rng(42)
+        for n in (3, 30, 300):
+            v = np.concatenate((rng.uniform(0, 600, n),
+                                rng.normal(200, 2, n // 3)))
+            for win_size in (1, 5, 20):
+                sweep = center_distri(v, win_size)
+                grid = center_distri(v, win_size, method='grid')
+                self.assertGreaterEqual(n_in_window(v, sweep, win_size),
+                                        n_in_window(v, grid, win_size))
+                if n > 3:
+                    self.assertAlmostEqual(sweep, grid, delta=win_size)
+
+    def test_polar_analysis(self):
+        """
+        Test batched polarity analysis against a window-by-window calculation
+        """
+        datafile = str(self.data_path / "20190519T060917_MONA.mseed")
+        stream = obspy_read(datafile, 'MSEED')
+        stream.filter('bandpass', freqmin=3, freqmax=15)
+        pol = Polarity(stream, PolarityParameters())
+        t0 = stream[0].stats.starttime
+        times = [t0 + 20, t0 + 21, t0 + 40]
+        rect, azi, dip = pol.polar_analysis(times)
+        ind_vec, n_half = pol._calc_indices(times)
+        self.assertEqual(np.count_nonzero(rect.data), len(ind_vec))
+        for k in ind_vec[::25]:
+            MP = np.cov(np.array([x.data[k - n_half: k + n_half]
+                                  for x in (pol.tracee, pol.tracen,
+                                            pol.tracez)]))
+            D, V = np.linalg.eig(MP)
+            i_sort = np.argsort(D)
+            D, V_major = np.abs(D[i_sort]), V[:, i_sort[2]]
+            self.assertAlmostEqual(rect.data[k],
+                                   1 - ((D[0] + D[1]) / (2 * D[2])))
+            self.assertAlmostEqual(
+                azi.data[k], np.degrees(np.arctan(V_major[1] / V_major[0])))
+            # The dip sign depends on the (arbitrary) eigenvector sign
+            self.assertAlmostEqual(
+                np.abs(dip.data[k]),
+                np.abs(np.degrees(np.arctan(V_major[2] / np.sqrt(
+                    V_major[1]**2 + V_major[0]**2)))))
+        # Sliding and window-by-window covariances give the same results
+        pol_w = Polarity(stream, PolarityParameters(
+            covariance_method='windows'))
+        np.testing.assert_allclose(pol_w._calc_covariances(ind_vec, n_half),
+                                   pol._calc_sliding_covariances(ind_vec,
+                                                                 n_half),
+                                   rtol=1e-8, atol=1e-12)
+        np.testing.assert_allclose(pol_w.polar_analysis(times)[0].data,
+                                   rect.data, atol=1e-10)
+
     def test_nordic_write(self):
         """
         Test calculating amplitudes
@@ -152,6 +483,599 @@ class TestADDONSMethods(unittest.TestCase):
         for p in Path(".").glob('run_*.log'):
             p.unlink()
 
+    def test_run_many_workers(self):
+        """
+        Test that run_many() in a process pool gives the same database files
+        as a serial run, merges the workers' logs and isolates failed events
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files, sfiles = _write_events(tmpdir, 3, n_missing=1)
+            picker = PSPicker(files['parm_file'], files['wav_base_path'],
+                              files['database_path_in'],
+                              Path(tmpdir) / 'workers')
+            # Records kept in the parent process (the workers are forked
+            # with their own copy of it)
+            records = BufferingHandler(10000)
+            logging.getLogger('pspicker').addHandler(records)
+            try:
+                picker.run_many('201905190000', '201905192359', workers=2,
+                                ignore_fails=True, log_level='critical')
+            finally:
+                logging.getLogger('pspicker').removeHandler(records)
+            # The parent process doesn't log the events it sends to the pool
+            messages = [r.getMessage() for r in records.buffer]
+            log_text = ''.join(p.read_text()
+                               for p in Path(".").glob('run_*.log'))
+            for sfile in sfiles:
+                self.assertIn(f'   Running {sfile}...', messages)
+                self.assertIn(f'Running {sfile}...', log_text)
+            self.assertIn(f'run_one() failed for {sfiles[-1]}', messages)
+            picker.database_path_out = Path(tmpdir) / 'serial'
+            picker.database_path_out.mkdir()
+            picker.run_many('201905190000', '201905192359', workers=1,
+                            ignore_fails=True, log_level='critical')
+            self.assertDatabasesEqual(Path(tmpdir) / 'serial',
+                                      Path(tmpdir) / 'workers', len(sfiles))
+            # The failed event's database file is copied unchanged
+            self.assertTextFilesEqual(sfiles[-1], Path(tmpdir) / 'workers'
+                                      / sfiles[-1].name)
+            # The workers don't get the last event's results
+            self.assertIsNotNone(picker.run)
+            self.assertIsNone(picker._worker_copy().run)
+            with self.assertRaises(Exception):
+                picker.run_many('201905190000', '201905192359', workers=2,
+                                ignore_fails=False, log_level='critical')
+        for p in Path(".").glob('run_*.log'):
+            p.unlink()
+
+    def test_station_workers(self):
+        """
+        Test that picking stations in threads gives the same database file
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files, sfiles = _write_events(tmpdir, 1)
+            picker = PSPicker(files['parm_file'], files['wav_base_path'],
+                              files['database_path_in'],
+                              files['database_path_out'])
+            out_dirs = []
+            for station_workers in (1, 4):
+                picker.database_path_out = (Path(tmpdir)
+                                            / f'threads_{station_workers:d}')
+                picker.database_path_out.mkdir()
+                picker.run_one(files['database_filename'], plot_global=False,
+                               log_level=None,
+                               station_workers=station_workers)
+                out_dirs.append(picker.database_path_out)
+            self.assertDatabasesEqual(*out_dirs, 1)
+            # A database file outside database_path_in
+            outside = Path(tmpdir) / 'outside' / sfiles[0].name
+            outside.parent.mkdir()
+            outside.write_text(sfiles[0].read_text())
+            picker.database_path_out = Path(tmpdir) / 'outside_out'
+            picker.database_path_out.mkdir()
+            picker.run_one(str(outside), plot_global=False, log_level=None,
+                           station_workers=4)
+            self.assertDatabasesEqual(out_dirs[0], picker.database_path_out,
+                                      1)
+
+    def test_benchmarks(self):
+        """
+        Test the synthetic event generator and the benchmark runner
+        """
+        ev = SyntheticEvent(n_stations=2, n_components=4, duration=60.)
+        self.assertEqual(len(ev.stream), 8)
+        self.assertEqual(ev.stream, SyntheticEvent(
+            n_stations=2, n_components=4, duration=60.).stream)
+        for arrivals in ev.arrivals.values():
+            self.assertLess(arrivals['P'], arrivals['S'])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = Path(tmpdir) / 'bench.json'
+            results = run_benchmarks(n_stations=3, duration=60., repeat=1,
+                                     output=output)
+            self.assertEqual(json.loads(output.read_text())['results'].keys(),
+                             results['results'].keys())
+        self.assertEqual(list(results['results'].keys()), BENCHMARKS)
+        for r in results['results'].values():
+            self.assertEqual(len(r['times']), 1)
+            self.assertGreater(r['min'], 0)
+        for p in Path(".").glob('run_*.log'):
+            p.unlink()
+
+    def test_lazy_imports(self):
+        """
+        Test that importing pspicker doesn't import the plotting, TauP and
+        clustering modules
+        """
+        elapsed, lazy = import_time('pspicker')
+        self.assertGreater(elapsed, 0)
+        self.assertEqual(lazy, [])
+
+    def test_stage_timing(self):
+        """
+        Test per-stage timing of run_one() and run_many()
+        """
+        stages = StageTimer(enabled=False)
+        with stages.stage('a'):
+            stages.count('b')
+        self.assertEqual(stages.to_dict(), {'times': {}, 'counts': {}})
+        ev = SyntheticEvent(n_stations=3, duration=60.)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = ev.write_database(tmpdir)
+            picker = PSPicker(files['parm_file'], files['wav_base_path'],
+                              files['database_path_in'],
+                              files['database_path_out'])
+            self.assertIsNone(picker.run_one(files['database_filename'],
+                                             plot_global=False,
+                                             log_level='critical'))
+            timing = picker.run_one(files['database_filename'],
+                                    plot_global=False, log_level='critical',
+                                    timing=True)
+            for stage in ('global_window', 'snr', 'kurtosis', 'associate',
+                          'total'):
+                self.assertIn(stage, timing['times'])
+            self.assertEqual(timing['counts']['stations'], 3)
+            csv_file = Path(tmpdir) / 'timing.csv'
+            report = picker.run_many('201905190000', '201905192359',
+                                     log_level='critical',
+                                     timing_file=csv_file)
+            agg = report.aggregate()
+            self.assertEqual(agg['counts']['events'], 1)
+            self.assertEqual(agg['counts']['stations'], 3)
+            lines = csv_file.read_text().splitlines()
+            self.assertEqual(len(lines), 3)
+            self.assertTrue(lines[-1].startswith('TOTAL'))
+        for p in Path(".").glob('run_*.log'):
+            p.unlink()
+
+    def test_delay_table(self):
+        """
+        Test cached velocity model delays and vectorized origin times
+        """
+        params = AssociatorParameters(1., 3., 5., velocity_model='iasp91',
+                                      target_depth=10.)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            assoc = Associator(params, delay_cache_dir=tmpdir)
+            self.assertIsNotNone(assoc.delays)
+            cache_files = list(Path(tmpdir).glob('delays_iasp91_*.npz'))
+            self.assertEqual(len(cache_files), 1)
+            table = DelayTable.load(cache_files[0])
+            self.assertEqual(table.delays(10.), assoc.delays)
+            # Second time, the delays are read from the cache
+            assoc_2 = Associator(params, delay_cache_dir=tmpdir)
+            self.assertEqual(assoc_2.delays, assoc.delays)
+            self.assertEqual(len(list(Path(tmpdir).iterdir())), 1)
+        self.assertTrue(np.all(np.diff(assoc.delays['ps']) > 0))
+        self.assertTrue(np.all(np.diff(assoc.delays['op']) > 0))
+        p_times = [UTCDateTime(2019, 5, 19, 6, 9) + x
+                   for x in (1., 2.5, 4., 10.)]
+        s_times = [t + d for t, d in zip(p_times, (1.5, 3., 4., 11.))]
+        for delays in (None, assoc.delays):
+            otimes = Associator.calc_origin_times(p_times, s_times, 1.7,
+                                                  delays)
+            for p, s, o in zip(p_times, s_times, otimes):
+                self.assertAlmostEqual(
+                    Associator.calc_origin_time(p, s, 1.7, delays).timestamp,
+                    o, places=5)
+
+    def test_result_cache(self):
+        """
+        Test that reruns only recalculate the stages whose inputs changed
+        """
+        ev = SyntheticEvent(n_stations=4, duration=120.)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = ev.write_database(tmpdir)
+            picker = PSPicker(files['parm_file'], files['wav_base_path'],
+                              files['database_path_in'],
+                              files['database_path_out'],
+                              cache_dir=Path(tmpdir) / 'cache')
+            out_file = (Path(files['database_path_out'])
+                        / Path(files['database_filename']).name)
+            counts, outputs, n_filtered = [], [], []
+            for i in range(3):
+                if i == 2:
+                    # Only changes the station candidates
+                    picker.param.polarity.DR_threshold_P += 0.1
+                with mock.patch.object(FILTER_BANK, 'filter_stream',
+                                       wraps=FILTER_BANK.filter_stream
+                                       ) as filter_stream:
+                    counts.append(picker.run_one(
+                        files['database_filename'], plot_global=False,
+                        log_level='critical', timing=True)['counts'])
+                n_filtered.append(filter_stream.call_count)
+                outputs.append(out_file.read_text())
+            cached = sorted(p.parent.name for p in
+                            (Path(tmpdir) / 'cache').rglob('*.pkl'))
+        # 1 global window, 4 SNRs and 4 (then 8) station candidates
+        self.assertEqual(counts[0]['cache_misses'], 9)
+        self.assertEqual(counts[1]['cache_hits'], 9)
+        self.assertNotIn('cache_misses', counts[1])
+        self.assertEqual(counts[2]['cache_hits'], 5)
+        self.assertEqual(counts[2]['cache_misses'], 4)
+        self.assertEqual(outputs[0], outputs[1])
+        # Cached stations are only filtered to recalculate their candidates
+        self.assertEqual(n_filtered, [4, 0, 4])
+        self.assertEqual(cached, ['candidates'] * 8 + ['global_window']
+                         + ['snr'] * 4)
+        for p in Path(".").glob('run_*.log'):
+            p.unlink()
+
+    def test_parameter_sweep(self):
+        """
+        Test picking an event with a grid of parameter values
+        """
+        ev = SyntheticEvent(n_stations=4, duration=120.)
+        overrides = {'kurtosis.window_lengths': [[0.5, 1, 2], [1, 2, 4]],
+                     'polarity.DR_threshold_P': [0.3, 0.5]}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = ev.write_database(tmpdir)
+            picker = PSPicker(files['parm_file'], files['wav_base_path'],
+                              files['database_path_in'],
+                              files['database_path_out'])
+            with self.assertRaises(ValueError):
+                picker.run_sweep({'kurtosis.window_length': [[1]]},
+                                 [files['database_filename']],
+                                 log_level=None)
+            csv_file = Path(tmpdir) / 'sweep.csv'
+            sweep = picker.run_sweep(overrides,
+                                     [files['database_filename']],
+                                     output=csv_file, log_level=None)
+            self.assertEqual(len(sweep), 4)
+            self.assertEqual(len(csv_file.read_text().splitlines()),
+                             len(sweep.picks) + 1)
+            # The same picks as run_one() with the same parameters
+            base = picker.param
+            for i in (0, 3):
+                picker.param = sweep.apply(base, sweep.combinations[i])
+                picker.assoc = None
+                picker.run_one(files['database_filename'], plot_global=False,
+                               log_level=None)
+                cat = read_nordic(str(Path(files['database_path_out'])
+                                      / files['database_filename']))
+                self.assertEqual(
+                    sorted((x.waveform_id.station_code, x.phase_hint[0],
+                            str(x.time)) for x in cat[0].picks
+                           if x.phase_hint[0] in 'PS'),
+                    sorted((x['station'], x['phase'], x['time'])
+                           for x in sweep.picks if x['combination'] == i))
+        # The picker's parameters are not modified
+        for station_params in base.station_parameters.values():
+            self.assertEqual(station_params.kurtosis.window_lengths,
+                             [0.3, 0.5, 1, 2, 4, 8])
+
+    def test_plot_renderer(self):
+        """
+        Test saving plots rendered in the background
+        """
+        ev = SyntheticEvent(n_stations=4, duration=120.)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = ev.write_database(tmpdir)
+            picker = PSPicker(files['parm_file'], files['wav_base_path'],
+                              files['database_path_in'],
+                              files['database_path_out'])
+            out_file = (Path(files['database_path_out'])
+                        / files['database_filename'])
+            picker.run_one(files['database_filename'], plot_global=False,
+                           log_level=None)
+            no_plots = out_file.read_text()
+            # Rendered in this process
+            picker.run_one(files['database_filename'], plot_global=True,
+                           plot_stations=True, log_level=None,
+                           plot_dir=Path(tmpdir) / 'plots',
+                           plot_formats=('png', 'pdf'))
+            self.assertEqual(out_file.read_text(), no_plots)
+            names = sorted(p.name for p in
+                           (Path(tmpdir) / 'plots').iterdir())
+            self.assertEqual(len(names), 2 * (2 + 4))
+            self.assertIn(f"{files['database_filename']}_overview.png",
+                          names)
+            self.assertIn(f"{files['database_filename']}_picks.pdf", names)
+            # Rendered by a worker process
+            day = ev.starttime.strftime('%Y%m%d')
+            picker.run_many(day + '0000', day + '2359', plot_global=True,
+                            plot_dir=Path(tmpdir) / 'many', plot_workers=1,
+                            log_level='critical')
+            self.assertIsNone(picker.plot_renderer)
+            self.assertEqual(
+                sorted(p.name for p in (Path(tmpdir) / 'many').iterdir()),
+                [f"{files['database_filename']}_{x}.png"
+                 for x in ('overview', 'picks')])
+        for p in Path(".").glob('run_*.log'):
+            p.unlink()
+
+    def test_find_otime_matching(self):
+        """
+        Test selecting the candidates that match an origin time
+        """
+        assoc = Associator(AssociatorParameters(1., 3., 5.,
+                                                otime_vp_vs=1.75))
+        ot = UTCDateTime(2019, 6, 29, 12)
+        cands = {}
+        # A: preferred picks match; B: preferred S is wrong; C: no picks
+        for sta, offsets in (('A', (2., 3.5, 9.)), ('B', (1., 1.75, 6.)),
+                             ('C', (0.5, 3., 4., 7., 12.))):
+            cands[sta] = [PickCandidate(ot + x, 'kurtosis', 1., station=sta)
+                          for x in offsets]
+        picks = [cands['A'][0], cands['A'][1], cands['B'][0], cands['B'][2]]
+        for p, phase in zip(picks, 'PSPS'):
+            p.phase_guess = phase
+        # P-S delay / (vp/vs - 1) must equal the P offset
+        new_picks = assoc._find_otime_matching(
+            ot, picks, [x for v in cands.values() for x in v])
+        chosen = {(p.station, p.phase_guess): p.time - ot for p in new_picks}
+        self.assertEqual(chosen, {('A', 'P'): 2., ('A', 'S'): 3.5,
+                                  ('B', 'P'): 1., ('B', 'S'): 1.75,
+                                  ('C', 'P'): 4., ('C', 'S'): 7.})
+
+    def test_location_association(self):
+        """
+        Test grid-search location association with StationXML coordinates
+        """
+        params = AssociatorParameters(
+            1., 3., 5., method='location', grid_spacing=5., grid_margin=5.,
+            grid_depths=[5., 10.], location_tolerance=0.3,
+            station_file=str(self.data_path /
+                             'stations_mayobs_20190629.xml'))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            assoc = Associator(params, delay_cache_dir=tmpdir)
+        grid = assoc.grid
+        self.assertEqual(len(grid.stations), 17)
+        node = grid.n_nodes // 2 + 7
+        otime = UTCDateTime(2019, 6, 29, 12)
+        stations = ['MOCA', 'MONA', 'MOSA', 'MOFA', 'IF2B']
+        picks, candidates = [], []
+        for i, sta in enumerate(stations):
+            i_sta = grid.station_index(sta)
+            p = PickCandidate(otime + grid.p_times[i_sta, node], 'kurtosis',
+                              1., station=sta, phase_guess='P')
+            s = PickCandidate(otime + grid.s_times[i_sta, node], 'kurtosis',
+                              1., station=sta, phase_guess='S')
+            noise = PickCandidate(otime + 30. + 7 * i, 'kurtosis', 1.,
+                                  station=sta, phase_guess='S')
+            candidates.extend([p, s, noise])
+            # MOFA's preferred S pick is noise, IF2B's phases are inverted
+            if sta == 'MOFA':
+                picks.extend([p, noise])
+            elif sta == 'IF2B':
+                p.phase_guess, s.phase_guess = 'S', 'P'
+                picks.extend([p, s])
+            else:
+                picks.extend([p, s])
+        new_picks = assoc.run(picks, candidates)
+        self.assertEqual(assoc.hypocenter['depth'], grid.depths[node])
+        self.assertAlmostEqual(assoc.hypocenter['time'] - otime, 0, places=3)
+        self.assertEqual(len(new_picks), 2 * len(stations))
+        for sta in stations:
+            i_sta = grid.station_index(sta)
+            for phase, tt in (('P', grid.p_times), ('S', grid.s_times)):
+                pick = [x for x in new_picks
+                        if x.station == sta and x.phase_guess == phase]
+                self.assertEqual(len(pick), 1)
+                self.assertAlmostEqual(pick[0].time - otime,
+                                       tt[i_sta, node], places=3)
+
+    def test_database_index(self):
+        """
+        Test incremental updates and queries of the database index
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sfile_dir = Path(tmpdir) / 'REA' / '2019' / '05'
+            sfile_dir.mkdir(parents=True)
+            otime = UTCDateTime('2019-05-19T06:09:00')
+            sfiles = []
+            for i in range(3):
+                t = otime + 86400 * i
+                sfile = t.strftime('%d-%H%M-%SL.S%Y%m')
+                PSPicker.save_nordic_event(
+                    [], t, sfile_dir, sfile,
+                    wavefiles=[t.strftime('%Y-%m-%d-%H%M-%SM.TEST')])
+                sfiles.append(sfile_dir / sfile)
+            index = DatabaseIndex(Path(tmpdir) / 'REA',
+                                  Path(tmpdir) / 'index.sqlite')
+            self.assertEqual(index.update(), (3, 0, 0))
+            self.assertEqual(index.update(), (0, 0, 0))
+            info = index.get(sfiles[1])
+            self.assertEqual(info['wavefiles'], ['2019-05-20-0609-00M.TEST'])
+            self.assertEqual(info['event_time'], otime + 86400)
+            start = PSPicker._split_date('201905200000')
+            end = PSPicker._split_date('201905212359')
+            self.assertEqual(index.sfiles(start, end), sfiles[1:])
+            with open(sfiles[0], 'a') as fp:
+                fp.write('\n')
+            self.assertIsNone(index.get(sfiles[0]))
+            sfiles[2].unlink()
+            self.assertEqual(index.update(), (0, 1, 1))
+            self.assertEqual(len(index), 2)
+
+    def test_run_many_index(self):
+        """
+        Test that run_many() with a database index picks the same events as
+        globbing the database directories, including events added later
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files, _ = _write_events(tmpdir, 2)
+            picker = PSPicker(files['parm_file'], files['wav_base_path'],
+                              files['database_path_in'],
+                              Path(tmpdir) / 'glob')
+            index_file = Path(tmpdir) / 'index.sqlite'
+            for i in range(2):
+                if i == 1:
+                    SyntheticEvent(n_stations=4, duration=120., seed=2,
+                                   starttime=UTCDateTime(2019, 5, 19, 6, 15)
+                                   ).write_database(tmpdir)
+                picker.database_path_out = Path(tmpdir) / 'glob'
+                picker.run_many('201905190000', '201905192359',
+                                log_level='critical')
+                picker.database_path_out = Path(tmpdir) / 'index'
+                picker.database_path_out.mkdir(exist_ok=True)
+                picker._day_sfiles = self._fail_glob
+                try:
+                    picker.run_many('201905190000', '201905192359',
+                                    log_level='critical',
+                                    index_file=index_file)
+                finally:
+                    del picker._day_sfiles
+                self.assertEqual(len(picker.database_index), 2 + i)
+                self.assertDatabasesEqual(Path(tmpdir) / 'glob',
+                                          Path(tmpdir) / 'index', 2 + i)
+        for p in Path(".").glob('run_*.log'):
+            p.unlink()
+
+    def _fail_glob(self, *args, **kwargs):
+        self.fail('database directory globbed instead of using the index')
+
+    def test_waveform_sources(self):
+        """
+        Test bulk reads from an SDS archive and background prefetching
+        """
+        stream = obspy_read(str(self.data_path /
+                                '20190519T060917_MONA.mseed'))
+        t0 = stream[0].stats.starttime
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for tr in stream:
+                s = tr.stats
+                sds_dir = (Path(tmpdir) / str(t0.year) / s.network
+                           / s.station / f'{s.channel}.D')
+                sds_dir.mkdir(parents=True)
+                tr.write(str(sds_dir / f'{tr.id}.D.{t0.year}.{t0.julday:03d}'),
+                         'MSEED')
+            source = SDSSource(tmpdir, pre_event=10., post_event=20.)
+            requests = [WaveformRequest('a', t0 + 30), WaveformRequest('b'),
+                        WaveformRequest('c', t0 + 60, ['wavefile'])]
+            results = list(source.prefetch(requests, batch_size=2))
+            window = source.get_window(t0 + 10, t0 + 40)
+        self.assertEqual([r[0] for r in results], requests)
+        self.assertIsInstance(results[1][1], AssertionError)
+        for (request, (st, wavefile)) in (results[0], results[2]):
+            self.assertEqual(len(st), 3)
+            self.assertEqual(st[0].stats.starttime, request.event_time - 10)
+            np.testing.assert_array_equal(
+                st[0].data,
+                stream.slice(request.event_time - 10,
+                             request.event_time + 20)[0].data)
+        self.assertIsNone(results[0][1][1])
+        self.assertEqual(results[2][1][1], 'wavefile')
+        self.assertEqual(len(window), 3)
+        self.assertEqual(window[0].stats.starttime, t0 + 10)
+
+        class Source(WaveformSource):
+            def get(self, request):
+                return request.sfile, None
+        self.assertEqual([r[1][0] for r in Source().prefetch(requests, 2)],
+                         ['a', 'b', 'c'])
+
+    def test_run_many_prefetch(self):
+        """
+        Test that run_many() with prefetching gives the same database files
+        as reading each event's waveforms when picking it
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files, sfiles = _write_events(tmpdir, 3, n_missing=1)
+            picker = PSPicker(files['parm_file'], files['wav_base_path'],
+                              files['database_path_in'],
+                              Path(tmpdir) / 'serial')
+            picker.run_many('201905190000', '201905192359',
+                            log_level='critical')
+            picker.database_path_out = Path(tmpdir) / 'prefetch'
+            picker.database_path_out.mkdir()
+            waveforms = {}
+
+            def run_one_event(s_file, *args, **kwargs):
+                waveforms[s_file] = args[4]
+                return PSPicker._run_one_event(picker, s_file, *args,
+                                               **kwargs)
+            picker._run_one_event = run_one_event
+            picker.run_many('201905190000', '201905192359',
+                            log_level='critical', prefetch=2)
+            self.assertEqual(list(waveforms.keys()), sfiles)
+            for sfile in sfiles[:-1]:
+                self.assertEqual(len(waveforms[sfile][0]), 12)
+            # The read error is raised by run_one(), so the database file is
+            # copied unchanged
+            self.assertIsInstance(waveforms[sfiles[-1]], Exception)
+            self.assertDatabasesEqual(Path(tmpdir) / 'serial',
+                                      Path(tmpdir) / 'prefetch', len(sfiles))
+            self.assertTextFilesEqual(sfiles[-1], Path(tmpdir) / 'prefetch'
+                                      / sfiles[-1].name)
+            with self.assertRaises(Exception):
+                picker.run_many('201905190000', '201905192359',
+                                log_level='critical', prefetch=2,
+                                ignore_fails=False)
+        for p in Path(".").glob('run_*.log'):
+            p.unlink()
+
+    def test_run_continuous(self):
+        """
+        Test detecting and picking events in continuous data
+        """
+        t0 = UTCDateTime(2019, 5, 19, 6, 0)
+        events = [SyntheticEvent(n_stations=6, duration=600.,
+                                 origin_offset=offset, starttime=start,
+                                 seed=1)
+                  for start, offset in ((t0, 100.), (t0 + 600, 350.))]
+        stream = events[0].stream + events[1].stream
+        stream.merge()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = events[0].write_database(tmpdir)
+            picker = PSPicker(files['parm_file'], files['wav_base_path'],
+                              files['database_path_in'],
+                              Path(tmpdir) / 'out')
+            times = picker.run_continuous(t0, t0 + 1200, stream=stream,
+                                          log_level=None)
+            self.assertEqual(len(times), 2)
+            for t, event in zip(times, events):
+                self.assertAlmostEqual(t - event.origin_time, 0, delta=5)
+            sfiles = sorted((Path(tmpdir) / 'out').glob('*.S201905'))
+            self.assertEqual([f.name for f in sfiles],
+                             [t.strftime('%d-%H%M-%SL.S%Y%m') for t in times])
+            # The first event is picked as by run_one()
+            picker.database_path_out = Path(tmpdir) / 'run_one'
+            picker.database_path_out.mkdir()
+            picker.run_one(files['database_filename'], plot_global=False,
+                           log_level=None)
+            lines = [_phase_lines(f) for f in (
+                sfiles[0], picker.database_path_out
+                / Path(files['database_filename']).name)]
+            self.assertEqual(lines[0], lines[1])
+            self.assertGreater(len(lines[0]), 0)
+
+
+def _write_events(base_dir, n_events, n_missing=0):
+    """
+    Write synthetic events, 3 minutes apart, as a SEISAN-style database
+
+    :param base_dir: directory to write to
+    :param n_events: number of synthetic events
+    :param n_missing: number of extra database files whose waveform file
+        doesn't exist
+    :returns: SyntheticEvent.write_database() output, list of database
+        files (the missing ones last)
+    """
+    t0 = UTCDateTime(2019, 5, 19, 6, 9)
+    sfiles = []
+    for i in range(n_events):
+        files = SyntheticEvent(n_stations=4, duration=120.,
+                               starttime=t0 + 180 * i, seed=i
+                               ).write_database(base_dir)
+        sfiles.append(Path(files['database_path_in']) / '2019' / '05'
+                      / files['database_filename'])
+    for i in range(n_missing):
+        t = t0 + 180 * (n_events + i)
+        sfile = t.strftime('%d-%H%M-%SL.S%Y%m')
+        PSPicker.save_nordic_event(
+            [], t, sfiles[0].parent, sfile,
+            wavefiles=[t.strftime('%Y-%m-%d-%H%M-%SM.MISSING')])
+        sfiles.append(sfiles[0].parent / sfile)
+    return files, sfiles
+
+
+def _phase_lines(sfile):
+    """Return a NORDIC file's phase lines"""
+    with open(sfile) as fp:
+        return [line for line in fp.read().splitlines()
+                if len(line) >= 80 and line[79] == ' '
+                and len(line[1:6].strip()) > 0]
+
+
 def suite():
     return unittest.makeSuite(TestADDONSMethods, 'test')
 
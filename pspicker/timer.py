@@ -1,7 +1,11 @@
 # timer.py
 
-from contextlib import ContextDecorator
+from contextlib import ContextDecorator, nullcontext
+import csv
 from dataclasses import dataclass, field
+import json
+from pathlib import Path
+import threading
 import time
 from typing import Any, Callable, ClassVar, Dict, Optional
 
@@ -57,3 +61,177 @@ class Timer(ContextDecorator):
     def __exit__(self, *exc_info: Any) -> None:
         """Stop the context manager timer"""
         self.stop()
+
+
+class StageTimer():
+    """
+    Named stage timers and counters, for example for one event
+
+    Stage times and counts are summed over all calls, and can be updated
+    from several threads.  If disabled, stage() returns a shared do-nothing
+    context manager and count() returns immediately.
+
+    >>> stages = StageTimer()
+    >>> with stages.stage('kurtosis'):
+    ...     pass
+    >>> stages.count('candidates', 5)
+    """
+    _null_context = nullcontext()
+
+    def __init__(self, enabled=True):
+        """
+        :param enabled: measure times and counts
+        """
+        self.enabled = enabled
+        self.times = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        """Locks can't be pickled (e.g. to send to a process pool)"""
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        """
+        Return a context manager timing a stage
+
+        :param name: stage name
+        """
+        if not self.enabled:
+            return self._null_context
+        return _Stage(self, name)
+
+    def add_time(self, name, seconds):
+        """
+        Add time to a stage
+
+        :param name: stage name
+        :param seconds: time to add
+        """
+        with self._lock:
+            self.times[name] = self.times.get(name, 0.) + seconds
+
+    def count(self, name, n=1):
+        """
+        Increment a counter
+
+        :param name: counter name
+        :param n: value to add
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def to_dict(self):
+        """
+        Return stage times (seconds) and counts as a dict
+
+        :returns: {'times': {stage: seconds}, 'counts': {counter: value}}
+        """
+        return {'times': dict(self.times), 'counts': dict(self.counts)}
+
+
+class _Stage():
+    """Context manager adding its elapsed time to a StageTimer stage"""
+    def __init__(self, stages, name):
+        self.stages = stages
+        self.name = name
+        self.timer = Timer(logger=None)
+
+    def __enter__(self):
+        self.timer.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stages.add_time(self.name, self.timer.stop())
+
+
+class TimingReport():
+    """
+    Per-event and aggregate stage times and counts
+
+    Each event is a StageTimer.to_dict() output, with its name
+    """
+    def __init__(self):
+        self.events = []
+
+    def __len__(self):
+        return len(self.events)
+
+    def __str__(self):
+        agg = self.aggregate()
+        s = f'TimingReport: {agg["counts"].get("events", 0):d} events\n'
+        for name, t in agg['times'].items():
+            s += (f'    {name:16s}: {t["total"]:9.3f}s total, '
+                  f'{t["mean"]:8.4f}s mean, {t["max"]:8.4f}s max\n')
+        for name, n in agg['counts'].items():
+            s += f'    {name:16s}: {n:d}\n'
+        return s
+
+    def add(self, event, timing):
+        """
+        Add one event's times and counts
+
+        :param event: event name
+        :param timing: StageTimer.to_dict() output (None: not added)
+        """
+        if timing is None:
+            return
+        self.events.append({'event': str(event), **timing})
+
+    def aggregate(self):
+        """
+        Return stage time totals, means and maxima and count totals
+
+        :returns: {'times': {stage: {'total', 'mean', 'max'}},
+                   'counts': {counter: total}}, with 'events' included in
+                   the counts
+        """
+        times, counts = {}, {'events': len(self.events)}
+        for ev in self.events:
+            for name, t in ev['times'].items():
+                times.setdefault(name, []).append(t)
+            for name, n in ev['counts'].items():
+                counts[name] = counts.get(name, 0) + n
+        times = {k: {'total': sum(v), 'mean': sum(v) / len(self.events),
+                     'max': max(v)}
+                 for k, v in times.items()}
+        return {'times': times, 'counts': counts}
+
+    def to_dict(self):
+        return {'events': self.events, 'aggregate': self.aggregate()}
+
+    def write(self, filename):
+        """
+        Write to a JSON or CSV file
+
+        The CSV file has one line per event, with a column per stage time
+        (seconds) and per count, and a last line with the totals
+
+        :param filename: output file name (CSV if it ends in '.csv', JSON
+            otherwise)
+        """
+        if Path(filename).suffix.lower() != '.csv':
+            with open(filename, 'w') as fp:
+                json.dump(self.to_dict(), fp, indent=2)
+            return
+        agg = self.aggregate()
+        stages = list(agg['times'].keys())
+        counters = [k for k in agg['counts'].keys() if k != 'events']
+        with open(filename, 'w', newline='') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(['event'] + [f'{s}_s' for s in stages] + counters)
+            for ev in self.events:
+                writer.writerow([ev['event']]
+                                + [ev['times'].get(s, 0.) for s in stages]
+                                + [ev['counts'].get(c, 0) for c in counters])
+            writer.writerow(['TOTAL']
+                            + [agg['times'][s]['total'] for s in stages]
+                            + [agg['counts'][c] for c in counters])
@@ -0,0 +1,252 @@
+"""
+P and S travel times from a grid of trial hypocentres to each station
+"""
+import numpy as np
+
+from .delay_table import DelayTable
+from .logger import log
+
+KM_PER_DEGREE = 111.195
+
+
+class TravelTimeGrid():
+    """
+    P and S travel times from each node of a hypocentre grid to each station
+
+    The grid covers the stations plus a margin, in a local flat-earth
+    projection around the network's centre.  Travel times are interpolated
+    from the DelayTable of the velocity model, so they are only calculated
+    (with TauP) once per velocity model and network.  Station elevations
+    are ignored.
+
+    >>> grid = TravelTimeGrid.from_stationxml('stations.xml', 'iasp91')
+    >>> result = grid.search(times, station_indices, tolerance=0.5)
+    """
+    def __init__(self, stations, latitudes, longitudes, depths, p_times,
+                 s_times, model=''):
+        """
+        :param stations: station codes
+        :param latitudes: grid node latitudes
+        :param longitudes: grid node longitudes
+        :param depths: grid node depths (km)
+        :param p_times: P travel times (s), shape (len(stations),
+            len(latitudes))
+        :param s_times: S travel times (s), same shape as p_times
+        :param model: velocity model name
+        """
+        self.stations = list(stations)
+        self.latitudes = np.asarray(latitudes, dtype=float)
+        self.longitudes = np.asarray(longitudes, dtype=float)
+        self.depths = np.asarray(depths, dtype=float)
+        self.p_times = np.asarray(p_times, dtype=float)
+        self.s_times = np.asarray(s_times, dtype=float)
+        self.model = model
+
+    def __str__(self):
+        return (f'TravelTimeGrid: {self.model}, {len(self.stations):d} '
+                f'stations, {self.n_nodes:d} nodes')
+
+    @property
+    def n_nodes(self):
+        return len(self.latitudes)
+
+    def station_index(self, station):
+        """
+        Return a station's row in p_times and s_times (None if not in grid)
+        """
+        try:
+            return self.stations.index(station)
+        except ValueError:
+            return None
+
+    @classmethod
+    def from_stationxml(cls, filename, vel_model='iasp91', **kwargs):
+        """
+        Make a grid for the stations in a StationXML file
+
+        :param filename: StationXML file name
+        :param vel_model: velocity model (obspy taup model name or path
+            of a .nd or .tvel file)
+        :param kwargs: from_coordinates() keyword arguments
+        """
+        from obspy import read_inventory
+        return cls.from_coordinates(station_coordinates(
+            read_inventory(str(filename), 'STATIONXML')), vel_model, **kwargs)
+
+    @classmethod
+    def from_coordinates(cls, coordinates, vel_model='iasp91', spacing=2.,
+                         margin=20., depths=(0., 5., 10., 15., 20., 30.),
+                         cache_dir=None):
+        """
+        Make a grid for a set of stations
+
+        :param coordinates: dict with key=station code,
+            value=(latitude, longitude)
+        :param vel_model: velocity model (obspy taup model name or path
+            of a .nd or .tvel file)
+        :param spacing: horizontal grid spacing (km)
+        :param margin: distance (km) that the grid extends beyond the
+            outermost stations
+        :param depths: grid depths (km)
+        :param cache_dir: delay table cache directory (None:
+            delay_table.default_cache_dir())
+        """
+        stations = list(coordinates.keys())
+        sta_lats = np.array([coordinates[s][0] for s in stations])
+        sta_lons = np.array([coordinates[s][1] for s in stations])
+        lat0, lon0 = np.mean(sta_lats), np.mean(sta_lons)
+        sta_x, sta_y = _project(sta_lats, sta_lons, lat0, lon0)
+        xs = np.arange(sta_x.min() - margin,
+                       sta_x.max() + margin + spacing / 2, spacing)
+        ys = np.arange(sta_y.min() - margin,
+                       sta_y.max() + margin + spacing / 2, spacing)
+        depths = np.atleast_1d(np.asarray(depths, dtype=float))
+        node_x, node_y = [a.ravel() for a in np.meshgrid(xs, ys)]
+        # (n_stations, n_horizontal_nodes) epicentral distances, in degrees
+        distances = np.hypot(node_x - sta_x[:, None],
+                             node_y - sta_y[:, None]) / KM_PER_DEGREE
+        max_distance = distances.max() * 1.01
+        n_distances = max(20, int(np.ceil(max_distance * KM_PER_DEGREE
+                                          / spacing)))
+        table = DelayTable.from_model(vel_model, max_distance, n_distances,
+                                      depths, cache_dir)
+        p_times = np.empty((len(stations), len(depths), len(node_x)))
+        s_times = np.empty_like(p_times)
+        for i in range(len(depths)):
+            op, ps = table.op[i], table.ps[i]
+            good = np.isfinite(op) & np.isfinite(ps)
+            if not np.any(good):
+                raise ValueError(f'No travel times at depth {depths[i]:g} km')
+            p_times[:, i, :] = np.interp(distances, table.distances[good],
+                                         op[good])
+            s_times[:, i, :] = p_times[:, i, :] + np.interp(
+                distances, table.distances[good], ps[good])
+        node_lats, node_lons = _unproject(node_x, node_y, lat0, lon0)
+        log(f'Travel-time grid: {len(stations):d} stations, {len(xs):d}x'
+            f'{len(ys):d} nodes every {spacing:g} km, {len(depths):d} depths',
+            'verbose')
+        return cls(stations, np.tile(node_lats, len(depths)),
+                   np.tile(node_lons, len(depths)),
+                   np.repeat(depths, len(node_x)),
+                   p_times.reshape(len(stations), -1),
+                   s_times.reshape(len(stations), -1), str(vel_model))
+
+    def search(self, times, station_indices, tolerance=0.5,
+               max_elements=4000000):
+        """
+        Find the grid node and origin time that explain the most arrivals
+
+        Each arrival time, taken as a P and as an S, gives an origin time
+        at each node.  At each node, each of these origin times is scored
+        by the number of station-phases having an origin time within
+        tolerance of it (ties broken by the smallest summed residual).  The
+        scores are calculated with array operations over all arrival times
+        and nodes, in blocks of nodes.
+
+        :param times: arrival times (timestamps)
+        :param station_indices: each arrival's station index in the grid
+        :param tolerance: maximum origin time residual (s)
+        :param max_elements: maximum size of the temporary arrays
+        :returns: dict with keys 'node' (grid node index), 'origin_time'
+            (timestamp), 'n_phases' and 'phases' (list of
+            (arrival index, 'P' or 'S', residual))
+        """
+        times = np.asarray(times, dtype=float)
+        station_indices = np.asarray(station_indices, dtype=int)
+        n = len(times)
+        t0 = times.min()
+        # Origin times if each arrival is a P (rows :n) or an S (rows n:)
+        otimes = np.concatenate(
+            (times[:, None] - t0 - self.p_times[station_indices],
+             times[:, None] - t0 - self.s_times[station_indices]))
+        # Same origin times, padded by inf into (station-phase, arrival, node)
+        _, row_group = np.unique(np.r_[2 * station_indices,
+                                       2 * station_indices + 1],
+                                 return_inverse=True)
+        counts = np.bincount(row_group)
+        order = np.argsort(row_group, kind='stable')
+        row_rank = np.empty(2 * n, dtype=int)
+        row_rank[order] = np.arange(2 * n) - np.repeat(
+            np.cumsum(counts) - counts, counts)
+        grouped = np.full((len(counts), counts.max(), self.n_nodes), np.inf)
+        grouped[row_group, row_rank] = otimes
+        group_rows = np.full(grouped.shape[:2], -1)
+        group_rows[row_group, row_rank] = np.arange(2 * n)
+
+        block = max(1, max_elements // (2 * n * len(counts)))
+        best = (-np.inf, None, None)
+        for first in range(0, self.n_nodes, block):
+            seeds = otimes[:, None, first:first + block]
+            # (seed, station-phase, node) distance to the closest otime
+            resid = np.full((2 * n, len(counts), seeds.shape[-1]), np.inf)
+            for k in range(grouped.shape[1]):
+                np.minimum(resid, np.abs(
+                    seeds - grouped[None, :, k, first:first + block]),
+                    out=resid)
+            match = resid <= tolerance
+            score = (match.sum(axis=1)
+                     - np.where(match, resid, 0).sum(axis=1)
+                     / (tolerance * (len(counts) + 1)))
+            i_seed, i_node = np.unravel_index(np.argmax(score), score.shape)
+            if score[i_seed, i_node] > best[0]:
+                best = (score[i_seed, i_node], i_seed, first + i_node)
+
+        _, i_seed, node = best
+        seed = otimes[i_seed, node]
+        matched = {}   # key=arrival index, value=(phase, otime)
+        for g in range(len(counts)):
+            k = np.argmin(np.abs(grouped[g, :, node] - seed))
+            if np.abs(grouped[g, k, node] - seed) > tolerance:
+                continue
+            row = group_rows[g, k]
+            otime = otimes[row, node]
+            # An arrival can't be both a P and an S: keep the closer one
+            if (row % n in matched and np.abs(matched[row % n][1] - seed)
+                    <= np.abs(otime - seed)):
+                continue
+            matched[row % n] = ('P' if row < n else 'S', otime)
+        origin_time = np.mean([x[1] for x in matched.values()])
+        phases = [(i, phase, otime - origin_time)
+                  for i, (phase, otime) in sorted(matched.items())]
+        return {'node': node, 'origin_time': t0 + origin_time,
+                'n_phases': len(phases), 'phases': phases}
+
+    def hypocenter(self, node):
+        """
+        Return a grid node's latitude, longitude and depth (km)
+        """
+        return (self.latitudes[node], self.longitudes[node],
+                self.depths[node])
+
+
+def station_coordinates(inventory):
+    """
+    Return the coordinates of an Inventory's stations
+
+    :param inventory: obspy Inventory
+    :returns: dict with key=station code, value=(latitude, longitude).
+        If a station code is in several networks, the first one is used
+    """
+    coordinates = {}
+    for net in inventory:
+        for sta in net:
+            coordinates.setdefault(sta.code, (sta.latitude, sta.longitude))
+    return coordinates
+
+
+def _project(lats, lons, lat0, lon0):
+    """
+    Return x (east) and y (north) distances (km) from (lat0, lon0)
+    """
+    x = (np.asarray(lons) - lon0) * KM_PER_DEGREE * np.cos(np.radians(lat0))
+    y = (np.asarray(lats) - lat0) * KM_PER_DEGREE
+    return x, y
+
+
+def _unproject(x, y, lat0, lon0):
+    """
+    Return the latitudes and longitudes of x, y distances from (lat0, lon0)
+    """
+    lats = lat0 + np.asarray(y) / KM_PER_DEGREE
+    lons = lon0 + np.asarray(x) / (KM_PER_DEGREE * np.cos(np.radians(lat0)))
+    return lats, lons
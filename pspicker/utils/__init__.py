@@ -1,9 +1,12 @@
 """
 These routines should never need to be called by the user
 """
+from .array_trace import ArrayTrace, as_trace
 from .pick_utils import picks_matched_stations, picks_ps_times
 from .select_traces import select_traces
-from .smooth_filter import smooth_filter
+from .smooth_filter import smooth_filter, central_moving_average
+from .rolling_mean import rolling_mean
 
-__all__ = ['select_traces', 'smooth_filter',
+__all__ = ['ArrayTrace', 'as_trace', 'select_traces', 'smooth_filter',
+           'rolling_mean', 'central_moving_average',
            'picks_matched_stations', 'picks_ps_times']
@@ -0,0 +1,199 @@
+"""
+Lightweight data array + metadata, used instead of obspy Traces internally
+"""
+import math
+
+import numpy as np
+from obspy.core import UTCDateTime
+from obspy.core.trace import Trace
+from obspy.core.compatibility import round_away
+
+
+class ArrayTrace():
+    """
+    Data array with a starttime, sampling rate and seed id
+
+    Used instead of obspy Traces in the kurtosis, SNR and polarity
+    calculations: making a new ArrayTrace, copying or slicing one does not
+    deep-copy a Stats object and its processing history.
+
+    Has the Trace attributes and methods used in those calculations
+    (stats.starttime, stats.endtime, stats.sampling_rate, stats.delta,
+    stats.npts, stats.channel..., copy(), slice(), trim(), times()).
+    slice() and trim() select the same samples as for a Trace.
+    Use to_trace() to plot or write.
+    """
+    def __init__(self, data, starttime, sampling_rate, network='',
+                 station='', location='', channel=''):
+        """
+        :param data: data array (not copied)
+        :param starttime: time of the first sample
+        :type starttime: UTCDateTime
+        :param sampling_rate: sampling rate (Hz)
+        """
+        self.data = data
+        self.starttime = starttime
+        self.sampling_rate = float(sampling_rate)
+        self.network = network
+        self.station = station
+        self.location = location
+        self.channel = channel
+
+    @classmethod
+    def from_trace(cls, trace):
+        """
+        Return an ArrayTrace using (not copying) an obspy Trace's data
+
+        :param trace: obspy Trace
+        """
+        s = trace.stats
+        return cls(trace.data, s.starttime, s.sampling_rate, s.network,
+                   s.station, s.location, s.channel)
+
+    def to_trace(self):
+        """
+        Return an obspy Trace using (not copying) the data
+        """
+        return Trace(self.data, header={'starttime': self.starttime,
+                                        'sampling_rate': self.sampling_rate,
+                                        'network': self.network,
+                                        'station': self.station,
+                                        'location': self.location,
+                                        'channel': self.channel})
+
+    def __str__(self):
+        return (f'{self.id} | {self.starttime} - {self.endtime} | '
+                f'{self.sampling_rate:.1f} Hz, {self.npts:d} samples')
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def stats(self):
+        """
+        The metadata, accessed as for an obspy Trace
+        """
+        return self
+
+    @property
+    def id(self):
+        return '.'.join([self.network, self.station, self.location,
+                         self.channel])
+
+    @property
+    def npts(self):
+        return len(self.data)
+
+    @property
+    def delta(self):
+        return 1.0 / self.sampling_rate
+
+    @property
+    def endtime(self):
+        if self.npts == 0:
+            return self.starttime
+        return self.starttime + float(self.npts - 1) * self.delta
+
+    def with_data(self, data, starttime=None):
+        """
+        Return an ArrayTrace with the same metadata and different data
+
+        :param data: new data array (not copied)
+        :param starttime: new starttime (None: keep the same)
+        """
+        if starttime is None:
+            starttime = self.starttime
+        return ArrayTrace(data, starttime, self.sampling_rate, self.network,
+                          self.station, self.location, self.channel)
+
+    def copy(self):
+        """
+        Return a copy, with a copy of the data
+        """
+        return self.with_data(self.data.copy())
+
+    def slice(self, starttime=None, endtime=None, nearest_sample=True):
+        """
+        Return an ArrayTrace with a view of the data between two times
+        """
+        return self.with_data(self.data).trim(starttime, endtime,
+                                              nearest_sample)
+
+    def trim(self, starttime=None, endtime=None, nearest_sample=True):
+        """
+        Cut to the given start and end times (no padding)
+
+        :returns: self
+        """
+        if (isinstance(starttime, UTCDateTime)
+                and isinstance(endtime, UTCDateTime)
+                and starttime > endtime):
+            raise ValueError("startime is larger than endtime")
+        if starttime:
+            self._ltrim(starttime, nearest_sample)
+        if endtime:
+            self._rtrim(endtime, nearest_sample)
+        return self
+
+    def _ltrim(self, starttime, nearest_sample=True):
+        """
+        Cut to the given start time, as obspy's Trace._ltrim(pad=False)
+        """
+        if nearest_sample:
+            delta = int(round_away((starttime - self.starttime)
+                                   * self.sampling_rate))
+        else:
+            delta = int(math.floor(round((self.starttime - starttime)
+                                         * self.sampling_rate, 7))) * -1
+        if delta <= 0:
+            return
+        self.starttime += delta * self.delta
+        if starttime > self.endtime:
+            self.data = self.data[:0]
+        else:
+            self.data = self.data[delta:]
+
+    def _rtrim(self, endtime, nearest_sample=True):
+        """
+        Cut to the given end time, as obspy's Trace._rtrim(pad=False)
+        """
+        if nearest_sample:
+            delta = int(round_away((endtime - self.starttime)
+                                   * self.sampling_rate)) - self.npts + 1
+        else:
+            delta = int(math.floor(round((endtime - self.endtime)
+                                         * self.sampling_rate, 7)))
+        if delta >= 0:
+            return
+        if endtime < self.starttime:
+            self.starttime = self.endtime + delta * self.delta
+            self.data = self.data[:0]
+            return
+        total = len(self.data) + delta
+        if endtime == self.starttime:
+            total = 1
+        self.data = self.data[:total]
+
+    def times(self, type='relative'):
+        """
+        Return the sample times
+
+        :param type: 'relative' (seconds from starttime) or 'timestamp'
+        """
+        time_array = np.arange(self.npts) / self.sampling_rate
+        if type == 'relative':
+            return time_array
+        elif type == 'timestamp':
+            return time_array + self.starttime.timestamp
+        raise ValueError(f'Invalid type: {type}')
+
+
+def as_trace(trace):
+    """
+    Return an obspy Trace from an ArrayTrace or a Trace (unchanged)
+
+    :param trace: ArrayTrace, obspy Trace or None
+    """
+    if isinstance(trace, ArrayTrace):
+        return trace.to_trace()
+    return trace
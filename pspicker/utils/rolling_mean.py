@@ -0,0 +1,35 @@
+import numpy as np
+
+
+def rolling_mean(data, win_samps):
+    """
+    Trailing moving average of each row of an array, using cumulative sums
+
+    Same as lfilter(np.ones(win_samps) / win_samps, 1, data, axis=-1), but
+    the cost does not depend on win_samps.
+
+    Subtracting two running cumulative sums loses all precision in quiet
+    windows that follow a large signal, so the sums are instead restarted
+    every win_samps samples: each window is the sum of the backward
+    cumulative sum of one block and the forward cumulative sum of the next,
+    and no subtraction is done.
+
+    :param data: 1-D or 2-D array (one row per signal)
+    :param win_samps: number of samples in the moving window
+    :returns: array of the same shape as data
+    """
+    n = data.shape[-1]
+    n_blocks = int(np.ceil((n + win_samps - 1) / win_samps))
+    # Leading zeros reproduce lfilter's zero initial conditions
+    padded = np.zeros(data.shape[:-1] + (n_blocks * win_samps,))
+    padded[..., win_samps - 1:win_samps - 1 + n] = data
+    blocks = padded.reshape(data.shape[:-1] + (n_blocks, win_samps))
+    forward = np.cumsum(blocks, axis=-1).reshape(padded.shape)
+    backward = np.cumsum(blocks[..., ::-1], axis=-1)[..., ::-1]
+    backward = backward.reshape(padded.shape)
+    # window i covers padded samples i to i + win_samps - 1 (all of block
+    # i / win_samps if i is a multiple of win_samps)
+    sums = forward[..., win_samps - 1:win_samps - 1 + n].copy()
+    sums[..., ::win_samps] = 0.
+    sums += backward[..., :n]
+    return sums / win_samps
@@ -5,6 +5,8 @@ from scipy.signal import lfilter
 from obspy.core.stream import Stream
 from obspy.core.stream import Trace
 
+from .array_trace import ArrayTrace
+
 
 def smooth_filter(traces, n_smooth):
     """
@@ -12,22 +14,26 @@ def smooth_filter(traces, n_smooth):
 
     Uses the scipy.signal.lfilter() function
 
-    :param traces_in: trace of list of traces
+    :param traces_in: trace (obspy Trace or ArrayTrace) or list of traces
     :param n_smooth: size of the smoothing window in SAMPLES
     :returns: smoothed data
     """
     n_smooth = int(n_smooth)
     bare_trace = False
-    if isinstance(traces, Trace):
+    if isinstance(traces, (Trace, ArrayTrace)):
         traces = [traces]
         bare_trace = True
     assert isinstance(traces, list) or isinstance(traces, Stream)
 
     smoothed_traces = []
     for tr in traces:
-        smooth_tr = tr.copy()
-        smooth_tr.data = lfilter(np.divide(np.ones(n_smooth), n_smooth),
-                                 1., tr.data)
+        smoothed = lfilter(np.divide(np.ones(n_smooth), n_smooth), 1.,
+                           tr.data)
+        if isinstance(tr, ArrayTrace):
+            smooth_tr = tr.with_data(smoothed)
+        else:
+            smooth_tr = tr.copy()
+            smooth_tr.data = smoothed
         smoothed_traces.append(smooth_tr)
     if len(smoothed_traces) == 0:
         return None
@@ -36,5 +42,29 @@ def smooth_filter(traces, n_smooth):
     return smoothed_traces
 
 
+def central_moving_average(data, half_width):
+    """
+    Central moving average of a 1-D array
+
+    Average of the half_width samples before and the half_width samples
+    after each sample (not the sample itself).  The half_width samples at
+    each end are set to the first and last full averages.  Same as
+    obspy.signal.util.smooth(), without importing obspy.signal (which
+    imports matplotlib)
+
+    :param data: 1-D array
+    :param half_width: number of samples on each side (0: return data)
+    """
+    n = int(half_width)
+    if n <= 0:
+        return data
+    padded = np.hstack(([data[0]] * n, data, [data[-1]] * n))
+    weights = np.ones(n) / (2 * n)
+    out = lfilter(np.hstack((weights, 0, weights)), 1, padded)[2 * n:]
+    out[:n] = out[n]
+    out[len(out) - n:] = out[len(out) - n - 1]
+    return out
+
+
 if __name__ == '__main__':
     pass
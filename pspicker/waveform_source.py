@@ -0,0 +1,234 @@
+"""
+Waveform sources: where the picker gets each event's waveforms from
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from obspy.core import read as obspy_read
+from obspy.io.nordic.core import read_nordic
+
+from .logger import log
+
+
+class WaveformRequest():
+    """
+    The waveforms wanted for one event
+    """
+    def __init__(self, sfile, event_time=None, wavefiles=None):
+        """
+        :param sfile: database file of the event
+        :param event_time: event (or first pick window) time
+        :type event_time: UTCDateTime
+        :param wavefiles: waveform file names listed in the database file
+        """
+        self.sfile = sfile
+        self.event_time = event_time
+        self.wavefiles = wavefiles if wavefiles is not None else []
+
+    def __str__(self):
+        return (f'WaveformRequest: {self.sfile}, event_time={self.event_time}'
+                f', wavefiles={self.wavefiles}')
+
+    @classmethod
+    def from_sfile(cls, sfile, index=None):
+        """
+        Make a request from a NORDIC database file
+
+        :param sfile: database file
+        :param index: DatabaseIndex to look the file up in before parsing it
+        """
+        if index is not None:
+            info = index.get(sfile)
+            if info is not None:
+                return cls(sfile, info['event_time'], info['wavefiles'])
+        cat, wav_names = read_nordic(str(sfile), return_wavnames=True)
+        assert len(wav_names) == 1, 'More than one wav_name in database file'
+        event = cat[0]
+        origin = event.preferred_origin() or (event.origins[0]
+                                              if len(event.origins) > 0
+                                              else None)
+        return cls(sfile, origin.time if origin is not None else None,
+                   wav_names[0])
+
+
+class WaveformSource():
+    """
+    Base class for waveform sources
+
+    Subclasses implement get() or get_many(), which return, for each
+    WaveformRequest, a (stream, wavefile) tuple: wavefile is the waveform
+    file name to write in the output database file (None: none).
+    Sources of continuous data also implement get_window()
+    """
+    def get(self, request):
+        """
+        Return the waveforms for one event
+
+        :param request: WaveformRequest
+        :returns: stream, wavefile
+        """
+        return self.get_many([request])[0]
+
+    def get_many(self, requests):
+        """
+        Return the waveforms for several events
+
+        :param requests: list of WaveformRequests
+        :returns: list of (stream, wavefile)
+        """
+        return [self.get(r) for r in requests]
+
+    def get_window(self, starttime, endtime):
+        """
+        Return all the waveforms in a time window (for continuous data)
+
+        :param starttime: first time
+        :param endtime: last time
+        :returns: stream
+        """
+        raise NotImplementedError(
+            f'{self.__class__.__name__} has no continuous data')
+
+    def prefetch(self, requests, batch_size=1):
+        """
+        Yield each event's waveforms, reading ahead in a background thread
+
+        The next batch of events is read (using get_many()) while the
+        current batch is being processed.
+
+        :param requests: list of WaveformRequests
+        :param batch_size: number of events to read in one call
+        :returns: generator of (request, (stream, wavefile)).  If reading
+            an event failed, the Exception is given instead of
+            (stream, wavefile)
+        """
+        batches = [requests[i:i + batch_size]
+                   for i in range(0, len(requests), batch_size)]
+        if len(batches) == 0:
+            return
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(self._get_batch, batches[0])
+            for i, batch in enumerate(batches):
+                results = future.result()
+                if i + 1 < len(batches):
+                    future = executor.submit(self._get_batch, batches[i + 1])
+                yield from zip(batch, results)
+
+    def _get_batch(self, requests):
+        """
+        Return get_many(requests), or each request's result or Exception
+        """
+        try:
+            return self.get_many(requests)
+        except Exception as err:
+            if len(requests) == 1:
+                return [err]
+        log(f'Could not read {len(requests):d} events in one request, '
+            'reading them one by one', 'verbose')
+        results = []
+        for r in requests:
+            try:
+                results.append(self.get(r))
+            except Exception as err:
+                results.append(err)
+        return results
+
+
+class SEISANSource(WaveformSource):
+    """
+    One miniSEED file per event, in a SEISAN WAV/YEAR/MONTH/ directory
+
+    The file name is read from the database file
+    """
+    def __init__(self, wav_base_path):
+        """
+        :param wav_base_path: absolute basepath to the waveform files (just
+            before the YEAR/MONTH subdirectories)
+        """
+        self.wav_base_path = Path(wav_base_path)
+
+    def __str__(self):
+        return f'SEISANSource: {self.wav_base_path}'
+
+    def get(self, request):
+        assert len(request.wavefiles) > 0, \
+            f'No waveform file in {request.sfile}'
+        wav_name = request.wavefiles[0]
+        pts = wav_name.split('-')
+        full_wavefile = str(self.wav_base_path / pts[0] / pts[1] / wav_name)
+        stream = obspy_read(full_wavefile, 'MSEED')
+        # get rid of bad last sample in some streams
+        for tr in stream:
+            tr.data = tr.data[:-10]
+        return stream, full_wavefile
+
+
+class ClientSource(WaveformSource):
+    """
+    Waveforms from an obspy Client (FDSN, SDS, seedlink...)
+
+    Reads from event_time - pre_event to event_time + post_event.  Several
+    events are read in one get_waveforms_bulk() request.
+    """
+    def __init__(self, client, pre_event=60., post_event=120., network='*',
+                 station='*', location='*', channel='*'):
+        """
+        :param client: obspy Client with a get_waveforms_bulk() method
+        :param pre_event: seconds to read before the event time
+        :param post_event: seconds to read after the event time
+        :param network: network code(s) to read (wildcards allowed)
+        :param station: station code(s) to read (wildcards allowed)
+        :param location: location code(s) to read (wildcards allowed)
+        :param channel: channel code(s) to read (wildcards allowed)
+        """
+        self.client = client
+        self.pre_event = pre_event
+        self.post_event = post_event
+        self.nslc = (network, station, location, channel)
+
+    def __str__(self):
+        return (f'{self.__class__.__name__}: {self.client}, '
+                f'{".".join(self.nslc)}, -{self.pre_event:g}s to '
+                f'+{self.post_event:g}s')
+
+    def _window(self, request):
+        assert request.event_time is not None, \
+            f'No event time in {request.sfile}'
+        return (request.event_time - self.pre_event,
+                request.event_time + self.post_event)
+
+    def get_many(self, requests):
+        windows = [self._window(r) for r in requests]
+        stream = self.client.get_waveforms_bulk(
+            [(*self.nslc, t1, t2) for t1, t2 in windows])
+        results = []
+        for r, (t1, t2) in zip(requests, windows):
+            st = stream.slice(t1, t2).copy()
+            st.merge(method=1, fill_value='interpolate')
+            wavefile = r.wavefiles[0] if len(r.wavefiles) > 0 else None
+            results.append((st, wavefile))
+        return results
+
+    def get_window(self, starttime, endtime):
+        stream = self.client.get_waveforms(*self.nslc, starttime, endtime)
+        stream.merge(method=1, fill_value='interpolate')
+        return stream
+
+
+class SDSSource(ClientSource):
+    """
+    Waveforms from a SeisComP Data Structure (SDS) archive
+    """
+    def __init__(self, sds_root, **kwargs):
+        """
+        :param sds_root: SDS archive root directory
+        :param kwargs: ClientSource arguments (pre_event, post_event,
+            network, station, location, channel)
+        """
+        from obspy.clients.filesystem.sds import Client
+        super().__init__(Client(str(sds_root)), **kwargs)
+        self.sds_root = sds_root
+
+    def __str__(self):
+        return (f'SDSSource: {self.sds_root}, {".".join(self.nslc)}, '
+                f'-{self.pre_event:g}s to +{self.post_event:g}s')
@@ -20,7 +20,7 @@ setuptools.setup(
     include_package_data=True,
     install_requires=[
           'obspy>=1.2',
-          'numpy>=1.18',
+          'numpy>=1.20',
           'scipy>=1.5',
           'verboselogs>=1.7',
           'matplotlib>=3.2',